@@ -0,0 +1,316 @@
+#-*- coding:utf-8 -*-
+
+"""
+PCAP 引擎数据包解析热点路径基准测试
+使用 dpkt 构造合成流量，分别测量 pkt_decode、decode_request、decode_response、decode_chunked、
+decode_body、parse_headers 各阶段及端到端（run，安装 NumPy 时另测不同批量大小的批量筛选模式）的耗时，并与保存的基准结果对比，超出容差时以非0状态退出。
+测试前先检查跨多个分段的分块响应在启用重组时能收集到结束分块或重组上限，结果不正确时以非0状态退出。
+不需要网卡权限，可在任意 Linux 主机上运行。
+
+用法：
+python3 bench/bench_decode.py              # 与 bench/baseline.json 对比，基准结果不存在时以非0状态退出
+python3 bench/bench_decode.py -s           # 将本次结果保存为基准
+python3 bench/bench_decode.py -t 0.3       # 容差 30%
+python3 bench/bench_decode.py -n 20000     # 会话数量（默认 2000）
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import getopt
+import socket
+import dpkt
+import brotli
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from lib._http_tcp_pcap import tcp_http_pcap
+from lib._msg_queue import msg_queue
+from lib._batch_triage import numpy
+
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baseline.json')
+# 批量筛选模式测试的批量大小
+BATCH_SIZES = (16, 64, 256, 1024)
+
+http_filter = {
+	"response_code": ['304', '400', '404'],
+	"content_type": ['audio/', 'video/', 'image/', 'font/', 'application/pdf', 'application/msword', 'application/javascript', 'text/javascript', 'text/css']
+}
+
+HTML_BODY = ('<html><head><title>passets benchmark</title></head><body>' + '<p>asset fingerprint sample line</p>' * 30 + '</body></html>').encode()
+CJK_TEXT = '<html><head><title>资产测试页面</title></head><body>' + '<p>被动资产识别测试数据</p>' * 30 + '</body></html>'
+JP_TEXT = '<html><head><title>資産テスト</title></head><body>' + '<p>パッシブ資産識別のテストデータ</p>' * 30 + '</body></html>'
+
+def chunked(data, size=64):
+	"""将数据按 Transfer-Encoding: chunked 格式分块"""
+	out = b''
+	for i in range(0, len(data), size):
+		part = data[i:i + size]
+		out += b'%x\r\n%s\r\n' % (len(part), part)
+	return out + b'0\r\n\r\n'
+
+def http_response(headers, body, status=b'200 OK'):
+	return b'HTTP/1.1 ' + status + b'\r\n' + b'\r\n'.join(headers) + b'\r\nServer: nginx/1.16.1\r\n\r\n' + body
+
+# 响应样本：名称 -> 完整响应报文
+RESPONSES = {
+	'plain': http_response([b'Content-Type: text/html; charset=utf-8', b'Content-Length: %d' % len(HTML_BODY)], HTML_BODY),
+	'chunked': http_response([b'Content-Type: text/html', b'Transfer-Encoding: chunked'], chunked(HTML_BODY)),
+	'gzip': http_response([b'Content-Type: text/html', b'Content-Encoding: gzip'], gzip.compress(HTML_BODY)),
+	'brotli': http_response([b'Content-Type: text/html', b'Content-Encoding: br'], brotli.compress(HTML_BODY)),
+	'gbk': http_response([b'Content-Type: text/html; charset=gbk'], CJK_TEXT.encode('gbk')),
+	'shift_jis': http_response([b'Content-Type: text/html; charset=shift_jis'], JP_TEXT.encode('shift_jis')),
+	'not_modified': http_response([b'Content-Type: text/html'], b'', b'304 Not Modified'),
+}
+
+BANNER = b'J\x00\x00\x00\n5.7.31-log\x00\x0b\x00\x00\x00mysql_native_password\x00'
+
+def build_frame(src, sport, dst, dport, seq, ack, flags, data=b''):
+	tcp = dpkt.tcp.TCP(sport=sport, dport=dport, seq=seq, ack=ack, flags=flags, data=data)
+	ip = dpkt.ip.IP(src=socket.inet_aton(src), dst=socket.inet_aton(dst), p=dpkt.ip.IP_PROTO_TCP, ttl=64, data=tcp)
+	ip.len = len(ip)
+	eth = dpkt.ethernet.Ethernet(src=b'\x00\x0c\x29\x00\x00\x01', dst=b'\x00\x0c\x29\x00\x00\x02', type=dpkt.ethernet.ETH_TYPE_IP, data=ip)
+	return bytes(eth)
+
+def build_flows(flow_num):
+	"""
+	构造 flow_num 条会话，每条会话的服务端地址、URL 和序列号互不相同，避免被去重缓存过滤
+	:return: 帧列表，以及 (请求, 响应) 报文列表
+	"""
+	frames = []
+	messages = []
+	names = sorted(RESPONSES)
+	for i in range(flow_num):
+		client = '10.0.{}.{}'.format(i // 250 % 250, i % 250 + 1)
+		server = '172.16.{}.{}'.format(i // 250 % 250, i % 250 + 1)
+		cport = 20000 + i % 40000
+		c_isn = (i * 7919 * 65536) & 0xffffffff
+		s_isn = (i * 104729 * 65536 + 12345) & 0xffffffff
+		# 每 8 条会话中 1 条为 TCP Banner（服务端先发数据）
+		if i % 8 == 7:
+			frames.append(build_frame(server, 3306, client, cport, s_isn, c_isn + 1, 0x12))
+			frames.append(build_frame(server, 3306, client, cport, s_isn + 1, c_isn + 1, 0x18, BANNER))
+			continue
+
+		name = names[i % len(names)]
+		request = 'GET /{}/{}.html HTTP/1.1\r\nHost: www.site{}.com\r\nUser-Agent: bench\r\nAccept: */*\r\n\r\n'.format(name, i, i).encode()
+		response = RESPONSES[name]
+		frames.append(build_frame(server, 80, client, cport, s_isn, c_isn + 1, 0x12))
+		frames.append(build_frame(client, cport, server, 80, c_isn + 1, s_isn + 1, 0x10))
+		frames.append(build_frame(client, cport, server, 80, c_isn + 1, s_isn + 1, 0x18, request))
+		frames.append(build_frame(server, 80, client, cport, s_isn + 1, c_isn + 1 + len(request), 0x18, response))
+		frames.append(build_frame(client, cport, server, 80, c_isn + 1 + len(request), s_isn + 1 + len(response), 0x10))
+		messages.append((request, response))
+	return frames, messages
+
+def add_acks(frames, ack_num=8):
+	"""
+	在每个帧之后插入 ack_num 个无数据的 ACK，模拟大流量下以纯 ACK 为主的流量
+	"""
+	ack = build_frame('10.255.0.1', 40000, '172.31.0.1', 443, 1, 1, 0x10)
+	result = []
+	for frame in frames:
+		result.append(frame)
+		result.extend([ack] * ack_num)
+	return result
+
+class frame_source():
+	"""代替 pcap 句柄向 run() 提供数据包"""
+
+	def __init__(self, frames):
+		self.frames = frames
+
+	def __iter__(self):
+		ts = time.time()
+		for frame in self.frames:
+			yield ts, frame
+
+	def close(self):
+		pass
+
+def new_engine(queue_size, batch_size=0):
+	return tcp_http_pcap(queue_size, msg_queue(queue_size), None, 'bench', True, http_filter, 65536, 65536, 'tcp', 1000, False, batch_size=batch_size)
+
+def segment_flow(index, response, segment_size=1300):
+	"""
+	构造一条响应被拆分为多个 segment_size 字节分段的 HTTP 会话
+	"""
+	client = '10.254.0.{}'.format(index + 1)
+	server = '172.30.0.{}'.format(index + 1)
+	cport = 50000 + index
+	request = 'GET /segment/{}.html HTTP/1.1\r\nHost: www.segment{}.com\r\n\r\n'.format(index, index).encode()
+	frames = [
+		build_frame(server, 80, client, cport, 1000, 2001, 0x12),
+		build_frame(client, cport, server, 80, 2001, 1001, 0x18, request)
+	]
+	for offset in range(0, len(response), segment_size):
+		frames.append(build_frame(server, 80, client, cport, 1001 + offset, 2001 + len(request), 0x10, response[offset:offset + segment_size]))
+	return frames
+
+def check_reassembly(reassembly_size=64*1024, segment_size=1300):
+	"""
+	检查分块响应的重组：首个分块（0x20000 字节）超过重组上限时应收集到上限，
+	分块跨越多个分段但总长度未超过上限时应收集到结束分块，均不能在首个分段后提前输出
+	:return: 错误信息列表
+	"""
+	headers = [b'Content-Type: text/html', b'Transfer-Encoding: chunked']
+	large_body = b'x' * 0x20000
+	small_body = HTML_BODY * 4
+	cases = (
+		('chunked_capped', http_response(headers, b'20000\r\n' + large_body + b'\r\n0\r\n\r\n'), 'capped', reassembly_size // 2),
+		('chunked_complete', http_response(headers, chunked(small_body, 3000)), 'complete', len(small_body))
+	)
+	errors = []
+	for index, (name, response, reason, body_len) in enumerate(cases):
+		engine = tcp_http_pcap(16, msg_queue(16), None, 'bench', True, {}, 1000, 1000, 'tcp', 1000, False, max_body_size=reassembly_size, reassembly_size=reassembly_size)
+		engine.sniffer = frame_source(segment_flow(index, response, segment_size))
+		engine.run()
+		stats = engine.reassembler.get_stats()
+		messages = [json.loads(msg) if isinstance(msg, str) else msg for msg in engine.work_queue.get_batch()]
+		bodies = [len(msg.get('body', '')) for msg in messages if msg.get('url')]
+		if stats[reason] != 1 or not bodies or bodies[0] < body_len:
+			errors.append('{}: reassembly {}, body {}'.format(name, stats, bodies))
+	return errors
+
+def measure(func, op_num, repeat=5, min_time=0.2):
+	"""
+	多次执行 func 取最快一轮，返回每次操作的耗时（纳秒）
+	:param func: 被测函数，每次调用执行 op_num 次操作
+	"""
+	best = None
+	for _ in range(repeat):
+		loops = 0
+		start = time.perf_counter()
+		while True:
+			func()
+			loops += 1
+			used = time.perf_counter() - start
+			if used >= min_time:
+				break
+		per_op = used * 1e9 / (loops * op_num)
+		best = per_op if best is None else min(best, per_op)
+	return best
+
+def run_benchmarks(flow_num=2000):
+	frames, messages = build_flows(flow_num)
+	engine = new_engine(len(frames))
+	results = {}
+
+	results['pkt_decode'] = measure(lambda: [engine.pkt_decode(frame) for frame in frames], len(frames))
+
+	requests = [request for request, response in messages]
+	results['decode_request'] = measure(lambda: [engine.decode_request(request, '172.16.0.1', '80') for request in requests], len(requests))
+
+	for name, response in sorted(RESPONSES.items()):
+		results['decode_response.' + name] = measure(lambda: engine.decode_response(response), 1)
+
+	results['decode_response_header'] = measure(lambda: engine.decode_response_header(RESPONSES['gzip']), 1)
+
+	chunked_body = chunked(HTML_BODY)
+	results['decode_chunked'] = measure(lambda: engine.decode_chunked(chunked_body), 1)
+	results['decode_body.utf-8'] = measure(lambda: engine.decode_body(HTML_BODY, 'text/html; charset=utf-8'), 1)
+	gbk_body = CJK_TEXT.encode('gbk')
+	results['decode_body.gbk'] = measure(lambda: engine.decode_body(gbk_body, 'text/html; charset=gbk'), 1)
+	header_str = str(RESPONSES['plain'].split(b'\r\n\r\n')[0], 'utf-8')
+	header_str = header_str[header_str.find('\r\n') + 2:]
+	results['parse_headers'] = measure(lambda: engine.parse_headers(header_str), 1)
+
+	# 端到端：每轮使用新的引擎对象，保证会话与去重缓存状态一致
+	def end_to_end():
+		e2e_engine = new_engine(len(frames))
+		e2e_engine.sniffer = frame_source(frames)
+		e2e_engine.run()
+	results['run.end_to_end'] = measure(end_to_end, len(frames), repeat=3)
+
+	# 批量筛选模式：分别使用原有流量和以纯 ACK 为主的流量，batch_size 为0时逐包处理
+	ack_frames = add_acks(frames)
+	if numpy is not None:
+		for name, test_frames in (('run.batch', frames), ('run.ack_heavy', ack_frames)):
+			for batch_size in (0,) + BATCH_SIZES:
+				if not batch_size and name == 'run.batch':
+					continue
+				def end_to_end_batch():
+					e2e_engine = new_engine(len(test_frames), batch_size)
+					e2e_engine.sniffer = frame_source(test_frames)
+					e2e_engine.run()
+				results['{}_{}'.format(name, batch_size)] = measure(end_to_end_batch, len(test_frames), repeat=3)
+
+	return results
+
+def compare(results, baseline, tolerance):
+	"""
+	与基准结果对比，耗时超出 (1 + tolerance) 倍视为性能回退
+	:return: 回退的测试项列表
+	"""
+	regressions = []
+	print('{:<28}{:>14}{:>14}{:>10}'.format('benchmark', 'ns/op', 'baseline', 'change'))
+	for name, value in results.items():
+		base = baseline.get(name)
+		if base:
+			change = (value - base) * 100 / base
+			flag = ''
+			if value > base * (1 + tolerance):
+				regressions.append(name)
+				flag = '  REGRESSION'
+			print('{:<28}{:>14.1f}{:>14.1f}{:>9.1f}%{}'.format(name, value, base, change, flag))
+		else:
+			print('{:<28}{:>14.1f}{:>14}{:>10}'.format(name, value, '-', '-'))
+	return regressions
+
+def Usage():
+	print(__doc__)
+	sys.exit()
+
+if __name__ == '__main__':
+	save = False
+	tolerance = 0.25
+	baseline_file = BASELINE_FILE
+	flow_num = 2000
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], 'st:b:n:h')
+	except getopt.GetoptError:
+		Usage()
+	for o, a in opts:
+		if o == '-s':
+			save = True
+		if o == '-t':
+			tolerance = float(a)
+		if o == '-b':
+			baseline_file = str(a)
+		if o == '-n':
+			flow_num = int(a)
+		if o == '-h':
+			Usage()
+
+	errors = check_reassembly()
+	if errors:
+		for error in errors:
+			print('[!] Reassembly check failed, {}'.format(error))
+		sys.exit(1)
+	print('[+] Reassembly check passed')
+
+	# 没有基准结果时无法判断性能回退，需先在目标硬件上使用 -s 生成
+	if not save and not os.path.isfile(baseline_file):
+		print('[!] Baseline not found: {}, run with -s on the target hardware first'.format(baseline_file))
+		sys.exit(1)
+
+	results = run_benchmarks(flow_num)
+	baseline = {}
+	if os.path.isfile(baseline_file):
+		with open(baseline_file) as f:
+			baseline = json.load(f)
+	regressions = compare(results, baseline, tolerance)
+	for name, value in results.items():
+		if name.startswith('run.'):
+			print('[*] {:<24}{:>12.0f} pkt/s'.format(name, 1e9 / value))
+
+	if save:
+		with open(baseline_file, 'w') as f:
+			json.dump(results, f, indent=2, sort_keys=True)
+		print('[+] Baseline saved: {}'.format(baseline_file))
+	elif regressions:
+		print('[!] Performance regression: {}'.format(', '.join(regressions)))
+		sys.exit(1)
@@ -0,0 +1,95 @@
+#-*- coding:utf-8 -*-
+
+import heapq
+from ._packet import ip_addr
+
+# 只捕获 SYN-ACK 和携带数据的分段，纯 ACK 在内核中丢弃
+SYN_ACK_FILTER = 'tcp[tcpflags] & (tcp-syn|tcp-ack) = (tcp-syn|tcp-ack)'
+PAYLOAD_FILTER = '(ip[2:2] - ((ip[0] & 0xf) << 2) - ((tcp[12] & 0xf0) >> 2)) != 0'
+# 排除条件过多会超出 BPF 指令数上限
+MAX_EXCLUDE = 256
+
+class adaptive_filter():
+	"""
+	自适应 BPF 过滤器：统计各服务端 IP:端口的数据包数量，定期将流量最大、且仍在去重缓存有效期内的已知服务
+	从内核过滤器中排除，有效期结束后恢复捕获，使采集负载随新资产数量而不是带宽增长
+	只有已上报的 TCP 服务（tcp_cache 中的键）会被排除，HTTP 服务按 URL 去重，仍然捕获以发现新的 URL
+	"""
+
+	def __init__(self, bpf_filter, top_num):
+		"""
+		构造函数
+		:param bpf_filter: 原有的过滤器
+		:param top_num: 最多排除的服务数量
+		"""
+		self.bpf_filter = bpf_filter
+		self.top_num = min(top_num, MAX_EXCLUDE)
+		# 服务端 IP:端口 整数 -> 排除的截止时间
+		self.excluded = {}
+		self.stats = {
+			'recompile': 0,
+			'exclude': 0,
+			'restore': 0,
+			'error': 0
+		}
+
+	def base_filter(self):
+		capture = '({} or {})'.format(SYN_ACK_FILTER, PAYLOAD_FILTER)
+		if self.bpf_filter:
+			return '({}) and {}'.format(self.bpf_filter, capture)
+		return 'tcp and {}'.format(capture)
+
+	def compile(self):
+		"""
+		:return: 当前的过滤器表达式
+		"""
+		if not self.excluded:
+			return self.base_filter()
+		exclude = ' or '.join('(host {} and port {})'.format(ip_addr(key >> 16), key & 0xffff) for key in sorted(self.excluded))
+		return '{} and not ({})'.format(self.base_filter(), exclude)
+
+	def update(self, counter, cache, now):
+		"""
+		按本周期的数据包计数更新排除列表
+		:param counter: 服务端 IP:端口 整数 -> 数据包数量
+		:param cache: 服务的去重缓存（tcp_cache），提供 expire_time
+		:param now: 当前时间
+		:return: 排除列表有变化时返回新的过滤器表达式，否则返回 None
+		"""
+		changed = False
+		for key, expire_time in list(self.excluded.items()):
+			if expire_time <= now:
+				del self.excluded[key]
+				self.stats['restore'] += 1
+				changed = True
+
+		free_num = self.top_num - len(self.excluded)
+		if free_num > 0 and counter:
+			for key in heapq.nlargest(free_num * 4, counter, key=counter.get):
+				if free_num <= 0:
+					break
+				if key in self.excluded:
+					continue
+				expire_time = cache.expire_time(key)
+				if expire_time is not None and expire_time > now:
+					self.excluded[key] = expire_time
+					self.stats['exclude'] += 1
+					free_num -= 1
+					changed = True
+
+		if not changed:
+			return None
+		self.stats['recompile'] += 1
+		return self.compile()
+
+	def reset(self):
+		"""
+		过滤器编译失败时清空排除列表
+		"""
+		self.excluded.clear()
+		self.stats['error'] += 1
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['excluded'] = len(self.excluded)
+		return stats
@@ -0,0 +1,166 @@
+#-*- coding:utf-8 -*-
+
+import socket
+import queue
+import threading
+import time
+from ._dedup_cache import new_dedup_cache
+
+# linux/if_packet.h
+SOL_PACKET = 263
+PACKET_FANOUT = 18
+PACKET_FANOUT_HASH = 0
+PACKET_FANOUT_FLAG_DEFRAG = 0x8000
+# 发送队列压力达到该值后暂停汇总
+FORWARD_PAUSE = 0.95
+
+def set_packet_fanout(fd, fanout_id):
+	"""
+	将抓包套接字加入 AF_PACKET fanout 组，内核按对称的四元组哈希分发数据包，
+	同一条 TCP 流的双向数据包总是进入同一个采集进程
+	:param fd: 抓包句柄的文件描述符（AF_PACKET 套接字）
+	:param fanout_id: fanout 组ID，同一组内的采集进程共享流量
+	"""
+	sock = socket.fromfd(fd, socket.AF_PACKET, socket.SOCK_RAW)
+	try:
+		fanout_arg = (fanout_id & 0xffff) | ((PACKET_FANOUT_HASH | PACKET_FANOUT_FLAG_DEFRAG) << 16)
+		sock.setsockopt(SOL_PACKET, PACKET_FANOUT, fanout_arg)
+	finally:
+		# 仅关闭 fromfd 复制出的描述符，原抓包句柄不受影响
+		sock.close()
+
+def partition_filter(bpf_filter, index, count):
+	"""
+	生成第 index 个采集进程的 BPF 过滤器：按 IP 地址和端口的异或（与方向无关）取模分区，
+	同一条 TCP 流的双向数据包总是进入同一个进程，各进程的流量互不重叠
+	:param bpf_filter: 原有的过滤器
+	:param index: 进程序号
+	:param count: 进程数量
+	"""
+	flow_hash = 'ip[12:4] ^ ip[16:4] ^ tcp[0:2] ^ tcp[2:2]'
+	# 高位折叠到低位，同一网段内只有末尾字节不同的地址也能均匀分布
+	partition = 'tcp and (({0}) ^ (({0}) >> 8) ^ (({0}) >> 16)) % {1} = {2}'.format(flow_hash, count, index)
+	if bpf_filter:
+		return '({}) and {}'.format(bpf_filter, partition)
+	return partition
+
+class forward_dedup():
+	"""
+	汇总各采集进程结果时的跨进程去重：同一服务或 URL 的不同会话可能分到不同进程，
+	按采集引擎随数据发来的去重键（与引擎 http_cache/tcp_cache 的键相同）在主进程中再去重一次，不解析 JSON
+	"""
+
+	def __init__(self, cache_size, dedup_mode='hash', dedup_fpr=0.001):
+		"""
+		构造函数
+		:param cache_size: 去重缓存大小
+		:param dedup_mode: 去重缓存类型，hash 或 bloom
+		:param dedup_fpr: bloom 去重缓存的误判率
+		"""
+		self.http_cache = new_dedup_cache(dedup_mode, cache_size, ttl=120, fpr=dedup_fpr)
+		self.tcp_cache = new_dedup_cache(dedup_mode, cache_size, ttl=120, fpr=dedup_fpr)
+		self.stats = {
+			'msg': 0,
+			'duplicate': 0
+		}
+
+	def is_duplicate(self, dedup_key):
+		"""
+		:param dedup_key: (协议, 去重键)，协议为 HTTP 时使用 http_cache，否则使用 tcp_cache
+		"""
+		self.stats['msg'] += 1
+		pro, key = dedup_key
+		cache = self.http_cache if pro == 'HTTP' else self.tcp_cache
+		if cache.get(key):
+			self.stats['duplicate'] += 1
+			return True
+		cache.set(key, True)
+		return False
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['http_cache'] = self.http_cache.get_stats()
+		stats['tcp_cache'] = self.tcp_cache.get_stats()
+		return stats
+
+class worker_queue():
+	"""
+	采集子进程使用的发送队列，对外保持与 collections.deque 相同的 append/len/clear 接口，
+	数据通过跨进程队列汇总到主进程的发送线程
+	"""
+
+	def __init__(self, mp_queue, worker_id=None):
+		"""
+		构造函数
+		:param mp_queue: multiprocessing.Queue 跨进程队列
+		:param worker_id: 采集进程序号，用于区分各进程的运行统计
+		"""
+		self.mp_queue = mp_queue
+		self.worker_id = worker_id
+		self.drop_num = 0
+
+	def append(self, msg, dedup_key=None):
+		"""
+		:param msg: 资产数据（JSON 字符串）
+		:param dedup_key: 跨进程去重键 (协议, 键)，与数据一起发往主进程
+		"""
+		try:
+			self.mp_queue.put_nowait((dedup_key, msg))
+		except queue.Full:
+			self.drop_num += 1
+
+	def publish_stats(self, stats):
+		"""
+		将采集进程的运行统计随数据一起发往主进程，由 worker_forward 取出，附带跨进程队列已满时丢弃的数据数量
+		"""
+		stats['worker_queue'] = {'size': len(self), 'drop': self.drop_num}
+		try:
+			self.mp_queue.put_nowait(('stats', self.worker_id, stats))
+		except queue.Full:
+			pass
+
+	def __len__(self):
+		return self.mp_queue.qsize()
+
+	def clear(self):
+		# 跨进程队列无法安全清空，队列已满时由 append 丢弃新数据
+		pass
+
+class worker_forward(threading.Thread):
+	"""
+	主进程中的汇总线程，将各采集子进程的结果转入统一的发送队列
+	"""
+
+	def __init__(self, mp_queue, work_queue, backpressure=False, worker_stats=None, dedup=None):
+		"""
+		构造函数
+		:param mp_queue: multiprocessing.Queue 跨进程队列
+		:param work_queue: 主进程的发送队列
+		:param backpressure: 发送队列接近满时暂停汇总，使数据积压在跨进程队列中，由采集子进程按压力分级丢弃
+		:param worker_stats: 保存各采集进程最新运行统计的字典（进程序号 -> 统计）
+		:param dedup: 跨进程去重（forward_dedup），None 为不去重
+		"""
+		threading.Thread.__init__(self)
+		self.mp_queue = mp_queue
+		self.work_queue = work_queue
+		self.backpressure = backpressure
+		self.worker_stats = worker_stats if worker_stats is not None else {}
+		self.dedup = dedup
+
+	def get_stats(self):
+		return self.dedup.get_stats() if self.dedup is not None else {}
+
+	def run(self):
+		pressure = self.work_queue.pressure if self.backpressure else None
+		while True:
+			item = self.mp_queue.get()
+			if len(item) == 3:
+				# 采集进程的运行统计
+				self.worker_stats[str(item[1])] = item[2]
+				continue
+			dedup_key, msg = item
+			if self.dedup is not None and dedup_key is not None and self.dedup.is_duplicate(dedup_key):
+				continue
+			while pressure is not None and pressure() >= FORWARD_PAUSE:
+				time.sleep(0.01)
+			self.work_queue.append(msg)
@@ -0,0 +1,140 @@
+#-*- coding:utf-8 -*-
+
+import zlib
+import threading
+import brotli
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+# 每次送入解压器的压缩数据长度
+INPUT_STEP = 16 * 1024
+# 旧版 brotli 不支持限制单次输出长度，改为小块送入以控制单次解压的输出
+BROTLI_OUTPUT_LIMIT = 'output_buffer_limit' in (brotli.Decompressor.process.__doc__ or '')
+BROTLI_INPUT_STEP = INPUT_STEP if BROTLI_OUTPUT_LIMIT else 1024
+
+class body_decompressor():
+	"""
+	HTTP 响应正文流式解压，输出达到上限后立即停止，数据不完整或损坏时保留已解压的部分
+	支持 gzip、deflate、br，安装 zstandard 后支持 zstd
+	启用正文处理线程（-W）时由多个线程同时调用，统计计数在锁内更新
+	"""
+
+	def __init__(self, max_size):
+		"""
+		构造函数
+		:param max_size: 解压输出的最大字节数，至少为1（zlib 的 max_length 为0时不限制输出）
+		"""
+		self.max_size = max(max_size, 1)
+		self.stats = {
+			'bytes_in': 0,
+			'bytes_out': 0,
+			'truncated': 0,
+			'error': 0,
+			'unsupported': 0
+		}
+		self.lock = threading.Lock()
+
+	def get_stats(self):
+		with self.lock:
+			return dict(self.stats)
+
+	def decompress(self, data, encoding):
+		"""
+		按 Content-Encoding 解压数据
+		:param data: 压缩数据
+		:param encoding: Content-Encoding 头的值
+		:return: (解压后的数据, 是否因达到上限被截断)；无法解压时返回原始数据
+		"""
+		encoding = encoding.strip().lower()
+		if encoding in ('gzip', 'x-gzip'):
+			out, truncated, error = self.decompress_zlib(data, 16 + zlib.MAX_WBITS)
+		elif encoding == 'deflate':
+			# 规范要求 zlib 封装，部分服务器直接发送裸 deflate 数据
+			zlib_wrapped = len(data) >= 2 and data[0] & 0x0f == 8 and (data[0] << 8 | data[1]) % 31 == 0
+			out, truncated, error = self.decompress_zlib(data, zlib.MAX_WBITS if zlib_wrapped else -zlib.MAX_WBITS)
+		elif encoding == 'br':
+			out, truncated, error = self.decompress_brotli(data)
+		elif encoding == 'zstd' and zstandard:
+			out, truncated, error = self.decompress_zstd(data)
+		else:
+			with self.lock:
+				self.stats['unsupported'] += 1
+			return data, False
+
+		stats = self.stats
+		with self.lock:
+			stats['bytes_in'] += len(data)
+			if error:
+				stats['error'] += 1
+				# 与原有行为保持一致：完全无法解压时返回原始数据
+				if not out:
+					return data, False
+			if truncated:
+				stats['truncated'] += 1
+			stats['bytes_out'] += len(out)
+		return out, truncated
+
+	def decompress_zlib(self, data, wbits):
+		decomp = zlib.decompressobj(wbits)
+		out = []
+		out_len = 0
+		truncated = False
+		error = False
+		try:
+			for pos in range(0, len(data), INPUT_STEP):
+				part = decomp.decompress(data[pos:pos + INPUT_STEP], self.max_size - out_len)
+				out.append(part)
+				out_len += len(part)
+				if decomp.eof:
+					break
+				if out_len >= self.max_size:
+					truncated = True
+					break
+		except zlib.error:
+			error = True
+		return b''.join(out), truncated, error
+
+	def decompress_brotli(self, data):
+		decomp = brotli.Decompressor()
+		out = []
+		out_len = 0
+		truncated = False
+		error = False
+		try:
+			for pos in range(0, len(data), BROTLI_INPUT_STEP):
+				chunk = data[pos:pos + BROTLI_INPUT_STEP]
+				if BROTLI_OUTPUT_LIMIT:
+					part = decomp.process(chunk, output_buffer_limit=self.max_size - out_len)
+				else:
+					part = decomp.process(chunk)
+				out.append(part)
+				out_len += len(part)
+				if decomp.is_finished():
+					break
+				if out_len >= self.max_size:
+					truncated = True
+					break
+		except brotli.error:
+			error = True
+		return b''.join(out)[:self.max_size], truncated, error
+
+	def decompress_zstd(self, data):
+		reader = zstandard.ZstdDecompressor().stream_reader(data)
+		out = []
+		out_len = 0
+		truncated = False
+		error = False
+		try:
+			while out_len < self.max_size:
+				part = reader.read(min(INPUT_STEP * 4, self.max_size - out_len))
+				if not part:
+					break
+				out.append(part)
+				out_len += len(part)
+			if out_len >= self.max_size and reader.read(1):
+				truncated = True
+		except zstandard.ZstdError:
+			error = True
+		return b''.join(out), truncated, error
@@ -0,0 +1,347 @@
+#-*- coding:utf-8 -*-
+
+import os
+import math
+import time
+import array
+import itertools
+import struct
+import hashlib
+
+MASK64 = 0xffffffffffffffff
+# hash_cache 每个键的内存估算值（字典项、整数键、浮点过期时间）
+HASH_ENTRY_SIZE = 112
+
+# 快照文件：文件头（标识、版本、缓存数量），每个缓存一条记录（名称、类型、数据长度、数据）
+SNAPSHOT_MAGIC = b'PSDC'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HASH = 0
+SNAPSHOT_BLOOM = 1
+snapshot_header = struct.Struct('<4sHH')
+snapshot_record = struct.Struct('<16sBI')
+bloom_header = struct.Struct('<IIdQ')
+
+def key_hash(key):
+	"""
+	将去重键转换为 64 位整数：字符串使用 blake2b，整数键（IP:端口等）做位混合使其均匀分布
+	"""
+	if isinstance(key, int):
+		# splitmix64 终结函数
+		key = (key ^ key >> 30) * 0xbf58476d1ce4e5b9 & MASK64
+		key = (key ^ key >> 27) * 0x94d049bb133111eb & MASK64
+		return key ^ key >> 31
+	if isinstance(key, str):
+		key = key.encode('utf-8', 'surrogatepass')
+	return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+def hit_rate(stats):
+	lookup_num = stats['hit'] + stats['miss']
+	return round(stats['hit'] / lookup_num, 4) if lookup_num else 0
+
+class hash_cache():
+	"""
+	去重缓存，只保存键的 64 位哈希和过期时间，内存占用与键的长度无关
+	整数键直接使用，不再计算哈希；接口与 cacheout.Cache 的 get/set 一致
+	"""
+
+	def __init__(self, maxsize, ttl=120, timer=time.time):
+		"""
+		构造函数
+		:param maxsize: 最大条数，超出后淘汰最早写入的键
+		:param ttl: 有效期（单位秒）
+		:param timer: 时间函数
+		"""
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.timer = timer
+		# 键的哈希 -> 过期时间，所有键有效期相同，写入顺序即过期顺序
+		self.table = {}
+		self.stats = {
+			'hit': 0,
+			'miss': 0,
+			'set': 0,
+			'eviction': 0,
+			'expire': 0
+		}
+
+	def get(self, key, default=None):
+		if not isinstance(key, int):
+			key = key_hash(key)
+		expire_time = self.table.get(key)
+		if expire_time is not None:
+			if expire_time > self.timer():
+				self.stats['hit'] += 1
+				return True
+			del self.table[key]
+			self.stats['expire'] += 1
+		self.stats['miss'] += 1
+		return default
+
+	def set(self, key, value=True):
+		if not isinstance(key, int):
+			key = key_hash(key)
+		table = self.table
+		now = self.timer()
+		# 移到末尾，保持按过期时间排列
+		if table.pop(key, None) is None:
+			self.purge(now)
+			if len(table) >= self.maxsize:
+				del table[next(iter(table))]
+				self.stats['eviction'] += 1
+		table[key] = now + self.ttl
+		self.stats['set'] += 1
+
+	def expire_time(self, key):
+		"""
+		键的过期时间，不存在或已过期时返回 None；不计入命中统计
+		"""
+		if not isinstance(key, int):
+			key = key_hash(key)
+		expire_time = self.table.get(key)
+		if expire_time is not None and expire_time > self.timer():
+			return expire_time
+		return None
+
+	def purge(self, now):
+		"""
+		从最早写入的键开始清除已过期的键
+		"""
+		table = self.table
+		while table:
+			key = next(iter(table))
+			if table[key] > now:
+				break
+			del table[key]
+			self.stats['expire'] += 1
+
+	def dump(self):
+		"""
+		导出全部键和过期时间（按过期时间排列）
+		"""
+		keys = array.array('Q', self.table.keys())
+		expire_times = array.array('d', self.table.values())
+		return struct.pack('<I', len(keys)) + keys.tobytes() + expire_times.tobytes()
+
+	def restore(self, payload):
+		"""
+		导入 dump 导出的数据，跳过已过期的键，超出 maxsize 时保留最新的键
+		:return: 导入的键数量
+		"""
+		num = struct.unpack_from('<I', payload)[0]
+		keys = array.array('Q')
+		keys.frombytes(payload[4:4 + num * 8])
+		expire_times = array.array('d')
+		expire_times.frombytes(payload[4 + num * 8:4 + num * 16])
+		now = self.timer()
+		table = self.table
+		restore_num = 0
+		for i in range(max(num - self.maxsize, 0), num):
+			if expire_times[i] > now and keys[i] not in table:
+				table[keys[i]] = expire_times[i]
+				restore_num += 1
+		return restore_num
+
+	def __len__(self):
+		return len(self.table)
+
+	def memory_size(self):
+		return len(self.table) * HASH_ENTRY_SIZE
+
+	def shrink(self, fraction):
+		"""
+		淘汰最早写入的 fraction 比例的键
+		:return: 淘汰的键数量
+		"""
+		table = self.table
+		keys = list(itertools.islice(table, int(len(table) * fraction)))
+		for key in keys:
+			del table[key]
+		self.stats['eviction'] += len(keys)
+		return len(keys)
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['size'] = len(self.table)
+		stats['hit_rate'] = hit_rate(self.stats)
+		return stats
+
+class bloom_cache():
+	"""
+	按时间衰减的 Bloom Filter 去重缓存，由当前、上一代两个位图组成，
+	每 ttl/2 秒（或当前位图写满 capacity 个键）轮换一次，键在写入后 ttl/2 ~ ttl 秒内可查到
+	存在误判（把新资产当作重复），概率不超过 fpr；不会漏判
+	"""
+
+	def __init__(self, capacity, ttl=120, fpr=0.001, timer=time.time):
+		"""
+		构造函数
+		:param capacity: 每一代位图容纳的键数量
+		:param ttl: 有效期（单位秒）
+		:param fpr: 期望的误判率
+		:param timer: 时间函数
+		"""
+		self.capacity = max(int(capacity), 1)
+		self.ttl = ttl
+		self.fpr = fpr
+		self.timer = timer
+		self.bit_num = max(int(-self.capacity * math.log(fpr) / (math.log(2) ** 2)), 64)
+		self.hash_num = max(int(round(self.bit_num / self.capacity * math.log(2))), 1)
+		self.current = bytearray((self.bit_num + 7) // 8)
+		self.previous = bytearray(len(self.current))
+		self.current_num = 0
+		self.rotate_time = self.timer() + self.ttl / 2.0
+		self.stats = {
+			'hit': 0,
+			'miss': 0,
+			'set': 0,
+			'rotate': 0
+		}
+
+	def positions(self, key):
+		# 双重哈希：由 64 位哈希的高、低 32 位生成 hash_num 个位置
+		h = key_hash(key)
+		h1 = h & 0xffffffff
+		h2 = h >> 32 | 1
+		bit_num = self.bit_num
+		return [(h1 + i * h2) % bit_num for i in range(self.hash_num)]
+
+	def rotate(self, now):
+		self.previous = self.current
+		self.current = bytearray(len(self.previous))
+		self.current_num = 0
+		self.rotate_time = now + self.ttl / 2.0
+		self.stats['rotate'] += 1
+
+	def advance(self, now):
+		if now >= self.rotate_time:
+			# 超过一整个周期未轮换时，两代位图都已过期
+			if now >= self.rotate_time + self.ttl / 2.0:
+				self.rotate(now)
+			self.rotate(now)
+
+	def get(self, key, default=None):
+		self.advance(self.timer())
+		positions = self.positions(key)
+		for bits in (self.current, self.previous):
+			if all(bits[pos >> 3] & 1 << (pos & 7) for pos in positions):
+				self.stats['hit'] += 1
+				return True
+		self.stats['miss'] += 1
+		return default
+
+	def expire_time(self, key):
+		"""
+		键至少有效到的时间（下一次轮换），不存在时返回 None；不计入命中统计
+		"""
+		self.advance(self.timer())
+		positions = self.positions(key)
+		if all(self.current[pos >> 3] & 1 << (pos & 7) for pos in positions):
+			return self.rotate_time + self.ttl / 2.0
+		if all(self.previous[pos >> 3] & 1 << (pos & 7) for pos in positions):
+			return self.rotate_time
+		return None
+
+	def set(self, key, value=True):
+		now = self.timer()
+		self.advance(now)
+		if self.current_num >= self.capacity:
+			self.rotate(now)
+		bits = self.current
+		for pos in self.positions(key):
+			bits[pos >> 3] |= 1 << (pos & 7)
+		self.current_num += 1
+		self.stats['set'] += 1
+
+	def dump(self):
+		return bloom_header.pack(self.bit_num, self.hash_num, self.rotate_time, self.current_num) + bytes(self.current) + bytes(self.previous)
+
+	def restore(self, payload):
+		"""
+		导入 dump 导出的位图，位图大小与当前配置（-c、-P）不一致时不导入
+		:return: 当前一代位图中的键数量
+		"""
+		bit_num, hash_num, rotate_time, current_num = bloom_header.unpack_from(payload)
+		size = len(self.current)
+		if bit_num != self.bit_num or hash_num != self.hash_num or len(payload) != bloom_header.size + size * 2:
+			return 0
+		self.current = bytearray(payload[bloom_header.size:bloom_header.size + size])
+		self.previous = bytearray(payload[bloom_header.size + size:])
+		self.current_num = current_num
+		self.rotate_time = rotate_time
+		self.advance(self.timer())
+		return self.current_num
+
+	def __len__(self):
+		return self.current_num
+
+	def memory_size(self):
+		return len(self.current) + len(self.previous)
+
+	def shrink(self, fraction):
+		# 位图大小固定，无法收缩
+		return 0
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['size'] = self.current_num
+		stats['hit_rate'] = hit_rate(self.stats)
+		stats['bytes'] = len(self.current) * 2
+		return stats
+
+def new_dedup_cache(mode, size, ttl=120, fpr=0.001):
+	"""
+	创建去重缓存
+	:param mode: hash - 64 位哈希精确去重；bloom - 按时间衰减的 Bloom Filter
+	:param size: hash 模式为最大条数，bloom 模式为每一代位图容纳的键数量
+	:param ttl: 有效期（单位秒）
+	:param fpr: bloom 模式的误判率
+	"""
+	if mode == 'bloom':
+		return bloom_cache(size, ttl, fpr)
+	return hash_cache(size, ttl)
+
+def save_snapshot(path, caches):
+	"""
+	将去重缓存写入快照文件，先写临时文件再替换，进程中途退出不会留下不完整的快照
+	:param path: 快照文件路径
+	:param caches: 缓存名称 -> 缓存对象
+	"""
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(snapshot_header.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(caches)))
+		for name, cache in caches.items():
+			payload = cache.dump()
+			cache_type = SNAPSHOT_BLOOM if isinstance(cache, bloom_cache) else SNAPSHOT_HASH
+			f.write(snapshot_record.pack(name.encode(), cache_type, len(payload)))
+			f.write(payload)
+	os.replace(tmp_path, path)
+
+def load_snapshot(path, caches):
+	"""
+	从快照文件恢复去重缓存，过期时间按快照中保存的绝对时间恢复；文件不存在、格式不符或缓存类型不同时跳过
+	:param path: 快照文件路径
+	:param caches: 缓存名称 -> 缓存对象
+	:return: 缓存名称 -> 恢复的键数量
+	"""
+	result = {}
+	if not os.path.isfile(path):
+		return result
+	with open(path, 'rb') as f:
+		data = f.read()
+	if len(data) < snapshot_header.size:
+		return result
+	magic, version, cache_num = snapshot_header.unpack_from(data)
+	if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+		return result
+	pos = snapshot_header.size
+	for _ in range(cache_num):
+		if pos + snapshot_record.size > len(data):
+			break
+		name, cache_type, size = snapshot_record.unpack_from(data, pos)
+		pos += snapshot_record.size
+		name = name.rstrip(b'\x00').decode()
+		cache = caches.get(name)
+		if cache is not None and cache_type == (SNAPSHOT_BLOOM if isinstance(cache, bloom_cache) else SNAPSHOT_HASH):
+			result[name] = cache.restore(data[pos:pos + size])
+		pos += size
+	return result
@@ -0,0 +1,169 @@
+#-*- coding:utf-8 -*-
+
+import itertools
+import collections
+
+# 会话键类型：S - SYN-ACK 后等待首个数据包，C - 已缓存请求数据、等待服务端响应
+FLOW_KIND_SYN = 0
+FLOW_KIND_REQ = 1
+
+# 每条会话的内存估算值（有序字典项及链表节点、键、过期时刻和时间轮中的引用），不含缓存的请求数据
+FLOW_ENTRY_SIZE = 260
+# 时间轮中失效引用（已删除、淘汰或重新写入的会话）超过该数量且多于有效会话数时重建时间轮
+MIN_STALE_REBUILD = 1024
+
+def flow_base(client_ip, client_port, server_ip, server_port):
+	"""
+	将按 客户端 -> 服务端 方向排列的四元组打包为一个整数
+	"""
+	return ((client_ip << 16 | client_port) << 32 | server_ip) << 16 | server_port
+
+def flow_key(base, number, kind):
+	"""
+	在四元组整数后拼接 32 位序列号和会话键类型，得到会话表的键
+	:param base: flow_base 的返回值
+	:param number: TCP 序列号或确认号
+	:param kind: FLOW_KIND_SYN 或 FLOW_KIND_REQ
+	"""
+	return (base << 32 | number) << 1 | kind
+
+class flow_table():
+	"""
+	TCP 半开会话表，以 (四元组, 序列号) 整数为键，使用哈希时间轮按秒过期，
+	过期与淘汰均为均摊 O(1)，不在每次查询时读取系统时间
+	删除、淘汰的会话在时间轮中的引用累计超过有效会话数时按会话表重建时间轮，时间轮的大小不超过会话表的约2倍
+	"""
+
+	def __init__(self, maxsize, ttl=30):
+		"""
+		构造函数
+		:param maxsize: 最大会话数，超出后淘汰最早写入的会话
+		:param ttl: 会话有效期（单位秒）
+		"""
+		self.maxsize = maxsize
+		self.ttl = int(ttl)
+		wheel_size = 1
+		while wheel_size <= self.ttl + 1:
+			wheel_size <<= 1
+		self.wheel_mask = wheel_size - 1
+		self.wheel = [[] for _ in range(wheel_size)]
+		# key -> (过期时刻, value)，按写入顺序排列；使用 OrderedDict 使淘汰最早的会话为 O(1)，
+		# 普通 dict 反复删除首项后 next(iter()) 需要跳过前部所有已删除的位置，会话表满时每次写入的开销随会话数增长
+		self.table = collections.OrderedDict()
+		self.current_tick = 0
+		# 时间轮中失效引用的数量
+		self.stale_num = 0
+		self.stats = {
+			'hit': 0,
+			'miss': 0,
+			'set': 0,
+			'collision': 0,
+			'eviction': 0,
+			'expire': 0,
+			'rebuild': 0
+		}
+
+	def advance(self, now):
+		"""
+		推进时间轮，清除已过期的会话，通常以数据包时间戳调用
+		:param now: 当前时间（单位秒）
+		"""
+		tick = int(now)
+		if tick <= self.current_tick:
+			return
+		if not self.current_tick:
+			self.current_tick = tick
+			return
+
+		# 跳过的时间超过一圈时只需处理每个槽一次
+		start_tick = max(self.current_tick + 1, tick - self.wheel_mask)
+		table = self.table
+		for slot_tick in range(start_tick, tick + 1):
+			slot = self.wheel[slot_tick & self.wheel_mask]
+			expire_num = 0
+			for key in slot:
+				entry = table.get(key)
+				# 重新写入的会话在新的槽中，这里只删除真正到期的
+				if entry is not None and entry[0] <= tick:
+					del table[key]
+					expire_num += 1
+			# 槽中其余的引用均已失效，随槽一起清除
+			self.stale_num -= len(slot) - expire_num
+			self.stats['expire'] += expire_num
+			slot.clear()
+		self.current_tick = tick
+
+	def get(self, key):
+		entry = self.table.get(key)
+		if entry is None:
+			self.stats['miss'] += 1
+			return None
+		self.stats['hit'] += 1
+		return entry[1]
+
+	def set(self, key, value):
+		table = self.table
+		if key in table:
+			# 同一键被重复写入（重传或序列号冲突），移到末尾作为最新会话
+			self.stats['collision'] += 1
+			del table[key]
+			self.stale_num += 1
+		elif len(table) >= self.maxsize:
+			table.popitem(last=False)
+			self.stats['eviction'] += 1
+			self.stale_num += 1
+		expire_tick = self.current_tick + self.ttl
+		table[key] = (expire_tick, value)
+		self.wheel[expire_tick & self.wheel_mask].append(key)
+		self.stats['set'] += 1
+		if self.stale_num > MIN_STALE_REBUILD and self.stale_num > len(table):
+			self.rebuild_wheel()
+
+	def delete(self, key):
+		if self.table.pop(key, None) is not None:
+			self.stale_num += 1
+
+	def rebuild_wheel(self):
+		"""
+		按会话表重新生成时间轮，去除失效引用；重建的开销与会话数成正比，且只在失效引用多于会话数时发生，均摊为 O(1)
+		"""
+		wheel = [[] for _ in range(self.wheel_mask + 1)]
+		wheel_mask = self.wheel_mask
+		for key, entry in self.table.items():
+			wheel[entry[0] & wheel_mask].append(key)
+		self.wheel = wheel
+		self.stale_num = 0
+		self.stats['rebuild'] += 1
+
+	def __len__(self):
+		return len(self.table)
+
+	def memory_size(self):
+		"""
+		估算占用的内存字节数，请求数据的长度按最早的 64 条会话采样
+		"""
+		num = len(self.table)
+		if not num:
+			return 0
+		sample = [entry[1] for entry in itertools.islice(self.table.values(), 64)]
+		value_size = sum(len(value) for value in sample if isinstance(value, bytes)) / len(sample)
+		return int(num * (FLOW_ENTRY_SIZE + value_size))
+
+	def shrink(self, fraction):
+		"""
+		淘汰最早写入的 fraction 比例的会话
+		:return: 淘汰的会话数
+		"""
+		table = self.table
+		keys = list(itertools.islice(table, int(len(table) * fraction)))
+		for key in keys:
+			del table[key]
+		self.stats['eviction'] += len(keys)
+		self.stale_num += len(keys)
+		return len(keys)
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['size'] = len(self.table)
+		stats['wheel'] = len(self.table) + self.stale_num
+		return stats
@@ -0,0 +1,179 @@
+#-*- coding:utf-8 -*-
+
+# 解码状态：分块长度行、分块数据、分块数据后的 CRLF、结束块后的 trailer、解码完成
+STATE_SIZE = 0
+STATE_DATA = 1
+STATE_DATA_END = 2
+STATE_TRAILER = 3
+STATE_DONE = 4
+
+# 长度行、trailer 行的最大长度，超出视为非 chunked 数据
+MAX_LINE_SIZE = 4096
+
+class chunked_decoder():
+	"""
+	Transfer-Encoding: chunked 增量解码器
+	单次遍历、无递归，支持分块扩展（chunk-ext）和 trailer，可跨 TCP 分段多次调用 feed 继续解码，
+	输出达到上限后停止
+	"""
+
+	def __init__(self, max_size, keep=True):
+		"""
+		构造函数
+		:param max_size: 解码输出的最大字节数
+		:param keep: 是否保留解码输出，False 时只跟踪分块边界，用于判断报文是否结束
+		"""
+		self.max_size = max_size
+		self.keep = keep
+		self.state = STATE_SIZE
+		self.remaining = 0
+		self.pending = b''
+		self.parts = []
+		self.out_len = 0
+		self.truncated = False
+		self.error = False
+
+	@property
+	def finished(self):
+		"""解码完成、达到上限或数据格式错误后不再接收数据"""
+		return self.state == STATE_DONE or self.truncated or self.error
+
+	def feed(self, data):
+		"""
+		送入一段数据继续解码，按偏移在原数据上扫描，不复制剩余部分
+		:param data: bytes 数据，可以是任意位置切分的片段
+		:return: 是否已结束解码
+		"""
+		if self.finished:
+			return True
+		find = data.find
+		parts = self.parts if self.keep else []
+		out_len = self.out_len
+		max_size = self.max_size
+		state = self.state
+		data_len = len(data)
+		pos = 0
+		while pos < data_len:
+			if state == STATE_DATA:
+				take = min(self.remaining, data_len - pos)
+				room = max_size - out_len
+				# 本段中的分块数据超出可用空间，输出已满；分块只有一部分在本段时继续等待后续分段
+				if take > room:
+					parts.append(data[pos:pos + room])
+					out_len += room
+					self.truncated = True
+					break
+				parts.append(data[pos:pos + take])
+				out_len += take
+				pos += take
+				self.remaining -= take
+				if not self.remaining:
+					state = STATE_DATA_END
+				continue
+
+			# 其余状态均按行读取
+			line_end = find(b'\n', pos)
+			if line_end < 0:
+				self.pending += data[pos:]
+				if len(self.pending) > MAX_LINE_SIZE:
+					self.error = True
+				break
+			line = data[pos:line_end]
+			if self.pending:
+				line = self.pending + line
+				self.pending = b''
+			pos = line_end + 1
+
+			if state == STATE_SIZE:
+				try:
+					size = int(line, 16)
+				except ValueError:
+					size = parse_size(line)
+				if size is None or size < 0:
+					self.error = True
+					break
+				if not size:
+					state = STATE_TRAILER
+					continue
+				chunk_end = pos + size
+				# 快速路径：整个分块及其后的 CRLF 都在本段数据中，直接复制并读取下一个长度行
+				if data[chunk_end:chunk_end + 2] == b'\r\n' and out_len + size <= max_size:
+					parts.append(data[pos:chunk_end])
+					out_len += size
+					pos = chunk_end + 2
+					continue
+				self.remaining = size
+				state = STATE_DATA
+			elif state == STATE_DATA_END:
+				state = STATE_SIZE
+			elif not line.rstrip(b'\r'):
+				# trailer 以空行结束
+				state = STATE_DONE
+				break
+
+		self.state = state
+		self.out_len = out_len
+		return self.finished
+
+	def result(self):
+		if len(self.parts) > 1:
+			self.parts = [b''.join(self.parts)]
+		return self.parts[0] if self.parts else b''
+
+def parse_size(line):
+	"""
+	解析带分块扩展的长度行（1a;name=value），忽略扩展部分
+	:return: 分块长度，格式错误时返回 None
+	"""
+	ext = line.find(b';')
+	if ext < 0:
+		return None
+	try:
+		return int(line[:ext], 16)
+	except ValueError:
+		return None
+
+def decode_complete(data, max_size):
+	"""
+	快速路径：数据是完整、格式规范（无分块扩展、无 trailer）且不超过上限的 chunked 数据时直接解码，
+	避免逐状态处理的开销；其他情况返回 None，由 chunked_decoder 处理
+	"""
+	find = data.find
+	parts = []
+	out_len = 0
+	pos = 0
+	while True:
+		line_end = find(b'\r\n', pos)
+		if line_end < 0:
+			return None
+		try:
+			size = int(data[pos:line_end], 16)
+		except ValueError:
+			return None
+		if size <= 0:
+			if size or data[line_end + 2:line_end + 4] != b'\r\n':
+				return None
+			return b''.join(parts)
+		start = line_end + 2
+		pos = start + size
+		out_len += size
+		if out_len > max_size or data[pos:pos + 2] != b'\r\n':
+			return None
+		parts.append(data[start:pos])
+		pos += 2
+
+def decode_chunked(data, max_size):
+	"""
+	一次性解码 chunked 数据，数据不完整时返回已解码的部分
+	:param data: chunked 编码的数据
+	:param max_size: 输出的最大字节数
+	:return: 解码后的数据；首个分块即无法解析时返回原始数据
+	"""
+	result = decode_complete(data, max_size)
+	if result is not None:
+		return result
+	decoder = chunked_decoder(max_size)
+	decoder.feed(data)
+	if decoder.error and not decoder.out_len:
+		return data
+	return decoder.result()
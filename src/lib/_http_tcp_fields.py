@@ -0,0 +1,378 @@
+#-*- coding:utf-8 -*-
+
+import json
+import time
+import struct
+import subprocess
+import traceback
+from ._util import proc_data_str, http_filter, decode_body_str
+from ._flow_table import flow_table
+from ._decompress import body_decompressor
+from ._http_chunked import decode_chunked
+from ._dedup_cache import new_dedup_cache, save_snapshot, load_snapshot
+from ._load_shed import load_shedder
+from ._latency_trace import trace_msg
+
+# tshark -T fields 输出的字段，顺序与 proc_packet 中的解包顺序一致
+TSHARK_FIELDS = [
+	'frame.time_epoch',
+	'ip.src',
+	'tcp.srcport',
+	'tcp.stream',
+	'tcp.flags',
+	'tcp.seq',
+	'tcp.payload',
+	'tcp.reassembled.data',
+	'http.request',
+	'http.response',
+	'http.request.method',
+	'http.request.full_uri',
+	'http.request.uri',
+	'http.response_for.uri',
+	'http.response.code',
+	'http.content_type',
+	'http.server'
+]
+FIELD_NUM = len(TSHARK_FIELDS)
+FLAG_SYN_ACK = 0x12
+
+class tcp_http_fields():
+	"""
+	TSHARK 字段提取引擎：tshark 按显示过滤器只输出 SYN-ACK、HTTP 请求/响应和首个数据包，
+	每个数据包一行、字段以制表符分隔，逐行流式解析，不经过 pyshark 的逐包对象模型
+	输出的资产数据与 tcp_http_shark 一致
+	"""
+
+	def __init__(self, work_queue, interface, custom_tag, return_deep_info, http_filter_json, cache_size, session_size, bpf_filter, timeout, debug, input_file=None, dedup_mode='hash', dedup_fpr=0.001, snapshot_file=None, snapshot_interval=300, max_queue_size=50000, load_shed=False, stats_callback=None, stats_interval=1, trace_interval=0, tshark_path='tshark'):
+		"""
+		构造函数
+		:param work_queue: 捕获资产数据消息发送队列
+		:param interface: 捕获流量的网卡名
+		:param custom_tag: 数据标签，用于区分不同的采集引擎
+		:param return_deep_info: 是否处理更多信息，包括原始请求、响应头和正文
+		:param http_filter_json: HTTP过滤器配置，支持按状态和内容类型过滤
+		:param cache_size: 缓存的已处理数据条数，120秒内重复的数据将不会发送Syslog
+		:param session_size: 缓存的HTTP/TCP会话数量，16秒未使用的会话将被自动清除
+		:param bpf_filter: 数据包底层过滤器
+		:param timeout: 采集程序的运行超时时间，默认为启动后1小时自动退出，0 为不退出
+		:param debug: 调试开关
+		:param input_file: 离线数据包文件（pcap/pcapng），指定后从文件读取数据包代替网卡实时采集
+		:param dedup_mode: 去重缓存类型，hash - 64 位哈希精确去重，bloom - 按时间衰减的 Bloom Filter
+		:param dedup_fpr: bloom 去重缓存的误判率
+		:param snapshot_file: 去重缓存快照文件，启动时恢复，运行中定期写入，None 为不保存
+		:param snapshot_interval: 去重缓存快照的写入间隔（单位秒）
+		:param max_queue_size: 发送队列最大长度
+		:param load_shed: 发送队列过载时按价值分级丢弃数据（先去除正文/数据，再丢弃已知服务的数据）
+		:param stats_callback: 运行统计回调，每 stats_interval 秒（按数据包时间）以 get_stats() 的结果调用，None 为不统计
+		:param stats_interval: 运行统计回调间隔（单位秒）
+		:param trace_interval: 延迟采样间隔（单位秒），每个间隔内标记一条资产数据，记录其从捕获到发送各阶段的耗时，0 为不采样
+		:param tshark_path: tshark 可执行文件路径
+		"""
+		self.work_queue = work_queue
+		self.debug = debug
+		self.timeout = timeout
+		self.bpf_filter = bpf_filter
+		self.cache_size = cache_size
+		self.session_size = session_size
+		self.http_filter_json = http_filter_json
+		self.return_deep_info = return_deep_info
+		self.custom_tag = custom_tag
+		self.interface = interface
+		self.input_file = input_file
+		self.tshark_path = tshark_path
+		self.proc = None
+		if self.session_size:
+			self.http_stream_cache = flow_table(self.session_size, ttl=16)
+			self.tcp_stream_cache = flow_table(self.session_size, ttl=16)
+		if self.cache_size:
+			self.http_cache = new_dedup_cache(dedup_mode, self.cache_size, ttl=120, fpr=dedup_fpr)
+			self.tcp_cache = new_dedup_cache(dedup_mode, self.cache_size, ttl=120, fpr=dedup_fpr)
+		self.snapshot_file = snapshot_file
+		self.snapshot_interval = snapshot_interval
+		self.next_snapshot = float('inf')
+		if self.snapshot_file and self.cache_size:
+			self.next_snapshot = time.time() + self.snapshot_interval
+			try:
+				print('[*] Dedup snapshot loaded: {}'.format(load_snapshot(self.snapshot_file, self.dedup_caches())))
+			except (OSError, ValueError, struct.error):
+				traceback.print_exc()
+		self.load_shedder = load_shedder(self.work_queue, max_queue_size, max(self.cache_size, 65536)) if load_shed else None
+		# 数据包计数：http、tcp - 按协议处理的数据包，skip - 字段数不符的输出行
+		self.packet_stats = {
+			'skip': 0,
+			'http': 0,
+			'tcp': 0
+		}
+		self.stats_callback = stats_callback
+		self.stats_interval = stats_interval
+		self.next_stats = float('inf') if self.stats_callback is None else 0
+		self.trace_interval = trace_interval
+		self.next_trace = 0 if self.trace_interval > 0 else float('inf')
+		self.body_decompressor = body_decompressor(16*1024)
+
+	def display_filter(self):
+		"""
+		只输出需要处理的数据包，绝大多数数据包在 tshark 中即被丢弃
+		"""
+		rules = ['tcp.flags == 0x12', 'http.response']
+		if self.session_size:
+			rules.append('http.request')
+			if self.return_deep_info:
+				# 服务端的首个数据包
+				rules.append('(tcp.seq == 1 && tcp.len > 0)')
+		return ' || '.join(rules)
+
+	def command(self):
+		cmd = [self.tshark_path, '-l', '-n', '-T', 'fields', '-E', 'separator=/t', '-E', 'occurrence=f', '-E', 'quote=n', '-Y', self.display_filter()]
+		if self.input_file:
+			cmd += ['-r', self.input_file]
+		else:
+			cmd += ['-i', self.interface]
+			if self.bpf_filter:
+				cmd += ['-f', self.bpf_filter]
+			if self.timeout:
+				cmd += ['-a', 'duration:{}'.format(self.timeout)]
+		for field in TSHARK_FIELDS:
+			cmd += ['-e', field]
+		return cmd
+
+	def run(self):
+		"""
+		入口函数
+		"""
+		self.proc = subprocess.Popen(self.command(), stdout=subprocess.PIPE, encoding='utf-8', errors='replace', bufsize=65536)
+		try:
+			for line in self.proc.stdout:
+				self.proc_packet(line.rstrip('\n').split('\t'))
+		finally:
+			if self.proc.poll() is None:
+				self.proc.terminate()
+			self.proc.wait()
+
+	def dedup_caches(self):
+		return {'tcp': self.tcp_cache, 'http': self.http_cache}
+
+	def save_snapshot(self):
+		"""
+		将去重缓存写入快照文件，运行中按 snapshot_interval 周期调用，退出前再调用一次
+		"""
+		if not self.snapshot_file or not self.cache_size:
+			return
+		self.next_snapshot = time.time() + self.snapshot_interval
+		try:
+			save_snapshot(self.snapshot_file, self.dedup_caches())
+		except OSError:
+			traceback.print_exc()
+
+	def get_stats(self):
+		"""
+		汇总各组件的运行统计
+		"""
+		stats = {'packet': dict(self.packet_stats)}
+		if self.cache_size:
+			stats['tcp_cache'] = self.tcp_cache.get_stats()
+			stats['http_cache'] = self.http_cache.get_stats()
+		if self.session_size:
+			stats['http_session'] = self.http_stream_cache.get_stats()
+			stats['tcp_session'] = self.tcp_stream_cache.get_stats()
+		if self.load_shedder is not None:
+			stats['shed'] = self.load_shedder.get_stats()
+		stats['decompress'] = self.body_decompressor.get_stats()
+		return stats
+
+	def proc_packet(self, fields):
+		"""
+		全局数据包处理：识别、路由及结果发送
+		:param fields: 一行 tshark 输出按制表符拆分后的字段列表
+		"""
+		try:
+			if len(fields) != FIELD_NUM:
+				self.packet_stats['skip'] += 1
+				return
+			ts = float(fields[0])
+			now = time.time()
+			if self.next_snapshot <= now:
+				self.save_snapshot()
+			if self.next_stats <= ts:
+				self.next_stats = ts + self.stats_interval
+				self.stats_callback(self.get_stats())
+			if self.session_size:
+				self.http_stream_cache.advance(ts)
+				self.tcp_stream_cache.advance(ts)
+
+			if fields[8] or fields[9]:
+				self.packet_stats['http'] += 1
+				pkt_json = self.proc_http(fields)
+			else:
+				self.packet_stats['tcp'] += 1
+				pkt_json = self.proc_tcp(fields)
+
+			if pkt_json and self.load_shedder is not None:
+				pkt_json = self.load_shedder.shed(pkt_json, '{}:{}'.format(pkt_json['ip'], pkt_json['port']))
+
+			if pkt_json:
+				result = json.dumps(pkt_json)
+				if self.debug:
+					print(result)
+				if self.next_trace <= ts:
+					self.next_trace = ts + self.trace_interval
+					result = trace_msg(result, ts, now)
+				# 跨进程去重键：HTTP 与 http_cache 的键相同（URL），TCP 为 IP:端口
+				if pkt_json['pro'] == 'HTTP':
+					dedup_key = ('HTTP', pkt_json['url'])
+				else:
+					dedup_key = ('TCP', '{}:{}'.format(pkt_json['ip'], pkt_json['port']))
+				self.work_queue.append(result, dedup_key)
+		except:
+			traceback.print_exc()
+
+	def proc_http(self, fields):
+		"""
+		处理 HTTP 包
+		:param fields: 字段列表
+		:return: JSON or None
+		"""
+		_, src_addr, src_port, stream, _, _, payload, reassembled, is_request, is_response, method, full_uri, uri, response_for_uri, code, content_type, server = fields
+		stream = int(stream)
+
+		if is_request and self.session_size:
+			self.http_stream_cache.set(stream, {
+				'url': full_uri or uri,
+				'method': method
+			})
+
+		elif is_response:
+			pkt_json = {}
+
+			if self.session_size:
+				cache_req = self.http_stream_cache.get(stream)
+				if cache_req:
+					pkt_json['url'] = cache_req['url']
+					pkt_json['method'] = cache_req['method']
+					self.http_stream_cache.delete(stream)
+
+			if 'url' not in pkt_json:
+				pkt_json['url'] = response_for_uri or '/'
+
+			# 处理 URL 只有URI的情况
+			if pkt_json['url'][0] == '/':
+				if src_port == '80':
+					pkt_json['url'] = "http://%s%s"%(src_addr, pkt_json['url'])
+				else:
+					pkt_json['url'] = "http://%s:%s%s"%(src_addr, src_port, pkt_json['url'])
+
+			if self.cache_size:
+				# 缓存机制，防止短时间大量处理重复响应
+				if self.http_cache.get(pkt_json['url']):
+					return None
+				self.http_cache.set(pkt_json['url'], True)
+
+			pkt_json['pro'] = 'HTTP'
+			pkt_json['tag'] = self.custom_tag
+			pkt_json['ip'] = src_addr
+			pkt_json['port'] = src_port
+
+			if code:
+				if self.http_filter_json and http_filter(self.http_filter_json, 'response_code', code):
+					return None
+				pkt_json['code'] = code
+
+			if content_type:
+				if self.http_filter_json and http_filter(self.http_filter_json, 'content_type', content_type):
+					return None
+				pkt_json['type'] = content_type.lower()
+			else:
+				pkt_json['type'] = 'unkown'
+
+			if server:
+				pkt_json['server'] = server
+
+			# 开启深度数据分析，返回header和body等数据
+			if self.return_deep_info:
+				# 跨多个分段的响应使用 tshark 重组后的数据
+				data = bytes.fromhex((reassembled or payload).replace(':', ''))
+				if data.find(b'HTTP/') == 0:
+					split_pos = data.find(b'\r\n\r\n')
+					if split_pos <= 0 or split_pos > 2048:
+						split_pos = 2048
+					pkt_json['header'] = str(data[:split_pos], 'utf-8', 'ignore')
+					pkt_json['body'] = self.decode_body(pkt_json['header'].lower(), data[split_pos+4:], pkt_json['type'])
+				else:
+					pkt_json['body'] = ''
+
+			return pkt_json
+
+		return None
+
+	def decode_body(self, header, data, content_type):
+		"""
+		去除 chunked 分块、解压并按字符集解码响应正文
+		:param header: 小写的响应头
+		:param data: 原始正文
+		:param content_type: 小写的 Content-Type
+		"""
+		if not data:
+			return ''
+		if 'transfer-encoding: chunked' in header:
+			data = decode_chunked(data, 16*1024)
+		pos = header.find('content-encoding:')
+		if pos >= 0:
+			encoding = header[pos+17:].split('\r\n', 1)[0].strip()
+			data = self.body_decompressor.decompress(data, encoding)[0]
+
+		return decode_body_str(data, content_type, 16*1024)
+
+	def proc_tcp(self, fields):
+		"""
+		处理 TCP 包
+		:param fields: 字段列表
+		:return: JSON or None
+		"""
+		_, src_addr, src_port, stream, flags, seq, payload = fields[:7]
+		stream = int(stream)
+
+		pkt_json = {}
+		pkt_json['pro'] = 'TCP'
+		pkt_json['tag'] = self.custom_tag
+
+		# SYN+ACK
+		if int(flags, 16) == FLAG_SYN_ACK:
+			tcp_info = '%s:%s' % (src_addr, src_port)
+
+			if self.cache_size:
+				if self.tcp_cache.get(tcp_info):
+					return None
+				self.tcp_cache.set(tcp_info, True)
+
+			if self.return_deep_info and self.session_size:
+				self.tcp_stream_cache.set(stream, tcp_info)
+			else:
+				pkt_json['ip'] = src_addr
+				pkt_json['port'] = src_port
+				return pkt_json
+
+		# -r on开启深度数据分析，采集server第一个响应数据包
+		elif self.return_deep_info and seq == '1' and payload and self.session_size:
+			tcp_info = self.tcp_stream_cache.get(stream)
+			if tcp_info:
+				# 防止误处理客户端发第一个包的情况
+				if tcp_info != '%s:%s' % (src_addr, src_port):
+					return None
+
+				self.tcp_stream_cache.delete(stream)
+
+				pkt_json['ip'] = src_addr
+				pkt_json['port'] = src_port
+				payload_data = payload.replace(':', '')
+				if payload_data.startswith('48545450'): # ^HTTP
+					return None
+
+				# HTTPS Protocol
+				if pkt_json['port'] == '443' and payload_data.startswith('1603'): # SSL
+					pkt_json['pro'] = 'HTTPS'
+					pkt_json['url'] = 'https://{}/'.format(pkt_json['ip'])
+				else:
+					pkt_json['data'] = proc_data_str(payload_data, 16 * 1024)
+
+				return pkt_json
+		return None
@@ -1,19 +1,32 @@
 #-*- coding:utf-8 -*-
 
 import pcap
-import dpkt
 import time
 import json
 import sys
 import re
-import io
-import gzip
-import brotli
-from cacheout import Cache, LRUCache
+import threading
+import struct
+import traceback
+import concurrent.futures
+from ._capture_worker import set_packet_fanout
+from ._util import http_filter
+from ._packet import decode_tcp_packet, ip_addr
+from ._decompress import body_decompressor
+from ._http_chunked import decode_chunked
+from ._flow_table import flow_table, flow_base, flow_key, FLOW_KIND_SYN, FLOW_KIND_REQ
+from ._reassembly import stream_reassembler, STREAM_TCP, STREAM_HTTP
+from ._dedup_cache import new_dedup_cache, save_snapshot, load_snapshot
+from ._memory_governor import memory_governor
+from ._load_shed import load_shedder
+from ._latency_trace import trace_msg
+from ._adaptive_filter import adaptive_filter
+from ._ring_capture import tpacket_ring
+from ._batch_triage import batch_triage, packet_batches, numpy
 
 class tcp_http_pcap():
 
-	def __init__(self, max_queue_size, work_queue, interface, custom_tag, return_deep_info, http_filter_json, cache_size, session_size, bpf_filter, timeout, debug):
+	def __init__(self, max_queue_size, work_queue, interface, custom_tag, return_deep_info, http_filter_json, cache_size, session_size, bpf_filter, timeout, debug, fanout_id=None, input_file=None, body_worker_num=0, max_body_size=16*1024, reassembly_size=0, reassembly_budget=64*1024*1024, dedup_mode='hash', dedup_fpr=0.001, snapshot_file=None, snapshot_interval=300, memory_budget=0, load_shed=False, stats_callback=None, stats_interval=1, trace_interval=0, adaptive_top=0, adaptive_interval=10, ring_size=0, ring_timeout=64, batch_size=0):
 		"""
 		构造函数
 		:param max_queue_size: 资产队列最大长度
@@ -23,10 +36,30 @@ class tcp_http_pcap():
 		:param return_deep_info: 是否处理更多信息，包括原始请求、响应头和正文
 		:param http_filter_json: HTTP过滤器配置，支持按状态和内容类型过滤
 		:param cache_size: 缓存的已处理数据条数，120秒内重复的数据将不会发送Syslog
-		:param session_size: 缓存的HTTP/TCP会话数量，16秒未使用的会话将被自动清除
+		:param session_size: 缓存的HTTP/TCP会话数量，30秒未使用的会话将被自动清除
 		:param bpf_filter: 数据包底层过滤器
 		:param timeout: 采集程序的运行超时时间，默认为启动后1小时自动退出
 		:param debug: 调试开关
+		:param fanout_id: AF_PACKET fanout 组ID，多进程采集时按流哈希分配数据包，None 为单进程采集
+		:param input_file: 离线数据包文件（pcap/pcapng），指定后从文件读取数据包代替网卡实时采集
+		:param body_worker_num: HTTP 响应正文解压和解码的工作线程数量，0 为在采集线程中处理
+		:param max_body_size: HTTP 响应正文（解压后）保留的最大字节数
+		:param reassembly_size: 单个响应重组的最大字节数，0 为不重组，只处理响应的首个分段
+		:param reassembly_budget: 全部响应重组缓存的最大字节数
+		:param dedup_mode: 去重缓存类型，hash - 64 位哈希精确去重，bloom - 按时间衰减的 Bloom Filter
+		:param dedup_fpr: bloom 去重缓存的误判率
+		:param snapshot_file: 去重缓存快照文件，启动时恢复，运行中定期写入，None 为不保存
+		:param snapshot_interval: 去重缓存快照的写入间隔（单位秒）
+		:param memory_budget: 内存预算（单位字节），超出后按 响应重组、去重缓存、会话、发送队列 的顺序收缩，0 为不限制
+		:param load_shed: 发送队列过载时按价值分级丢弃数据（先去除正文/数据，再丢弃已知服务的数据），代替队列满后整体清空
+		:param stats_callback: 运行统计回调，每 stats_interval 秒（按数据包时间）以 get_stats() 的结果调用，None 为不统计
+		:param stats_interval: 运行统计回调间隔（单位秒）
+		:param trace_interval: 延迟采样间隔（单位秒，按数据包时间），每个间隔内标记一条资产数据，记录其从捕获到发送各阶段的耗时，0 为不采样
+		:param adaptive_top: 自适应过滤器最多排除的已知服务数量，只捕获 SYN-ACK 和携带数据的分段，并定期排除流量最大的已知服务，0 为不启用
+		:param adaptive_interval: 自适应过滤器的更新间隔（单位秒）
+		:param ring_size: TPACKET_V3 环形缓冲区大小（单位字节），大于0时通过 AF_PACKET 内存映射直接抓包代替 libpcap，0 为使用 libpcap
+		:param ring_timeout: 环形缓冲区的块超时（单位毫秒）
+		:param batch_size: 批量模式每批的数据包数量，大于0时按批读取并用 NumPy 向量化筛选头部，只有剩余的数据包逐个处理，0 为逐包处理
 		"""
 		self.total_msg_num = 0
 		self.max_queue_size = max_queue_size
@@ -40,12 +73,89 @@ class tcp_http_pcap():
 		self.return_deep_info = return_deep_info
 		self.custom_tag = custom_tag
 		self.interface = interface
-		self.sniffer = pcap.pcap(self.interface, snaplen=65535, promisc=True, timeout_ms=self.timeout, immediate=False)
-		self.sniffer.setfilter(self.bpf_filter)
-		self.tcp_stream_cache = Cache(maxsize=self.session_size, ttl=30, timer=time.time, default=None)
+		self.input_file = input_file
+		# interface 和 input_file 均为空时不打开抓包句柄，由调用方设置 sniffer（基准测试）
+		self.sniffer = None
+		if self.input_file:
+			self.sniffer = pcap.pcap(self.input_file)
+		elif self.interface and ring_size > 0:
+			self.sniffer = tpacket_ring(self.interface, ring_size, ring_timeout)
+		elif self.interface:
+			self.sniffer = pcap.pcap(self.interface, snaplen=65535, promisc=True, timeout_ms=self.timeout or 1000, immediate=False)
+		self.adaptive_filter = None
+		self.adaptive_interval = adaptive_interval
+		self.next_adapt = float('inf')
+		# 服务端 IP:端口 整数 -> 本周期的数据包数量
+		self.heavy_counter = None
+		if adaptive_top > 0 and self.cache_size:
+			self.adaptive_filter = adaptive_filter(self.bpf_filter, adaptive_top)
+			self.heavy_counter = {}
+			self.next_adapt = 0
+		if self.sniffer is not None:
+			self.sniffer.setfilter(self.bpf_filter if self.adaptive_filter is None else self.adaptive_filter.compile())
+		if fanout_id is not None and not self.input_file:
+			set_packet_fanout(self.sniffer.fileno(), fanout_id)
+		self.tcp_stream_cache = flow_table(self.session_size, ttl=30)
+		self.max_body_size = max_body_size
+		self.body_decompressor = body_decompressor(self.max_body_size)
+		self.body_executor = None
+		if body_worker_num > 0:
+			self.body_executor = concurrent.futures.ThreadPoolExecutor(max_workers=body_worker_num)
+			# 限制排队中的正文解码任务数量，防止内存无限增长
+			self.body_semaphore = threading.BoundedSemaphore(body_worker_num * 64)
+		self.reassembler = None
+		if reassembly_size > 0:
+			self.reassembler = stream_reassembler(reassembly_size, reassembly_budget, self.session_size)
 		if self.cache_size:
-			self.tcp_cache = Cache(maxsize=self.cache_size, ttl=120, timer=time.time, default=None)
-			self.http_cache = Cache(maxsize=self.cache_size, ttl=120, timer=time.time, default=None)
+			self.tcp_cache = new_dedup_cache(dedup_mode, self.cache_size, ttl=120, fpr=dedup_fpr)
+			self.http_cache = new_dedup_cache(dedup_mode, self.cache_size, ttl=120, fpr=dedup_fpr)
+		self.snapshot_file = snapshot_file
+		self.snapshot_interval = snapshot_interval
+		self.next_snapshot = float('inf')
+		if self.snapshot_file and self.cache_size:
+			self.next_snapshot = time.time() + self.snapshot_interval
+			try:
+				print('[*] Dedup snapshot loaded: {}'.format(load_snapshot(self.snapshot_file, self.dedup_caches())))
+			except (OSError, ValueError, struct.error):
+				traceback.print_exc()
+		self.load_shedder = None
+		if load_shed:
+			self.load_shedder = load_shedder(self.work_queue, self.max_queue_size, max(self.cache_size, 65536))
+		self.memory_governor = None
+		if memory_budget > 0:
+			self.memory_governor = memory_governor(memory_budget)
+			if self.reassembler is not None:
+				self.memory_governor.register('reassembly', self.reassembler)
+			if self.cache_size:
+				self.memory_governor.register('http_cache', self.http_cache)
+				self.memory_governor.register('tcp_cache', self.tcp_cache)
+			self.memory_governor.register('session', self.tcp_stream_cache)
+			if self.load_shedder is not None:
+				self.memory_governor.register('shed', self.load_shedder)
+			# 多进程采集时子进程的发送队列在主进程中，不在此管理
+			if hasattr(self.work_queue, 'shrink'):
+				self.memory_governor.register('queue', self.work_queue)
+		# 数据包计数：skip - 解析时丢弃（非 TCP、无数据等），syn_ack - SYN-ACK，data - 携带数据的 ACK/PSH-ACK
+		self.packet_stats = {
+			'skip': 0,
+			'syn_ack': 0,
+			'data': 0
+		}
+		self.batch_size = batch_size
+		self.batch_triage = None
+		if batch_size > 0:
+			if numpy is None:
+				print('[!] NumPy not installed, batch triage disabled')
+			else:
+				self.batch_triage = batch_triage(self.packet_stats)
+		self.capture_stats = {}
+		self.stats_callback = stats_callback
+		self.stats_interval = stats_interval
+		self.next_stats = float('inf') if self.stats_callback is None else 0
+		# 延迟采样：到达采样时间后记录每个数据包的 (时间戳, 开始处理时间)，由下一条发送的资产数据带走
+		self.trace_interval = trace_interval
+		self.next_trace = 0 if self.trace_interval > 0 else float('inf')
+		self.trace_point = None
 		# http数据分析正则
 		self.decode_request_regex = re.compile(r'^([A-Z]+) +([^ \r\n]+) +HTTP/\d+(?:\.\d+)?[^\r\n]*(.*?)$', re.S)
 		self.decode_response_regex = re.compile(r'^HTTP/(\d+(?:\.\d+)?) (\d+)[^\r\n]*(.*?)$', re.S)
@@ -55,154 +165,354 @@ class tcp_http_pcap():
 		"""
 		入口函数
 		"""
-		for ts, pkt in self.sniffer:
-			# self.total_msg_num += 1
-			# if self.total_msg_num%1000 == 0:
-			# 	print("Packet analysis rate: %s"%(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())+" - "+str(self.total_msg_num)))
-			packet = self.pkt_decode(pkt)
-			if not packet:
-				continue
-			
-			# print('{}:{}->{}:{}: Seq:{}, Ack:{}, Flag: {}, Len: {}'.format(packet.src, packet.sport, packet.dst, packet.dport, packet.ack, packet.seq, packet.flags, len(packet.data)))
-			cache_key = '{}:{}'.format(packet.src, packet.sport)
-			# SYN & ACK
-			if packet.flags == 0x12:
-				if self.cache_size and self.tcp_cache.get(cache_key):
-					continue
-				
-				self.tcp_stream_cache.set('S_{}'.format(packet.ack), packet.seq + 1)
-			
-			# ACK || PSH-ACK
-			elif packet.flags in [0x10, 0x18, 0x19]:
-				# 长度为0的数据包不处理
-				if len(packet.data) == 0:
+		if self.batch_triage is not None:
+			self.run_batch()
+		else:
+			packet_stats = self.packet_stats
+			for ts, pkt in self.sniffer:
+				packet = self.pkt_decode(pkt)
+				if not packet:
+					packet_stats['skip'] += 1
 					continue
+				self.tick(ts)
+				self.proc_packet(ts, packet)
 
-				# 第一个有数据的请求包，先缓存下来
-				# Seq == SYN-ACK Ack
-				pre_cs_seq = self.tcp_stream_cache.get('S_{}'.format(packet.seq))
-				if pre_cs_seq:
-					c_s_key = 'C_{}'.format(packet.ack)
-					
-					self.tcp_stream_cache.set(c_s_key, packet.data)
-					self.tcp_stream_cache.delete('S_{}'.format(packet.seq))
-					continue
+		if self.reassembler is not None:
+			self.reassembler.flush()
+			self.proc_streams()
+		if self.body_executor:
+			self.body_executor.shutdown(wait=True)
+		if self.stats_callback is not None:
+			self.publish_stats(0)
+		self.sniffer.close()
 
-				# 1. 提取服务器主动响应的通讯，例如：MySQL
-				# Seq == SYN-ACK Seq + 1
-				pre_sc_seq = self.tcp_stream_cache.get('S_{}'.format(packet.ack))
-				if pre_sc_seq == packet.seq:
-					self.tcp_stream_cache.delete('S_{}'.format(packet.ack))
-
-					# TCP瞬时重复处理
-					if self.cache_size:
-						self.tcp_cache.set(cache_key, True)
-					
-					data = {
-						'pro': 'TCP',
-						'tag': self.custom_tag,
-						'ip': packet.src,
-						'port': packet.sport,
-						'data': packet.data.hex()
-					}
-					self.send_msg(data)
+	def run_batch(self):
+		"""
+		批量模式：按批读取数据包，先由 batch_triage 向量化筛选，只有剩余的数据包逐个解析和处理
+		"""
+		packet_stats = self.packet_stats
+		triage = self.batch_triage.triage
+		tcp_cache = self.tcp_cache if self.cache_size else None
+		for batch in packet_batches(self.sniffer, self.batch_size, live=bool(self.interface and not self.input_file)):
+			self.tick(batch[0][0])
+			for index in triage(batch, tcp_cache, self.heavy_counter):
+				ts, pkt = batch[index]
+				packet = self.pkt_decode(pkt)
+				if not packet:
+					packet_stats['skip'] += 1
 					continue
+				self.proc_packet(ts, packet)
 
-				# 2. 提取需要请求服务器才会响应的通讯，例如：HTTP
-				# Seq == PSH ACK(C->S) Ack
-				send_data = self.tcp_stream_cache.get('C_{}'.format(packet.seq))
-				# 判断是否存在请求数据
-				if send_data:
-					# 删除已使用的缓存
-					self.tcp_stream_cache.delete('C_{}'.format(packet.seq))
-				
-					# 判断是否为 HTTP 通讯
-					if packet.data[:5] == b'HTTP/':
-						request_dict = self.decode_request(send_data, packet.src, str(packet.sport))
-						if not request_dict:
-							continue
-
-						http_cache_key = '{}:{}'.format(request_dict['method'], request_dict['uri'])
-						if self.cache_size and self.http_cache.get(http_cache_key):
-							continue
-						
-						response_dict = self.decode_response(packet.data)
-						if response_dict:
-							# HTTP瞬时重复处理
-							if self.cache_size:
-								self.http_cache.set(http_cache_key, True)
-								
-							response_code = response_dict['status']
-							content_type = response_dict['type']
-
-							# 根据响应状态码和页面类型进行过滤
-							if self.http_filter_json:
-								filter_code = self.http_filter('response_code', response_code) if response_code else False
-								filter_type = self.http_filter('content_type', content_type) if content_type else False
-								if filter_code or filter_type:
-									continue
-							
-							data = {
-								'pro': 'HTTP',
-								'tag': self.custom_tag,
-								'ip': packet.src,
-								'port': packet.sport,
-								'method': request_dict['method'],
-								'code': response_code,
-								'type': content_type,
-								'server': response_dict['server'],
-								'header': response_dict['headers'],
-								'url': request_dict['uri'],
-								'body': response_dict['body']
-							}
-
-							self.send_msg(data)
-							continue
-					
-					# TCP瞬时重复处理
-					if self.cache_size:
-						self.tcp_cache.set(cache_key, True)
-					
-					# 2.2 非 HTTP 通讯
-					data = {
-						'pro': 'TCP',
-						'tag': self.custom_tag,
-						'ip': packet.src,
-						'port': packet.sport,
-						'data': packet.data.hex()
-					}
-					self.send_msg(data)
+	def tick(self, ts):
+		"""
+		按数据包时间执行周期任务：延迟采样、会话老化、快照、内存检查、运行统计、自适应过滤器、响应重组超时
+		"""
+		if ts >= self.next_trace:
+			self.trace_point = (ts, time.time())
+		self.tcp_stream_cache.advance(ts)
+		if ts >= self.next_snapshot:
+			self.save_snapshot()
+		if self.memory_governor is not None and ts >= self.memory_governor.next_check:
+			self.memory_governor.check(ts)
+		if ts >= self.next_stats:
+			self.publish_stats(ts)
+		if ts >= self.next_adapt:
+			self.adapt_filter(ts)
+		reassembler = self.reassembler
+		if reassembler is not None:
+			reassembler.expire(ts)
+			if reassembler.ready:
+				self.proc_streams()
+
+	def proc_packet(self, ts, packet):
+		"""
+		处理一个 SYN-ACK 或携带数据的 ACK/PSH-ACK 数据包：会话配对、去重、提取资产数据
+		:param ts: 数据包时间戳
+		:param packet: tcp_packet
+		"""
+		packet_stats = self.packet_stats
+		heavy_counter = self.heavy_counter
+		reassembler = self.reassembler
+		# print('{}:{}->{}:{}: Seq:{}, Ack:{}, Flag: {}, Len: {}'.format(packet.src, packet.sport, packet.dst, packet.dport, packet.ack, packet.seq, packet.flags, len(packet.data)))
+		# 服务端 IP:端口 的整数形式，避免逐包格式化字符串
+		cache_key = packet.src << 16 | packet.sport
+		if heavy_counter is not None:
+			heavy_counter[cache_key] = heavy_counter.get(cache_key, 0) + 1
+		# SYN & ACK
+		if packet.flags == 0x12:
+			packet_stats['syn_ack'] += 1
+			if self.cache_size and self.tcp_cache.get(cache_key):
+				return
+			
+			# 会话键统一按 客户端 -> 服务端 方向排列
+			s_key = flow_key(flow_base(packet.dst, packet.dport, packet.src, packet.sport), packet.ack, FLOW_KIND_SYN)
+			self.tcp_stream_cache.set(s_key, packet.seq + 1)
+		
+		# ACK || PSH-ACK
+		elif packet.flags in [0x10, 0x18, 0x19]:
+			packet_stats['data'] += 1
+			# 长度为0的数据包不处理
+			if len(packet.data) == 0:
+				return
+
+			sc_base = flow_base(packet.dst, packet.dport, packet.src, packet.sport)
+			# 正在重组的服务端响应的后续分段
+			if reassembler is not None and reassembler.streams:
+				if reassembler.add(sc_base, packet.seq, packet.data, packet.flags):
+					if reassembler.ready:
+						self.proc_streams()
+					return
+
+			# 第一个有数据的请求包，先缓存下来
+			# Seq == SYN-ACK Ack
+			cs_base = flow_base(packet.src, packet.sport, packet.dst, packet.dport)
+			cs_key = flow_key(cs_base, packet.seq, FLOW_KIND_SYN)
+			pre_cs_seq = self.tcp_stream_cache.get(cs_key)
+			if pre_cs_seq is not None:
+				self.tcp_stream_cache.set(flow_key(cs_base, packet.ack, FLOW_KIND_REQ), packet.data)
+				self.tcp_stream_cache.delete(cs_key)
+				return
+
+			# 1. 提取服务器主动响应的通讯，例如：MySQL
+			# Seq == SYN-ACK Seq + 1
+			sc_key = flow_key(sc_base, packet.ack, FLOW_KIND_SYN)
+			pre_sc_seq = self.tcp_stream_cache.get(sc_key)
+			if pre_sc_seq == packet.seq:
+				self.tcp_stream_cache.delete(sc_key)
+
+				if reassembler is not None:
+					reassembler.open(sc_base, STREAM_TCP, packet.seq, packet.data, packet.flags, ts, (packet.src, packet.sport))
+					if reassembler.ready:
+						self.proc_streams()
+				else:
+					self.send_tcp_msg(packet.src, packet.sport, packet.data)
+				return
+
+			# 2. 提取需要请求服务器才会响应的通讯，例如：HTTP
+			# Seq == PSH ACK(C->S) Ack
+			req_key = flow_key(sc_base, packet.seq, FLOW_KIND_REQ)
+			send_data = self.tcp_stream_cache.get(req_key)
+			# 判断是否存在请求数据
+			if send_data:
+				# 删除已使用的缓存
+				self.tcp_stream_cache.delete(req_key)
+			
+				# 判断是否为 HTTP 通讯
+				if packet.data[:5] == b'HTTP/':
+					request_dict = self.decode_request(send_data, self.ip_addr(packet.src), str(packet.sport))
+					if not request_dict:
+						return
+
+					http_cache_key = '{}:{}'.format(request_dict['method'], request_dict['uri'])
+					if self.cache_size and self.http_cache.get(http_cache_key):
+						return
+
+					if reassembler is not None:
+						context = (packet.src, packet.sport, request_dict, http_cache_key)
+						reassembler.open(sc_base, STREAM_HTTP, packet.seq, packet.data, packet.flags, ts, context, request_dict['method'] == 'HEAD')
+						if reassembler.ready:
+							self.proc_streams()
+						return
+					if self.proc_http_response(packet.src, packet.sport, request_dict, http_cache_key, packet.data):
+						return
 				
+				# 2.2 非 HTTP 通讯
+				if reassembler is not None:
+					reassembler.open(sc_base, STREAM_TCP, packet.seq, packet.data, packet.flags, ts, (packet.src, packet.sport))
+					if reassembler.ready:
+						self.proc_streams()
+				else:
+					self.send_tcp_msg(packet.src, packet.sport, packet.data)
 
-		self.sniffer.close()
+	def dedup_caches(self):
+		return {'tcp': self.tcp_cache, 'http': self.http_cache}
 
-	def http_filter(self, key, value):
+	def save_snapshot(self):
 		"""
-		检查字符串中是否包含特定的规则
-		:param key: 规则键名，response_code（状态码）或 content_type（内容类型）
-		:param value: 要检查的字符串
-		:return: True - 包含， False - 不包含
+		将去重缓存写入快照文件，运行中按 snapshot_interval 周期调用，退出前再调用一次
 		"""
-		if key in self.http_filter_json:
-			for rule in self.http_filter_json[key]:
-				if rule in value:
-					return True
-		return False
+		if not self.snapshot_file or not self.cache_size:
+			return
+		self.next_snapshot = time.time() + self.snapshot_interval
+		try:
+			save_snapshot(self.snapshot_file, self.dedup_caches())
+		except OSError:
+			traceback.print_exc()
 
-	def pkt_decode(self, pkt):
-		packet = dpkt.ethernet.Ethernet(pkt)
-		if isinstance(packet.data, dpkt.ip.IP) and isinstance(packet.data.data, dpkt.tcp.TCP):
-			if packet.data.data.flags == 0x12 or \
-				packet.data.data.flags in [0x10, 0x18, 0x19] and len(packet.data.data.data) > 0:
-				tcp_pkt = packet.data.data
-				tcp_pkt.src = self.ip_addr(packet.data.src)
-				tcp_pkt.dst = self.ip_addr(packet.data.dst)
-				return tcp_pkt
+	def adapt_filter(self, ts):
+		"""
+		按本周期各服务的数据包数量更新自适应过滤器；排除截止时间与去重缓存一致，按系统时间计算
+		"""
+		if not self.next_adapt:
+			self.next_adapt = ts + self.adaptive_interval
+			return
+		self.next_adapt = ts + self.adaptive_interval
+		bpf_filter = self.adaptive_filter.update(self.heavy_counter, self.tcp_cache, time.time())
+		self.heavy_counter.clear()
+		if bpf_filter is None:
+			return
+		try:
+			self.sniffer.setfilter(bpf_filter)
+		except (OSError, ValueError):
+			traceback.print_exc()
+			self.adaptive_filter.reset()
+			self.sniffer.setfilter(self.adaptive_filter.compile())
+
+	def publish_stats(self, ts):
+		self.next_stats = ts + self.stats_interval
+		try:
+			# 内核（pcap 或环形缓冲区的 PACKET_STATISTICS）接收、丢弃的数据包数量，离线文件不支持
+			recv_num, drop_num, ifdrop_num = self.sniffer.stats()
+			self.capture_stats = {'recv': recv_num, 'drop': drop_num, 'ifdrop': ifdrop_num}
+			if hasattr(self.sniffer, 'get_stats'):
+				self.capture_stats.update(self.sniffer.get_stats())
+		except (OSError, AttributeError, ValueError):
+			pass
+		self.stats_callback(self.get_stats())
+
+	def get_stats(self):
+		"""
+		汇总各组件的运行统计
+		"""
+		stats = {
+			'capture': dict(self.capture_stats),
+			'packet': dict(self.packet_stats),
+			'session': self.tcp_stream_cache.get_stats()
+		}
+		if self.cache_size:
+			stats['tcp_cache'] = self.tcp_cache.get_stats()
+			stats['http_cache'] = self.http_cache.get_stats()
+		if self.reassembler is not None:
+			stats['reassembly'] = self.reassembler.get_stats()
+		if self.load_shedder is not None:
+			stats['shed'] = self.load_shedder.get_stats()
+		if self.memory_governor is not None:
+			stats['memory'] = self.memory_governor.get_stats()
+		if self.adaptive_filter is not None:
+			stats['adaptive'] = self.adaptive_filter.get_stats()
+		if self.batch_triage is not None:
+			stats['triage'] = self.batch_triage.get_stats()
+		stats['decompress'] = self.body_decompressor.get_stats()
+		return stats
+
+	def proc_streams(self):
+		"""
+		处理重组完成的服务端响应
+		"""
+		for stream in self.reassembler.pop_ready():
+			data = stream.data()
+			if stream.kind == STREAM_HTTP:
+				src, sport, request_dict, http_cache_key = stream.context
+				if self.proc_http_response(src, sport, request_dict, http_cache_key, data):
+					continue
+			else:
+				src, sport = stream.context
+			self.send_tcp_msg(src, sport, data)
+
+	def proc_http_response(self, src, sport, request_dict, http_cache_key, data):
+		"""
+		解析 HTTP 响应，经过滤和去重后发送资产数据
+		:param src: 服务端 IP（整数形式）
+		:param sport: 服务端端口
+		:param request_dict: decode_request 的返回值
+		:param http_cache_key: 去重缓存键
+		:param data: 响应数据
+		:return: 是否为 HTTP 响应，False 时由调用方按 TCP 数据处理
+		"""
+		# 先只解析响应头，过滤和去重通过后再解码正文
+		response_dict = self.decode_response_header(data)
+		if not response_dict:
+			return False
+
+		# HTTP瞬时重复处理
+		if self.cache_size:
+			self.http_cache.set(http_cache_key, True)
+			
+		response_code = response_dict['status']
+		content_type = response_dict['type']
+
+		# 根据响应状态码和页面类型进行过滤
+		if self.http_filter_json:
+			filter_code = http_filter(self.http_filter_json, 'response_code', response_code) if response_code else False
+			filter_type = http_filter(self.http_filter_json, 'content_type', content_type) if content_type else False
+			if filter_code or filter_type:
+				return True
 		
-		return None
+		data = {
+			'pro': 'HTTP',
+			'tag': self.custom_tag,
+			'ip': self.ip_addr(src),
+			'port': sport,
+			'method': request_dict['method'],
+			'code': response_code,
+			'type': content_type,
+			'server': response_dict['server'],
+			'header': response_dict['headers'],
+			'url': request_dict['uri']
+		}
+
+		# 队列过载时按价值丢弃数据，去除正文时不再解码
+		if self.load_shedder is not None:
+			data['body'] = None
+			if self.load_shedder.shed(data, src << 16 | sport) is None:
+				return True
+			if data['body'] == '':
+				self.send_msg(data)
+				return True
+
+		# 正文解码交给工作线程池，队列已满时在采集线程中直接处理
+		if self.body_executor and self.body_semaphore.acquire(blocking=False):
+			self.body_executor.submit(self.send_http_msg, data, response_dict)
+		else:
+			self.send_http_msg(data, response_dict, False)
+		return True
+
+	def send_tcp_msg(self, src, sport, data):
+		"""
+		发送服务端主动响应或非 HTTP 响应的 TCP 资产数据
+		"""
+		# TCP瞬时重复处理
+		if self.cache_size:
+			self.tcp_cache.set(src << 16 | sport, True)
+
+		msg = {
+			'pro': 'TCP',
+			'tag': self.custom_tag,
+			'ip': self.ip_addr(src),
+			'port': sport,
+			'data': data
+		}
+		if self.load_shedder is not None and self.load_shedder.shed(msg, src << 16 | sport) is None:
+			return
+		# 被去除数据时不再编码
+		msg['data'] = msg['data'].hex() if msg['data'] else ''
+		self.send_msg(msg)
+
+	def send_http_msg(self, data, response_dict, release=True):
+		"""
+		解码响应正文后发送 HTTP 资产数据
+		:param data: 不含正文的资产数据
+		:param response_dict: decode_response_header 的返回值
+		:param release: 是否在工作线程中执行，执行结束后释放任务配额
+		"""
+		try:
+			data['body'] = self.decode_response_body(response_dict)
+			# 工作线程中发送时采样点可能已属于其他数据包，不参与采样
+			self.send_msg(data, not release)
+		finally:
+			if release:
+				self.body_semaphore.release()
+
+	def pkt_decode(self, pkt):
+		"""
+		解析数据包，仅返回 SYN-ACK 和携带数据的 ACK/PSH-ACK 包
+		:param pkt: 原始以太网帧
+		:return: tcp_packet 或 None
+		"""
+		return decode_tcp_packet(pkt)
 
 	def ip_addr(self, ip):
-		return '%d.%d.%d.%d'%tuple(ip)
+		return ip_addr(ip)
 
 	def decode_request(self, data, sip, sport):
 		pos = data.find(b'\r\n\r\n')
@@ -234,50 +544,61 @@ class tcp_http_pcap():
 		return {'method':'', 'uri':'http://{}:{}/'.format(sip, sport), 'headers':'', 'body':''}
 
 	def decode_response(self, data):
+		response_dict = self.decode_response_header(data)
+		if response_dict:
+			response_dict['body'] = self.decode_response_body(response_dict)
+		return response_dict
+
+	def decode_response_header(self, data):
+		"""
+		仅解析响应行和响应头，正文保持原始字节，供过滤和去重判断后再按需解码
+		:param data: 响应数据
+		:return: 响应信息字典，raw_body 为未解码的正文；非 HTTP 响应返回 None
+		"""
 		pos = data.find(b'\r\n\r\n')
-		body = data[pos+4:] if pos > 0 else b''
 		header_str = str(data[:pos] if pos > 0 else data, 'utf-8', 'ignore')
 		m = self.decode_response_regex.match(header_str)
 		if m:
 			headers = m.group(3).strip() if m.group(3) else ''
 			headers_dict = self.parse_headers(headers)
-			if self.return_deep_info and 'transfer-encoding' in headers_dict and headers_dict['transfer-encoding'] == 'chunked':
-				body = self.decode_chunked(body)
-
-			if self.return_deep_info and 'content-encoding' in headers_dict:
-				if headers_dict['content-encoding'] == 'gzip':
-					body = self.decode_gzip(body)
-				elif headers_dict['content-encoding'] == 'br':
-					body = self.decode_brotli(body)
-
 			content_type = '' if 'content-type' not in headers_dict else headers_dict['content-type']
 			server = '' if 'server' not in headers_dict else headers_dict['server']
 			return {
 				'version': m.group(1) if m.group(1) else '',
 				'status': m.group(2) if m.group(2) else '',
 				'headers': headers,
+				'headers_dict': headers_dict,
 				'type': content_type,
 				'server': server,
-				'body': self.decode_body(body, content_type)
+				'raw_body': data[pos+4:] if pos > 0 else b''
 			}
 		
 		return None
 
+	def decode_response_body(self, response_dict):
+		"""
+		还原响应正文：去除 chunked 分块、解压 gzip/deflate/brotli/zstd 并按字符集解码，正文长度不超过 max_body_size
+		:param response_dict: decode_response_header 的返回值
+		:return: 正文字符串
+		"""
+		body = response_dict['raw_body']
+		headers_dict = response_dict['headers_dict']
+		if self.return_deep_info and 'transfer-encoding' in headers_dict and headers_dict['transfer-encoding'] == 'chunked':
+			body = self.decode_chunked(body)
+
+		if self.return_deep_info and 'content-encoding' in headers_dict:
+			# 流式解压，输出达到 max_body_size 后停止
+			body = self.body_decompressor.decompress(body, headers_dict['content-encoding'])[0]
+
+		return self.decode_body(body[:self.max_body_size], response_dict['type'])
+
 	def decode_gzip(self, data):
 		'''
 		还原 HTTP 响应中采用 gzip 压缩的数据
 		标识：
 		Content-Encoding: gzip
 		'''
-		try:
-			buf = io.BytesIO(data)
-			gf = gzip.GzipFile(fileobj = buf)
-			content = gf.read()
-			gf.close()
-
-			return content
-		except:
-			return data
+		return self.body_decompressor.decompress(data, 'gzip')[0]
 
 	def decode_brotli(self, data):
 		'''
@@ -285,10 +606,7 @@ class tcp_http_pcap():
 		标识：
 		Content-Encoding: br
 		'''
-		try:
-			return brotli.decompress(data)
-		except:
-			return data
+		return self.body_decompressor.decompress(data, 'br')[0]
 
 	def decode_chunked(self, data):
 		'''
@@ -298,22 +616,10 @@ class tcp_http_pcap():
 
 		1b
 		{"ret":0, "messge":"error"}
+
+		单次遍历解码，输出不超过 max_body_size
 		'''
-		line_end = data.find(b'\r\n')
-		if line_end > 0:
-			data_len = -1
-			try:
-				data_len = int(data[: line_end], 16)
-				if data_len == 0:
-					return b''
-				
-				if data_len > 0:
-					new_data = data[line_end + 2: line_end + 2 + data_len]
-					return new_data + self.decode_chunked(data[line_end + 2 + data_len + 2: ])
-			except:
-				return data
-			
-		return data
+		return decode_chunked(data, self.max_body_size)
 
 	def decode_body(self, data, content_type):
 		charset_white_list = ['big5','big5-hkscs','cesu-8','euc-jp','euc-kr','gb18030','gb2312','gbk','ibm-thai','ibm00858','ibm01140','ibm01141','ibm01142','ibm01143','ibm01144','ibm01145','ibm01146','ibm01147','ibm01148','ibm01149','ibm037','ibm1026','ibm1047','ibm273','ibm277','ibm278','ibm280','ibm284','ibm285','ibm290','ibm297','ibm420','ibm424','ibm437','ibm500','ibm775','ibm850','ibm852','ibm855','ibm857','ibm860','ibm861','ibm862','ibm863','ibm864','ibm865','ibm866','ibm868','ibm869','ibm870','ibm871','ibm918','iso-10646-ucs-2','iso-2022-cn','iso-2022-jp','iso-2022-jp-2','iso-2022-kr','iso-8859-1','iso-8859-10','iso-8859-13','iso-8859-15','iso-8859-16','iso-8859-2','iso-8859-3','iso-8859-4','iso-8859-5','iso-8859-6','iso-8859-7','iso-8859-8','iso-8859-9','jis_x0201','jis_x0212-1990','koi8-r','koi8-u','shift_jis','tis-620','us-ascii','utf-16','utf-16be','utf-16le','utf-32','utf-32be','utf-32le','utf-8','windows-1250','windows-1251','windows-1252','windows-1253','windows-1254','windows-1255','windows-1256','windows-1257','windows-1258','windows-31j','x-big5-hkscs-2001','x-big5-solaris','x-euc-jp-linux','x-euc-tw','x-eucjp-open','x-ibm1006','x-ibm1025','x-ibm1046','x-ibm1097','x-ibm1098','x-ibm1112','x-ibm1122','x-ibm1123','x-ibm1124','x-ibm1166','x-ibm1364','x-ibm1381','x-ibm1383','x-ibm300','x-ibm33722','x-ibm737','x-ibm833','x-ibm834','x-ibm856','x-ibm874','x-ibm875','x-ibm921','x-ibm922','x-ibm930','x-ibm933','x-ibm935','x-ibm937','x-ibm939','x-ibm942','x-ibm942c','x-ibm943','x-ibm943c','x-ibm948','x-ibm949','x-ibm949c','x-ibm950','x-ibm964','x-ibm970','x-iscii91','x-iso-2022-cn-cns','x-iso-2022-cn-gb','x-iso-8859-11','x-jis0208','x-jisautodetect','x-johab','x-macarabic','x-maccentraleurope','x-maccroatian','x-maccyrillic','x-macdingbat','x-macgreek','x-machebrew','x-maciceland','x-macroman','x-macromania','x-macsymbol','x-macthai','x-macturkish','x-macukraine','x-ms932_0213','x-ms950-hkscs','x-ms950-hkscs-xp','x-mswin-936','x-pck','x-sjis','x-sjis_0213','x-utf-16le-bom','x-utf-32be-bom','x-utf-32le-bom','x-windows-50220','x-windows-50221','x-windows-874','x-windows-949','x-windows-950','x-windows-iso2022jp']
@@ -340,10 +646,26 @@ class tcp_http_pcap():
 				headers[_[:pos].lower()] = _[pos+1:].strip()
 		return headers
 
-	def send_msg(self, data):
+	def send_msg(self, data, trace=True):
+		"""
+		将资产数据写入发送队列
+		:param data: 资产数据字典
+		:param trace: 是否可作为延迟采样数据（在采集线程中发送）
+		"""
 		result = json.dumps(data)
 		if self.debug:
 			print(result)
-		if len(self.work_queue) >= self.max_queue_size*0.95:
+		trace_point = self.trace_point
+		if trace_point is not None and trace:
+			self.trace_point = None
+			self.next_trace = trace_point[0] + self.trace_interval
+			result = trace_msg(result, trace_point[0], trace_point[1])
+		# 启用分级丢弃时队列不再整体清空
+		if self.load_shedder is None and len(self.work_queue) >= self.max_queue_size*0.95:
 			self.work_queue.clear()
-		self.work_queue.append(result)
\ No newline at end of file
+		# 跨进程去重键：HTTP 与 http_cache 的键相同（请求方法:URL），TCP 为 IP:端口
+		if data['pro'] == 'HTTP':
+			dedup_key = ('HTTP', '{}:{}'.format(data['method'], data['url']))
+		else:
+			dedup_key = ('TCP', '{}:{}'.format(data['ip'], data['port']))
+		self.work_queue.append(result, dedup_key)
\ No newline at end of file
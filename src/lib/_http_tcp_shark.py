@@ -3,15 +3,18 @@
 import pyshark
 import json
 import time
-import re
+import struct
 import traceback
 import concurrent.futures
-from cacheout import Cache, LRUCache
-from ._util import proc_body_str, proc_data_str
+from cacheout import Cache
+from ._util import proc_data_str, http_filter, decode_body_str
+from ._dedup_cache import new_dedup_cache, save_snapshot, load_snapshot
+from ._load_shed import load_shedder
+from ._latency_trace import trace_msg
 
 class tcp_http_shark():
 
-	def __init__(self, work_queue, interface, custom_tag, return_deep_info, http_filter_json, cache_size, session_size, bpf_filter, timeout, debug):
+	def __init__(self, work_queue, interface, custom_tag, return_deep_info, http_filter_json, cache_size, session_size, bpf_filter, timeout, debug, input_file=None, display_filter='tcp', dedup_mode='hash', dedup_fpr=0.001, snapshot_file=None, snapshot_interval=300, max_queue_size=50000, load_shed=False, stats_callback=None, stats_interval=1, trace_interval=0):
 		"""
 		构造函数
 		:param work_queue: 捕获资产数据消息发送队列
@@ -22,8 +25,19 @@ class tcp_http_shark():
 		:param cache_size: 缓存的已处理数据条数，120秒内重复的数据将不会发送Syslog
 		:param session_size: 缓存的HTTP/TCP会话数量，16秒未使用的会话将被自动清除
 		:param bpf_filter: 数据包底层过滤器
-		:param timeout: 采集程序的运行超时时间，默认为启动后1小时自动退出
+		:param timeout: 采集程序的运行超时时间，默认为启动后1小时自动退出，0 为不退出
 		:param debug: 调试开关
+		:param input_file: 离线数据包文件（pcap/pcapng），指定后从文件读取数据包代替网卡实时采集
+		:param display_filter: 离线读取文件时使用的 tshark 显示过滤器
+		:param dedup_mode: 去重缓存类型，hash - 64 位哈希精确去重，bloom - 按时间衰减的 Bloom Filter
+		:param dedup_fpr: bloom 去重缓存的误判率
+		:param snapshot_file: 去重缓存快照文件，启动时恢复，运行中定期写入，None 为不保存
+		:param snapshot_interval: 去重缓存快照的写入间隔（单位秒）
+		:param max_queue_size: 发送队列最大长度
+		:param load_shed: 发送队列过载时按价值分级丢弃数据（先去除正文/数据，再丢弃已知服务的数据）
+		:param stats_callback: 运行统计回调，每 stats_interval 秒以 get_stats() 的结果调用，None 为不统计
+		:param stats_interval: 运行统计回调间隔（单位秒）
+		:param trace_interval: 延迟采样间隔（单位秒），每个间隔内标记一条资产数据，记录其从捕获到发送各阶段的耗时，0 为不采样
 		"""
 		self.work_queue = work_queue
 		self.debug = debug
@@ -35,38 +49,78 @@ class tcp_http_shark():
 		self.return_deep_info = return_deep_info
 		self.custom_tag = custom_tag
 		self.interface = interface
-		self.pktcap = pyshark.LiveCapture(interface=self.interface, bpf_filter=self.bpf_filter, use_json=False, debug=self.debug)
+		self.input_file = input_file
+		if self.input_file:
+			# 文件读取不支持 BPF 过滤器，改用显示过滤器；不保留已处理的数据包
+			self.pktcap = pyshark.FileCapture(self.input_file, display_filter=display_filter, keep_packets=False, use_json=False, debug=self.debug)
+		else:
+			self.pktcap = pyshark.LiveCapture(interface=self.interface, bpf_filter=self.bpf_filter, use_json=False, debug=self.debug)
 		if self.session_size:
 			self.http_stream_cache = Cache(maxsize=self.session_size, ttl=16, timer=time.time, default=None)
 			self.tcp_stream_cache = Cache(maxsize=self.session_size, ttl=16, timer=time.time, default=None)
 		if self.cache_size:
-			self.http_cache = LRUCache(maxsize=self.cache_size, ttl=120, timer=time.time, default=None)
-			self.tcp_cache = LRUCache(maxsize=self.cache_size, ttl=120, timer=time.time, default=None)
-		# 检测页面编码的正则表达式
-		self.encode_regex = re.compile(rb'<meta [^>]*?charset=["\']?([a-z\-\d]+)["\'>]?', re.I)
+			self.http_cache = new_dedup_cache(dedup_mode, self.cache_size, ttl=120, fpr=dedup_fpr)
+			self.tcp_cache = new_dedup_cache(dedup_mode, self.cache_size, ttl=120, fpr=dedup_fpr)
+		self.snapshot_file = snapshot_file
+		self.snapshot_interval = snapshot_interval
+		self.next_snapshot = float('inf')
+		if self.snapshot_file and self.cache_size:
+			self.next_snapshot = time.time() + self.snapshot_interval
+			try:
+				print('[*] Dedup snapshot loaded: {}'.format(load_snapshot(self.snapshot_file, self.dedup_caches())))
+			except (OSError, ValueError, struct.error):
+				traceback.print_exc()
+		self.load_shedder = load_shedder(self.work_queue, max_queue_size, max(self.cache_size, 65536)) if load_shed else None
+		# 数据包计数：http、tcp - 按协议处理的数据包，skip - 非 IP 或非 TCP 数据包
+		self.packet_stats = {
+			'skip': 0,
+			'http': 0,
+			'tcp': 0
+		}
+		self.stats_callback = stats_callback
+		self.stats_interval = stats_interval
+		self.next_stats = float('inf') if self.stats_callback is None else 0
+		self.trace_interval = trace_interval
+		self.next_trace = 0 if self.trace_interval > 0 else float('inf')
 
-	def http_filter(self, key, value):
-		"""
-		检查字符串中是否包含特定的规则
-		:param key: 规则键名，response_code（状态码）或 content_type（内容类型）
-		:param value: 要检查的字符串
-		:return: True - 包含， False - 不包含
-		"""
-		if key in self.http_filter_json:
-			for rule in self.http_filter_json[key]:
-				if rule in value:
-					return True
-		return False
-	
 	def run(self):
 		"""
 		入口函数
 		"""
 		try:
-			self.pktcap.apply_on_packets(self.proc_packet,timeout=self.timeout)
+			self.pktcap.apply_on_packets(self.proc_packet,timeout=None if self.input_file or not self.timeout else self.timeout)
 		except concurrent.futures.TimeoutError:
 			print("\nTimeoutError.")
 	
+	def dedup_caches(self):
+		return {'tcp': self.tcp_cache, 'http': self.http_cache}
+
+	def save_snapshot(self):
+		"""
+		将去重缓存写入快照文件，运行中按 snapshot_interval 周期调用，退出前再调用一次
+		"""
+		if not self.snapshot_file or not self.cache_size:
+			return
+		self.next_snapshot = time.time() + self.snapshot_interval
+		try:
+			save_snapshot(self.snapshot_file, self.dedup_caches())
+		except OSError:
+			traceback.print_exc()
+
+	def get_stats(self):
+		"""
+		汇总各组件的运行统计
+		"""
+		stats = {'packet': dict(self.packet_stats)}
+		if self.cache_size:
+			stats['tcp_cache'] = self.tcp_cache.get_stats()
+			stats['http_cache'] = self.http_cache.get_stats()
+		if self.session_size:
+			stats['session'] = {'http': len(self.http_stream_cache), 'tcp': len(self.tcp_stream_cache)}
+		if self.load_shedder is not None:
+			stats['shed'] = self.load_shedder.get_stats()
+		return stats
+
 	def proc_packet(self, pkt):
 		"""
 		全局数据包处理：识别、路由及结果发送
@@ -74,20 +128,44 @@ class tcp_http_shark():
 		:return: JSON or None
 		"""
 		try:
+			now = time.time()
+			if self.next_snapshot <= now:
+				self.save_snapshot()
+			if self.next_stats <= now:
+				self.next_stats = now + self.stats_interval
+				self.stats_callback(self.get_stats())
+
 			pkt_json = None
 			pkt_dict = dir(pkt)
 
 			if 'ip' in pkt_dict:
 				if 'http' in pkt_dict:
+					self.packet_stats['http'] += 1
 					pkt_json = self.proc_http(pkt)
 				elif 'tcp' in pkt_dict:
+					self.packet_stats['tcp'] += 1
 					pkt_json = self.proc_tcp(pkt)
+				else:
+					self.packet_stats['skip'] += 1
+			else:
+				self.packet_stats['skip'] += 1
+
+			if pkt_json and self.load_shedder is not None:
+				pkt_json = self.load_shedder.shed(pkt_json, '{}:{}'.format(pkt_json['ip'], pkt_json['port']))
 
 			if pkt_json:
 				result = json.dumps(pkt_json)
 				if self.debug:
 					print(result)
-				self.work_queue.append(result)
+				if self.next_trace <= now:
+					self.next_trace = now + self.trace_interval
+					result = trace_msg(result, float(pkt.sniff_timestamp), now)
+				# 跨进程去重键：HTTP 与 http_cache 的键相同（URL），TCP 为 IP:端口
+				if pkt_json['pro'] == 'HTTP':
+					dedup_key = ('HTTP', pkt_json['url'])
+				else:
+					dedup_key = ('TCP', '{}:{}'.format(pkt_json['ip'], pkt_json['port']))
+				self.work_queue.append(result, dedup_key)
 		except:
 			traceback.print_exc()
 	
@@ -147,14 +225,14 @@ class tcp_http_shark():
 
 			if 'response_code' in http_dict:
 				if self.http_filter_json:
-					return_status = self.http_filter('response_code', pkt.http.response_code)
+					return_status = http_filter(self.http_filter_json, 'response_code', pkt.http.response_code)
 					if return_status:
 						return None
 				pkt_json["code"] = pkt.http.response_code
 			
 			if 'content_type' in http_dict:
 				if self.http_filter_json:
-					return_status = self.http_filter('content_type', pkt.http.content_type)
+					return_status = http_filter(self.http_filter_json, 'content_type', pkt.http.content_type)
 					if return_status:
 						return None
 				pkt_json["type"] = pkt.http.content_type.lower()
@@ -166,12 +244,6 @@ class tcp_http_shark():
 
 			# 开启深度数据分析，返回header和body等数据
 			if self.return_deep_info:
-				charset = 'utf-8'
-				# 检测 Content-Type 中的编码信息
-				if 'type' in pkt_json and 'charset=' in pkt_json["type"]:
-					charset = pkt_json["type"][pkt_json["type"].find('charset=')+8:].strip().lower()
-					if not charset :
-						charset = 'utf-8'
 				if 'payload' in dir(pkt.tcp):
 					payload = bytes.fromhex(str(pkt.tcp.payload).replace(':', ''))
 					if payload.find(b'HTTP/') == 0:
@@ -190,15 +262,7 @@ class tcp_http_shark():
 					data = ''
 
 				if data:
-					# 检测页面 Meta 中的编码信息
-					data_head = data[:500] if data.find(b'</head>', 0, 1024) == -1 else data[:data.find(b'</head>')]
-					match = self.encode_regex.search(data_head)
-					if match:
-						charset = str(match.group(1).strip().lower(), 'utf-8', 'ignore')
-					
-					response_body = proc_body_str(str(data, charset, 'ignore'), 16*1024)
-					# response_body = self.proc_body_json(str(data, charset, 'ignore'), 16*1024)
-					pkt_json["body"] = response_body
+					pkt_json["body"] = decode_body_str(data, pkt_json['type'], 16*1024)
 				else:
 					pkt_json["body"] = ''
 			
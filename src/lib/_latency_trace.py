@@ -0,0 +1,78 @@
+#-*- coding:utf-8 -*-
+
+import time
+import collections
+
+# capture - 数据包时间戳到采集线程开始处理（内核缓冲及采集循环积压）
+# decode - 采集线程开始处理到写入发送队列（解析、重组、正文解码）
+# queue - 写入发送队列到发送线程取出
+# send - 发送线程取出到写入套接字完成
+# total - 数据包时间戳到写入套接字完成
+TRACE_STAGES = ('capture', 'decode', 'queue', 'send', 'total')
+
+class traced_msg(str):
+	"""
+	携带采样时间戳的资产数据，对发送队列和发送对象而言仍是普通字符串，
+	stamps 为 (数据包时间戳, 采集线程开始处理时间, 写入发送队列时间)
+	"""
+
+def trace_msg(msg, packet_ts, loop_time):
+	"""
+	将资产数据标记为采样数据，由采集引擎在写入发送队列前调用
+	:param msg: 资产数据（JSON 字符串）
+	:param packet_ts: 数据包的捕获时间戳
+	:param loop_time: 采集线程开始处理该数据包的时间
+	"""
+	msg = traced_msg(msg)
+	msg.stamps = (packet_ts, loop_time, time.time())
+	return msg
+
+class latency_tracer():
+	"""
+	端到端延迟统计：发送线程在写入套接字后记录采样数据各阶段的耗时，
+	每个阶段保留最近 window 个样本用于计算 p50/p99，最大值和样本数按全程累计
+	"""
+
+	def __init__(self, window=1024):
+		self.samples = dict((stage, collections.deque(maxlen=window)) for stage in TRACE_STAGES)
+		self.max_latency = dict((stage, 0.0) for stage in TRACE_STAGES)
+		self.count = 0
+
+	def record(self, msgs, get_time, send_time):
+		"""
+		记录一批数据中的采样数据，由发送线程调用
+		:param msgs: get_batch 取出的数据
+		:param get_time: 取出该批数据的时间
+		:param send_time: 该批数据发送完成的时间
+		"""
+		for msg in msgs:
+			if type(msg) is not traced_msg:
+				continue
+			packet_ts, loop_time, queue_time = msg.stamps
+			self.add('capture', loop_time - packet_ts)
+			self.add('decode', queue_time - loop_time)
+			self.add('queue', get_time - queue_time)
+			self.add('send', send_time - get_time)
+			self.add('total', send_time - packet_ts)
+			self.count += 1
+
+	def add(self, stage, latency):
+		self.samples[stage].append(latency)
+		if latency > self.max_latency[stage]:
+			self.max_latency[stage] = latency
+
+	def get_stats(self):
+		"""
+		:return: 阶段 -> p50、p99、max（单位毫秒）
+		"""
+		stats = {'count': self.count}
+		for stage in TRACE_STAGES:
+			samples = sorted(self.samples[stage])
+			if not samples:
+				continue
+			stats[stage] = {
+				'p50': round(samples[len(samples) // 2] * 1000, 3),
+				'p99': round(samples[min(int(len(samples) * 0.99), len(samples) - 1)] * 1000, 3),
+				'max': round(self.max_latency[stage] * 1000, 3)
+			}
+		return stats
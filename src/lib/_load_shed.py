@@ -0,0 +1,113 @@
+#-*- coding:utf-8 -*-
+
+from ._dedup_cache import hash_cache
+
+# 资产数据的价值分类
+# service - 首次发现的服务（IP:端口），url - 已知服务上的新 HTTP URL，
+# repeat - 已知服务的其他数据（去重缓存过期后再次上报的 TCP/HTTPS 服务）
+SHED_SERVICE = 'service'
+SHED_URL = 'url'
+SHED_REPEAT = 'repeat'
+SHED_CLASSES = (SHED_SERVICE, SHED_URL, SHED_REPEAT)
+
+# 发送队列压力（0~1）达到阈值后依次：去除正文/数据、丢弃 repeat、丢弃 url；首次发现的服务不丢弃
+BODY_WATERMARK = 0.5
+REPEAT_WATERMARK = 0.7
+URL_WATERMARK = 0.85
+SHED_LEVELS = (BODY_WATERMARK, REPEAT_WATERMARK, URL_WATERMARK)
+SHED_HYSTERESIS = 0.1
+# 深度信息中体积最大的字段，压力下最先去除
+BODY_FIELDS = ('body', 'data')
+
+class load_shedder():
+	"""
+	发送队列过载时按价值分级丢弃数据，代替队列满后整体清空：
+	先去除 body/data 等深度信息只保留资产记录，压力继续升高时再丢弃已知服务的重复数据和新 URL
+	已知服务通过 hash_cache 记录（按服务端 IP:端口），非线程安全，每个采集进程各自持有
+	"""
+
+	def __init__(self, work_queue, max_queue_size, service_size=65536, service_ttl=3600):
+		"""
+		构造函数
+		:param work_queue: 发送队列，提供 pressure() 时以其为准，否则按 长度 / max_queue_size 计算
+		:param max_queue_size: 发送队列最大长度
+		:param service_size: 记录的已知服务数量
+		:param service_ttl: 已知服务的有效期（单位秒），超过后再次出现按首次发现处理
+		"""
+		self.work_queue = work_queue
+		self.max_queue_size = max(max_queue_size, 1)
+		self.services = hash_cache(service_size, service_ttl)
+		self.level = 0
+		self.stats = dict((cls, {'send': 0, 'body': 0, 'drop': 0}) for cls in SHED_CLASSES)
+
+	def pressure(self):
+		pressure = getattr(self.work_queue, 'pressure', None)
+		if pressure is not None:
+			return pressure()
+		return len(self.work_queue) / self.max_queue_size
+
+	def shed_body(self):
+		"""
+		当前压力下是否去除正文，供调用方跳过正文解码
+		"""
+		return self.pressure() >= BODY_WATERMARK
+
+	def classify(self, service_key, pro):
+		"""
+		:param service_key: 服务端 IP:端口（整数或字符串形式）
+		:param pro: 资产数据的协议字段
+		"""
+		services = self.services
+		if not services.get(service_key):
+			services.set(service_key)
+			return SHED_SERVICE
+		return SHED_URL if pro == 'HTTP' else SHED_REPEAT
+
+	def shed(self, data, service_key):
+		"""
+		按队列压力处理一条资产数据
+		:param data: 资产数据字典，可能被去除 body/data 字段
+		:param service_key: 服务端 IP:端口（整数或字符串形式）
+		:return: 处理后的资产数据，被丢弃时返回 None
+		"""
+		cls = self.classify(service_key, data.get('pro'))
+		stats = self.stats[cls]
+		pressure = self.pressure()
+		# 压力回落到阈值以下 SHED_HYSTERESIS 后才降低级别，避免在阈值附近反复切换
+		level = self.level
+		while level < len(SHED_LEVELS) and pressure >= SHED_LEVELS[level]:
+			level += 1
+		while level > 0 and pressure < SHED_LEVELS[level - 1] - SHED_HYSTERESIS:
+			level -= 1
+		if level != self.level:
+			self.level = level
+			print('[!] Load shedding level {} (queue pressure {:.2f}), shed: {}'.format(level, pressure, self.format_stats()))
+
+		if level:
+			if (cls == SHED_REPEAT and level >= 2) or (cls == SHED_URL and level >= 3):
+				stats['drop'] += 1
+				return None
+			shed_body = False
+			for field in BODY_FIELDS:
+				if field in data:
+					data[field] = ''
+					shed_body = True
+			if shed_body:
+				stats['body'] += 1
+		stats['send'] += 1
+		return data
+
+	def memory_size(self):
+		return self.services.memory_size()
+
+	def shrink(self, fraction):
+		return self.services.shrink(fraction)
+
+	def format_stats(self):
+		return ', '.join('{} body {} drop {}'.format(cls, self.stats[cls]['body'], self.stats[cls]['drop']) for cls in SHED_CLASSES)
+
+	def get_stats(self):
+		stats = dict((cls, dict(self.stats[cls])) for cls in SHED_CLASSES)
+		stats['level'] = self.level
+		stats['services'] = len(self.services)
+		return stats
@@ -0,0 +1,96 @@
+#-*- coding:utf-8 -*-
+
+import os
+import collections
+
+try:
+	PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (ValueError, OSError, AttributeError):
+	PAGE_SIZE = 4096
+
+def rss_bytes():
+	"""
+	读取当前进程的常驻内存（RSS），非 Linux 系统返回 0
+	"""
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * PAGE_SIZE
+	except (OSError, ValueError, IndexError):
+		return 0
+
+class memory_governor():
+	"""
+	内存预算控制：定期检查进程内存，超出预算时按注册顺序（优先级）收缩各数据结构，
+	被管理的对象需提供 memory_size()（估算字节数）和 shrink(fraction)（按比例淘汰最早的数据）
+	Python 释放的内存不一定立即归还操作系统，RSS 高于 启动时 RSS + 各结构估算值 时以后者为准，避免反复收缩
+	"""
+
+	def __init__(self, budget, interval=1, target=0.9):
+		"""
+		构造函数
+		:param budget: 内存预算（单位字节）
+		:param interval: 检查间隔（单位秒）
+		:param target: 超出预算后收缩到预算的比例
+		"""
+		self.budget = budget
+		self.interval = interval
+		self.target = target
+		self.structures = collections.OrderedDict()
+		self.base_rss = rss_bytes()
+		self.next_check = 0
+		self.rss = self.base_rss
+		self.sizes = {}
+		self.stats = {
+			'check': 0,
+			'pressure': 0
+		}
+		self.shrink_stats = {}
+
+	def register(self, name, obj):
+		"""
+		注册被管理的数据结构，先注册的优先收缩
+		"""
+		self.structures[name] = obj
+		self.shrink_stats[name] = 0
+
+	def check(self, now):
+		"""
+		检查内存，超出预算时收缩，通常以数据包时间戳调用
+		:return: 是否执行了收缩
+		"""
+		self.next_check = now + self.interval
+		self.stats['check'] += 1
+		self.rss = rss_bytes()
+		self.sizes = collections.OrderedDict((name, obj.memory_size()) for name, obj in self.structures.items())
+		used = min(self.rss, self.base_rss + sum(self.sizes.values())) if self.rss else sum(self.sizes.values())
+		if used <= self.budget:
+			return False
+
+		self.stats['pressure'] += 1
+		need_free = used - self.budget * self.target
+		shrunk = []
+		for name, obj in self.structures.items():
+			size = self.sizes[name]
+			if need_free <= 0:
+				break
+			if size <= 0:
+				continue
+			num = obj.shrink(min(need_free / size, 1.0))
+			if num:
+				self.shrink_stats[name] += num
+				shrunk.append('{} {}'.format(name, num))
+				need_free -= min(size, need_free)
+		print('[!] Memory over budget: rss {:.1f}MB, budget {:.1f}MB, {}; shrunk: {}'.format(
+			self.rss / 1048576.0, self.budget / 1048576.0, self.format_sizes(), ', '.join(shrunk) or 'none'))
+		return True
+
+	def format_sizes(self):
+		return ', '.join('{} {:.1f}MB'.format(name, size / 1048576.0) for name, size in self.sizes.items())
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['rss'] = self.rss
+		stats['budget'] = self.budget
+		stats['size'] = dict(self.sizes)
+		stats['shrink'] = dict(self.shrink_stats)
+		return stats
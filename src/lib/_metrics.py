@@ -0,0 +1,133 @@
+#-*- coding:utf-8 -*-
+
+import os
+import re
+import threading
+import collections
+import http.server
+import socketserver
+
+METRIC_PREFIX = 'passets'
+metric_name_regex = re.compile(r'[^a-zA-Z0-9_]')
+
+def flatten_stats(stats, prefix=''):
+	"""
+	将嵌套的统计字典展开为 (名称, 数值) 列表，名称按层级以下划线连接，忽略非数值项
+	"""
+	result = []
+	for key, value in stats.items():
+		name = '{}_{}'.format(prefix, key) if prefix else str(key)
+		if isinstance(value, dict):
+			result.extend(flatten_stats(value, name))
+		elif isinstance(value, bool):
+			result.append((name, int(value)))
+		elif isinstance(value, (int, float)):
+			result.append((name, value))
+	return result
+
+class metrics_registry():
+	"""
+	运行指标汇总：各组件以 get_stats 形式的函数注册，按需采集，
+	输出 Prometheus 文本格式（/metrics），或按组件输出到日志
+	"""
+
+	def __init__(self):
+		# 组件名称 -> (采集函数, 标签名)
+		self.collectors = collections.OrderedDict()
+
+	def register(self, name, func, label=None):
+		"""
+		注册组件
+		:param name: 组件名称，作为指标名的前缀
+		:param func: 采集函数，返回统计字典（可嵌套）
+		:param label: 指定后 func 返回 标签值 -> 统计字典，例如按发送线程、采集进程区分
+		"""
+		self.collectors[name] = (func, label)
+
+	def collect(self):
+		"""
+		:return: (组件名称, 标签名, 标签值, 统计字典) 列表
+		"""
+		result = []
+		for name, (func, label) in self.collectors.items():
+			try:
+				stats = func()
+			except Exception as e:
+				print('[!] Metrics collect error: {}: {}'.format(name, e))
+				continue
+			if label is None:
+				result.append((name, None, None, stats))
+			else:
+				for label_value, label_stats in sorted(stats.items()):
+					result.append((name, label, label_value, label_stats))
+		return result
+
+	def render(self):
+		"""
+		输出 Prometheus 文本格式，同名指标的样本连续排列
+		"""
+		metrics = collections.OrderedDict()
+		for name, label, label_value, stats in self.collect():
+			labels = '{{{}="{}"}}'.format(label, label_value) if label else ''
+			for key, value in flatten_stats(stats, name):
+				metric = metric_name_regex.sub('_', '{}_{}'.format(METRIC_PREFIX, key))
+				metrics.setdefault(metric, []).append((labels, value))
+		lines = []
+		for metric, samples in metrics.items():
+			lines.append('# TYPE {} untyped'.format(metric))
+			for labels, value in samples:
+				lines.append('{}{} {}'.format(metric, labels, value))
+		return '\n'.join(lines) + '\n'
+
+	def log(self, names=None):
+		"""
+		按组件输出统计信息
+		:param names: 输出的组件名称，None 为全部
+		"""
+		for name, label, label_value, stats in self.collect():
+			if names is None or name in names:
+				print('[*] {}{}: {}'.format(name, '-{}'.format(label_value) if label else '', stats))
+
+class metrics_handler(http.server.BaseHTTPRequestHandler):
+	registry = None
+
+	def do_GET(self):
+		if self.path.split('?')[0] not in ('/', '/metrics'):
+			self.send_error(404)
+			return
+		body = self.registry.render().encode()
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+class unix_http_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+# http.server.ThreadingHTTPServer 需要 Python 3.7，在此同样组合
+class threading_http_server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+	daemon_threads = True
+
+def start_metrics_server(registry, listen):
+	"""
+	在后台线程中启动指标 HTTP 服务
+	:param registry: metrics_registry
+	:param listen: [地址:]端口（地址默认 127.0.0.1），或 Unix socket 路径（包含 /）
+	:return: 服务对象
+	"""
+	handler = type('registry_metrics_handler', (metrics_handler,), {'registry': registry})
+	if '/' in listen:
+		if os.path.exists(listen):
+			os.remove(listen)
+		server = unix_http_server(listen, handler)
+	else:
+		host, _, port = listen.rpartition(':')
+		server = threading_http_server((host or '127.0.0.1', int(port)), handler)
+	server_thread = threading.Thread(target=server.serve_forever)
+	server_thread.setDaemon(True)
+	server_thread.start()
+	return server
@@ -0,0 +1,137 @@
+#-*- coding:utf-8 -*-
+
+import sys
+import collections
+import threading
+import time
+
+# 启用磁盘溢出时，内存队列达到该比例后新数据写入磁盘；低于采集引擎清空队列的阈值（95%），队列不会再被清空
+SPILL_WATERMARK = 0.9
+
+class msg_queue():
+	"""
+	资产数据发送队列，对采集引擎保持与 collections.deque 相同的 append/len/clear 接口，
+	发送线程通过 get_batch 阻塞等待，按批次取出数据
+	指定 spill 后，内存队列接近上限时数据按顺序写入磁盘，内存队列取空后再从磁盘读出
+	"""
+
+	def __init__(self, max_queue_size, batch_size=100, batch_wait=0.05, spill=None):
+		"""
+		构造函数
+		:param max_queue_size: 队列最大长度，超出后丢弃最早的数据
+		:param batch_size: 每批次最多取出的数据条数
+		:param batch_wait: 不足一批时最多等待的时间（单位秒）
+		:param spill: 磁盘溢出缓冲区（spill_ring），None 为不启用
+		"""
+		self.max_queue_size = max_queue_size
+		self.batch_size = max(batch_size, 1)
+		self.batch_wait = batch_wait
+		self.queue = collections.deque(maxlen=max_queue_size)
+		self.cond = threading.Condition(threading.Lock())
+		self.clear_num = 0
+		self.shrink_num = 0
+		self.drop_num = 0
+		self.spill = spill
+		self.spill_size = int(max_queue_size * SPILL_WATERMARK)
+
+	def append(self, msg, dedup_key=None):
+		"""
+		:param msg: 资产数据（JSON 字符串）
+		:param dedup_key: 多进程汇总时的跨进程去重键，发送队列不使用
+		"""
+		with self.cond:
+			spill = self.spill
+			# 磁盘中仍有积压时也写入磁盘，保持发送顺序
+			if spill is not None and (len(self.queue) >= self.spill_size or spill.pending_size()):
+				if spill.write(msg):
+					self.cond.notify()
+				return
+			# 队列已满时 deque 会挤出最早的数据，计入丢弃数量
+			if len(self.queue) == self.max_queue_size:
+				self.drop_num += 1
+			self.queue.append(msg)
+			# 仅在队列由空变为非空或凑满一批时唤醒，避免逐条唤醒发送线程
+			queue_len = len(self.queue)
+			if queue_len == 1 or queue_len % self.batch_size == 0:
+				self.cond.notify()
+
+	def __len__(self):
+		return len(self.queue)
+
+	def clear(self):
+		with self.cond:
+			self.queue.clear()
+			self.clear_num += 1
+
+	def spill_pending(self):
+		return self.spill is not None and self.spill.pending_size() > 0
+
+	def pressure(self):
+		"""
+		队列压力（0~1）：未启用磁盘溢出时为队列长度占比；启用后内存队列只是缓冲，按磁盘占用比例计算
+		"""
+		if self.spill is not None:
+			return self.spill.pending_size() / self.spill.max_size
+		return len(self.queue) / self.max_queue_size
+
+	def get_stats(self):
+		stats = {
+			'size': len(self.queue),
+			'clear': self.clear_num,
+			'shrink': self.shrink_num,
+			'drop': self.drop_num
+		}
+		if self.spill is not None:
+			for key, value in self.spill.get_stats().items():
+				stats['spill_' + key] = value
+		return stats
+
+	def memory_size(self):
+		"""
+		估算占用的内存字节数，数据大小按队首、队尾两条的平均值计算
+		"""
+		with self.cond:
+			if not self.queue:
+				return 0
+			msg_size = (sys.getsizeof(self.queue[0]) + sys.getsizeof(self.queue[-1])) / 2
+			return int(len(self.queue) * (msg_size + 8))
+
+	def shrink(self, fraction):
+		"""
+		丢弃最早的 fraction 比例的数据
+		:return: 丢弃的数据条数
+		"""
+		with self.cond:
+			num = int(len(self.queue) * fraction)
+			popleft = self.queue.popleft
+			for _ in range(num):
+				popleft()
+			self.shrink_num += num
+			return num
+
+	def get_batch(self, timeout=None):
+		"""
+		阻塞等待并取出一批数据：队列为空时休眠，有数据后最多再等待 batch_wait 秒凑满 batch_size 条
+		:param timeout: 队列为空时的最长等待时间，None 为一直等待
+		:return: 数据列表，超时返回空列表
+		"""
+		with self.cond:
+			if not self.queue and not self.spill_pending():
+				self.cond.wait(timeout)
+				if not self.queue and not self.spill_pending():
+					return []
+			if not self.queue:
+				# 内存队列已取空，按写入顺序读出磁盘中的积压
+				return self.spill.read(self.batch_size)
+
+			if len(self.queue) < self.batch_size and self.batch_wait > 0:
+				deadline = time.monotonic() + self.batch_wait
+				while len(self.queue) < self.batch_size:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						break
+					self.cond.wait(remaining)
+
+			batch_num = min(len(self.queue), self.batch_size)
+			popleft = self.queue.popleft
+			return [popleft() for _ in range(batch_num)]
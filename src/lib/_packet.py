@@ -0,0 +1,93 @@
+#-*- coding:utf-8 -*-
+
+import struct
+
+ETH_TYPE_IP = 0x0800
+# 802.1Q、802.1ad（QinQ）及旧式 QinQ 标签
+ETH_TYPE_VLAN = (0x8100, 0x88a8, 0x9100)
+IP_PROTO_TCP = 6
+
+# SYN-ACK，以及携带数据的 ACK、PSH-ACK、FIN-PSH-ACK
+FLAG_SYN_ACK = 0x12
+FLAG_DATA = (0x10, 0x18, 0x19)
+
+unpack_tcp_header = struct.Struct('!HHII').unpack_from
+unpack_ip_addr = struct.Struct('!II').unpack_from
+
+class tcp_packet():
+	"""
+	解析后的 TCP 数据包记录，src/dst 为整数形式的 IPv4 地址，仅在输出资产时格式化为字符串
+	"""
+	__slots__ = ('src', 'sport', 'dst', 'dport', 'seq', 'ack', 'flags', 'data')
+
+	def __init__(self, src, sport, dst, dport, seq, ack, flags, data):
+		self.src = src
+		self.sport = sport
+		self.dst = dst
+		self.dport = dport
+		self.seq = seq
+		self.ack = ack
+		self.flags = flags
+		self.data = data
+
+def decode_tcp_packet(buf):
+	"""
+	按固定偏移直接读取 Ethernet（含 VLAN/QinQ）、IPv4、TCP 头部，
+	在创建任何对象之前丢弃不关心的数据包
+	:param buf: 原始以太网帧（bytes 或 memoryview）
+	:return: tcp_packet 或 None
+	"""
+	buf_len = len(buf)
+	if buf_len < 54:
+		return None
+
+	eth_type = buf[12] << 8 | buf[13]
+	offset = 14
+	while eth_type in ETH_TYPE_VLAN:
+		# 标签之后仍需容纳 IPv4 与 TCP 最小头部
+		if buf_len < offset + 44:
+			return None
+		eth_type = buf[offset + 2] << 8 | buf[offset + 3]
+		offset += 4
+	if eth_type != ETH_TYPE_IP:
+		return None
+
+	ver_ihl = buf[offset]
+	if ver_ihl >> 4 != 4 or buf[offset + 9] != IP_PROTO_TCP:
+		return None
+	# 非首个分片不含 TCP 头
+	if buf[offset + 6] & 0x1f or buf[offset + 7]:
+		return None
+
+	tcp_offset = offset + (ver_ihl & 0x0f) * 4
+	if buf_len < tcp_offset + 20:
+		return None
+	flags = buf[tcp_offset + 13]
+	if flags != FLAG_SYN_ACK and flags not in FLAG_DATA:
+		return None
+
+	data_offset = tcp_offset + (buf[tcp_offset + 12] >> 4) * 4
+	# 以 IP 总长度为准去掉以太网填充，网卡 TSO 时总长度可能为0
+	ip_len = buf[offset + 2] << 8 | buf[offset + 3]
+	data_end = min(offset + ip_len, buf_len) if ip_len else buf_len
+	if flags != FLAG_SYN_ACK and data_end <= data_offset:
+		return None
+
+	sport, dport, seq, ack = unpack_tcp_header(buf, tcp_offset)
+	src, dst = unpack_ip_addr(buf, offset + 12)
+	data = bytes(buf[data_offset:data_end]) if data_end > data_offset else b''
+	return tcp_packet(src, sport, dst, dport, seq, ack, flags, data)
+
+ip_str_cache = {}
+
+def ip_addr(ip):
+	"""
+	整数 IPv4 地址格式化为字符串，结果缓存复用
+	"""
+	ip_str = ip_str_cache.get(ip)
+	if ip_str is None:
+		if len(ip_str_cache) >= 65536:
+			ip_str_cache.clear()
+		ip_str = '%d.%d.%d.%d' % (ip >> 24, ip >> 16 & 0xff, ip >> 8 & 0xff, ip & 0xff)
+		ip_str_cache[ip] = ip_str
+	return ip_str
@@ -0,0 +1,259 @@
+#-*- coding:utf-8 -*-
+
+import re
+import itertools
+from ._http_chunked import chunked_decoder
+
+# 重组类型：服务端主动发送的数据及非 HTTP 响应、HTTP 响应
+STREAM_TCP = 0
+STREAM_HTTP = 1
+
+# 每个流最多缓存的乱序分段数量
+MAX_OOO_SEGMENTS = 32
+# 每个流除缓存数据外的内存估算值
+STREAM_OVERHEAD = 600
+
+TCP_FIN = 0x01
+TCP_PSH = 0x08
+
+content_length_regex = re.compile(rb'\r\ncontent-length:[ \t]*(\d+)', re.I)
+chunked_regex = re.compile(rb'\r\ntransfer-encoding:[^\r\n]*chunked', re.I)
+
+class tcp_stream():
+	"""
+	单个服务端响应的重组状态
+	"""
+	__slots__ = ('kind', 'context', 'next_seq', 'buf', 'ooo', 'ooo_size', 'deadline', 'no_body', 'scan_pos', 'header_end', 'body_end', 'chunked', 'chunked_pos')
+
+	def __init__(self, kind, context, seq, deadline, no_body):
+		self.kind = kind
+		self.context = context
+		self.next_seq = seq
+		self.buf = bytearray()
+		# 乱序分段：序列号 -> (数据, TCP 标志)
+		self.ooo = {}
+		self.ooo_size = 0
+		self.deadline = deadline
+		self.no_body = no_body
+		self.scan_pos = 0
+		self.header_end = -1
+		self.body_end = -1
+		self.chunked = None
+		self.chunked_pos = 0
+
+	def data(self):
+		return bytes(self.buf[:self.body_end] if self.body_end >= 0 else self.buf)
+
+class stream_reassembler():
+	"""
+	按流重组服务端响应的多个 TCP 分段，单个流不超过 max_flow_size 字节，全部流不超过 max_total_size 字节
+	只为已匹配到请求（或 SYN-ACK 后的服务端首包）的流创建状态，SYN Flood 等不完整的握手不会占用内存
+	完成条件：Content-Length 或 chunked 结束块、非 HTTP 数据的 PSH 标志、FIN、达到单流上限、超时、被全局预算淘汰，
+	完成的流放入 ready 列表，由调用方取出处理
+	"""
+
+	def __init__(self, max_flow_size, max_total_size, max_streams, timeout=1):
+		"""
+		构造函数
+		:param max_flow_size: 单个流缓存的最大字节数
+		:param max_total_size: 全部流缓存的最大字节数（含乱序分段）
+		:param max_streams: 同时重组的最大流数量
+		:param timeout: 流的最长等待时间（单位秒，按数据包时间戳计算）
+		"""
+		self.max_flow_size = max_flow_size
+		self.max_total_size = max_total_size
+		self.max_streams = max_streams
+		self.timeout = timeout
+		# key -> tcp_stream，按创建时间排列，最早的流最先超时和被淘汰
+		self.streams = {}
+		self.ready = []
+		self.total_size = 0
+		self.stats = {
+			'open': 0,
+			'complete': 0,
+			'capped': 0,
+			'timeout': 0,
+			'eviction': 0,
+			'flush': 0,
+			'retrans': 0,
+			'ooo': 0,
+			'ooo_drop': 0
+		}
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['streams'] = len(self.streams)
+		stats['bytes'] = self.total_size
+		return stats
+
+	def open(self, key, kind, seq, data, flags, now, context, no_body=False):
+		"""
+		以响应的首个分段创建重组流，首个分段已完整时直接放入 ready
+		:param key: 流的整数键
+		:param kind: STREAM_TCP 或 STREAM_HTTP
+		:param seq: 首个分段的序列号
+		:param data: 首个分段的数据
+		:param flags: 首个分段的 TCP 标志
+		:param now: 数据包时间戳
+		:param context: 调用方数据，随完成的流返回
+		:param no_body: HTTP 响应没有正文（HEAD 请求）
+		"""
+		streams = self.streams
+		if key in streams:
+			# 同一流上一个响应尚未结束，按已收到的部分交付
+			self.finish(key, 'complete')
+		elif len(streams) >= self.max_streams:
+			self.finish(next(iter(streams)), 'eviction')
+		stream = tcp_stream(kind, context, seq, now + self.timeout, no_body)
+		streams[key] = stream
+		self.stats['open'] += 1
+		self.append(key, stream, data, flags)
+
+	def add(self, key, seq, data, flags):
+		"""
+		向重组中的流追加分段
+		:return: 是否存在该流
+		"""
+		stream = self.streams.get(key)
+		if stream is None:
+			return False
+
+		offset = (seq - stream.next_seq) & 0xffffffff
+		if not offset:
+			self.append(key, stream, data, flags)
+		elif offset < 0x80000000:
+			# 乱序分段先缓存，等待缺失的分段到达
+			if seq in stream.ooo or len(stream.ooo) >= MAX_OOO_SEGMENTS or len(stream.buf) + offset + len(data) > self.max_flow_size:
+				self.stats['ooo_drop'] += 1
+			elif self.reserve(key, len(data)):
+				stream.ooo[seq] = (data, flags)
+				stream.ooo_size += len(data)
+				self.stats['ooo'] += 1
+			else:
+				self.finish(key, 'eviction')
+		else:
+			# 重传：完全重复的分段丢弃，部分重叠的去掉已收到的部分
+			overlap = 0x100000000 - offset
+			if overlap >= len(data):
+				self.stats['retrans'] += 1
+			else:
+				self.append(key, stream, data[overlap:], flags)
+		return True
+
+	def append(self, key, stream, data, flags):
+		"""
+		追加按序到达的分段，并取出与之衔接的乱序分段
+		"""
+		while True:
+			room = self.max_flow_size - len(stream.buf)
+			capped = len(data) >= room
+			if capped:
+				data = data[:room]
+			if not self.reserve(key, len(data)):
+				self.finish(key, 'eviction')
+				return
+			stream.buf += data
+			stream.next_seq = (stream.next_seq + len(data)) & 0xffffffff
+
+			if self.is_complete(stream, flags):
+				self.finish(key, 'complete')
+				return
+			if capped:
+				self.finish(key, 'capped')
+				return
+
+			if not stream.ooo:
+				return
+			segment = stream.ooo.pop(stream.next_seq, None)
+			if segment is None:
+				return
+			data, flags = segment
+			stream.ooo_size -= len(data)
+			self.total_size -= len(data)
+
+	def is_complete(self, stream, flags):
+		if flags & TCP_FIN:
+			return True
+		if stream.kind != STREAM_HTTP:
+			return bool(flags & TCP_PSH)
+
+		buf = stream.buf
+		if stream.header_end < 0:
+			pos = buf.find(b'\r\n\r\n', stream.scan_pos)
+			if pos < 0:
+				stream.scan_pos = max(len(buf) - 3, 0)
+				return False
+			stream.header_end = pos + 4
+			status = bytes(buf[9:12])
+			if stream.no_body or status[:1] == b'1' or status in (b'204', b'304'):
+				stream.body_end = stream.header_end
+			elif chunked_regex.search(buf, 0, pos):
+				stream.chunked = chunked_decoder(self.max_flow_size, False)
+				stream.chunked_pos = stream.header_end
+			else:
+				m = content_length_regex.search(buf, 0, pos)
+				if m:
+					stream.body_end = stream.header_end + int(m.group(1))
+
+		if stream.chunked is not None:
+			done = stream.chunked.feed(bytes(buf[stream.chunked_pos:]))
+			stream.chunked_pos = len(buf)
+			return done
+		# 没有 Content-Length 的响应以连接关闭为结束，等待 FIN 或超时
+		return 0 <= stream.body_end <= len(buf)
+
+	def reserve(self, key, size):
+		"""
+		为流申请缓存空间，超出全局预算时从最早的流开始提前交付
+		:return: 是否申请成功，当前流本身就是最早的流时返回 False
+		"""
+		streams = self.streams
+		while self.total_size + size > self.max_total_size:
+			oldest = next(iter(streams))
+			if oldest == key:
+				return False
+			self.finish(oldest, 'eviction')
+		self.total_size += size
+		return True
+
+	def finish(self, key, reason):
+		stream = self.streams.pop(key)
+		self.total_size -= len(stream.buf) + stream.ooo_size
+		self.stats[reason] += 1
+		self.ready.append(stream)
+
+	def expire(self, now):
+		"""
+		交付已超时的流，通常以数据包时间戳调用
+		"""
+		streams = self.streams
+		while streams:
+			key = next(iter(streams))
+			if streams[key].deadline > now:
+				break
+			self.finish(key, 'timeout')
+
+	def flush(self):
+		"""
+		交付全部流，采集结束时调用
+		"""
+		for key in list(self.streams):
+			self.finish(key, 'flush')
+
+	def memory_size(self):
+		return self.total_size + len(self.streams) * STREAM_OVERHEAD
+
+	def shrink(self, fraction):
+		"""
+		提前交付最早的 fraction 比例的流
+		:return: 交付的流数量
+		"""
+		keys = list(itertools.islice(self.streams, int(len(self.streams) * fraction)))
+		for key in keys:
+			self.finish(key, 'eviction')
+		return len(keys)
+
+	def pop_ready(self):
+		ready = self.ready
+		self.ready = []
+		return ready
@@ -0,0 +1,139 @@
+#-*- coding:utf-8 -*-
+
+import time
+import collections
+
+class stage_timer():
+	"""
+	离线回放时统计各处理阶段的调用次数和耗时
+	通过替换实例方法和包装抓包迭代器实现，在线采集不经过这里，没有额外开销
+	"""
+
+	def __init__(self):
+		self.stage_time = collections.OrderedDict()
+		self.stage_count = collections.OrderedDict()
+
+	def add_stage(self, stage):
+		self.stage_time[stage] = 0.0
+		self.stage_count[stage] = 0
+
+	def wrap_method(self, obj, name):
+		"""
+		包装实例方法，累计其调用次数和耗时
+		:param obj: 采集引擎对象
+		:param name: 方法名，同时作为阶段名
+		"""
+		func = getattr(obj, name)
+		self.add_stage(name)
+		stage_time = self.stage_time
+		stage_count = self.stage_count
+		perf_counter = time.perf_counter
+
+		def wrapper(*args, **kwargs):
+			start = perf_counter()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				stage_time[name] += perf_counter() - start
+				stage_count[name] += 1
+
+		setattr(obj, name, wrapper)
+
+	def wrap_capture(self, capture, stage='capture'):
+		"""
+		包装抓包句柄，统计读取数据包的耗时，其余属性（close 等）透传
+		"""
+		self.add_stage(stage)
+		return timed_capture(capture, self, stage)
+
+	def report(self, wall_time, packet_num, asset_num):
+		print('[*] Replay finished in {:.3f}s'.format(wall_time))
+		print('[*] packets: {}, {:.1f} pkt/s'.format(packet_num, packet_num / wall_time if wall_time else 0))
+		print('[*] assets:  {}, {:.1f} assets/s'.format(asset_num, asset_num / wall_time if wall_time else 0))
+		print('[*] {:<20}{:>12}{:>12}{:>9}{:>12}'.format('stage', 'calls', 'time(s)', 'share', 'avg(us)'))
+		other_time = wall_time
+		for stage, used_time in self.stage_time.items():
+			count = self.stage_count[stage]
+			other_time -= used_time
+			self.report_line(stage, count, used_time, wall_time)
+		# 未单独计时的部分：会话配对、缓存查询、过滤等主循环逻辑
+		self.report_line('session/other', packet_num, max(other_time, 0), wall_time)
+
+	def report_line(self, stage, count, used_time, wall_time):
+		share = used_time * 100 / wall_time if wall_time else 0
+		avg_time = used_time * 1000000 / count if count else 0
+		print('[*] {:<20}{:>12}{:>12.3f}{:>8.1f}%{:>12.2f}'.format(stage, count, used_time, share, avg_time))
+
+class timed_capture():
+
+	def __init__(self, capture, timer, stage):
+		self.capture = capture
+		self.timer = timer
+		self.stage = stage
+
+	def __iter__(self):
+		perf_counter = time.perf_counter
+		stage_time = self.timer.stage_time
+		stage_count = self.timer.stage_count
+		stage = self.stage
+		capture_iter = iter(self.capture)
+		while True:
+			start = perf_counter()
+			try:
+				item = next(capture_iter)
+			except StopIteration:
+				return
+			stage_time[stage] += perf_counter() - start
+			stage_count[stage] += 1
+			yield item
+
+	def __getattr__(self, name):
+		return getattr(self.capture, name)
+
+def run_replay(engine_obj, engine):
+	"""
+	以离线数据包文件为输入，按 CPU 允许的最快速度执行完整的解析与发送流程，并输出统计结果
+	:param engine_obj: 已指定 input_file 创建的采集引擎对象
+	:param engine: 引擎名称，PCAP、RING、TSHARK 或 FIELDS
+	"""
+	timer = stage_timer()
+	if engine in ('PCAP', 'RING'):
+		engine_obj.sniffer = timer.wrap_capture(engine_obj.sniffer)
+		for name in ['pkt_decode', 'decode_request', 'decode_response_header', 'decode_response_body', 'send_msg']:
+			timer.wrap_method(engine_obj, name)
+		packet_stage = 'capture'
+		asset_stage = 'send_msg'
+	else:
+		# TSHARK、FIELDS 引擎的数据包读取与解析在 tshark 子进程（及 pyshark）中完成，计入 proc_packet 之外的耗时
+		for name in ['proc_packet', 'proc_http', 'proc_tcp']:
+			timer.wrap_method(engine_obj, name)
+		engine_obj.work_queue = counted_queue(engine_obj.work_queue)
+		packet_stage = 'proc_packet'
+		asset_stage = None
+
+	start = time.perf_counter()
+	engine_obj.run()
+	wall_time = time.perf_counter() - start
+
+	packet_num = timer.stage_count[packet_stage]
+	asset_num = timer.stage_count[asset_stage] if asset_stage else engine_obj.work_queue.append_num
+	timer.report(wall_time, packet_num, asset_num)
+
+class counted_queue():
+	"""
+	统计写入发送队列的资产数量，其余接口透传
+	"""
+
+	def __init__(self, work_queue):
+		self.work_queue = work_queue
+		self.append_num = 0
+
+	def append(self, msg, dedup_key=None):
+		self.append_num += 1
+		self.work_queue.append(msg, dedup_key)
+
+	def __len__(self):
+		return len(self.work_queue)
+
+	def __getattr__(self, name):
+		return getattr(self.work_queue, name)
@@ -0,0 +1,220 @@
+#-*- coding:utf-8 -*-
+
+import mmap
+import struct
+import select
+import socket
+import ctypes
+import ctypes.util
+
+# linux/if_packet.h
+SOL_PACKET = 263
+PACKET_ADD_MEMBERSHIP = 1
+PACKET_MR_PROMISC = 1
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+PACKET_OUTGOING = 4
+ARPHRD_LOOPBACK = 772
+ETH_P_ALL = 0x0003
+SO_ATTACH_FILTER = 26
+# pcap/dlt.h
+DLT_EN10MB = 1
+PCAP_NETMASK_UNKNOWN = 0xffffffff
+
+# 每个块的大小（需为页大小的整数倍），帧大小在 TPACKET_V3 中只用于校验，帧按实际长度紧凑排列
+RING_BLOCK_SIZE = 1 << 20
+RING_FRAME_SIZE = 2048
+# 逐包迭代时每次从块中取出的数据包数量
+RING_BATCH_SIZE = 256
+
+# struct tpacket_req3
+pack_ring_req = struct.Struct('IIIIIII').pack
+# struct tpacket_block_desc：block_status、num_pkts、offset_to_first_pkt
+unpack_block_status = struct.Struct('I').unpack_from
+pack_block_status = struct.Struct('I').pack_into
+unpack_block_header = struct.Struct('II').unpack_from
+# struct tpacket3_hdr（48字节）及其后的 struct sockaddr_ll：
+# tp_next_offset、tp_sec、tp_nsec、tp_snaplen、tp_len、tp_status、tp_mac、tp_net，sll_hatype、sll_pkttype
+unpack_frame_header = struct.Struct('IIIIIIHH20x8xHB').unpack_from
+# struct tpacket_stats_v3
+unpack_ring_stats = struct.Struct('III').unpack
+
+class bpf_program(ctypes.Structure):
+	_fields_ = [('bf_len', ctypes.c_uint), ('bf_insns', ctypes.c_void_p)]
+
+libpcap = None
+
+def load_libpcap():
+	global libpcap
+	if libpcap is None:
+		path = ctypes.util.find_library('pcap')
+		if not path:
+			raise OSError('libpcap not found, BPF filter can not be compiled')
+		lib = ctypes.CDLL(path)
+		lib.pcap_open_dead.restype = ctypes.c_void_p
+		lib.pcap_open_dead.argtypes = [ctypes.c_int, ctypes.c_int]
+		lib.pcap_compile.argtypes = [ctypes.c_void_p, ctypes.POINTER(bpf_program), ctypes.c_char_p, ctypes.c_int, ctypes.c_uint32]
+		lib.pcap_geterr.restype = ctypes.c_char_p
+		lib.pcap_geterr.argtypes = [ctypes.c_void_p]
+		lib.pcap_freecode.argtypes = [ctypes.POINTER(bpf_program)]
+		lib.pcap_close.argtypes = [ctypes.c_void_p]
+		libpcap = lib
+	return libpcap
+
+def compile_filter(bpf_filter, snaplen=65535):
+	"""
+	通过 libpcap 将过滤器表达式编译为经典 BPF 指令（与内核 struct sock_filter 格式相同）
+	:param bpf_filter: 过滤器表达式
+	:param snaplen: 捕获长度
+	:return: (指令数量, 指令字节串)
+	"""
+	lib = load_libpcap()
+	handle = lib.pcap_open_dead(DLT_EN10MB, snaplen)
+	if not handle:
+		raise OSError('pcap_open_dead failed')
+	program = bpf_program()
+	try:
+		if lib.pcap_compile(handle, ctypes.byref(program), bpf_filter.encode(), 1, PCAP_NETMASK_UNKNOWN) != 0:
+			raise ValueError('BPF filter compile error: {}'.format(lib.pcap_geterr(handle).decode(errors='replace')))
+		insns = ctypes.string_at(program.bf_insns, program.bf_len * 8)
+		lib.pcap_freecode(ctypes.byref(program))
+		return program.bf_len, insns
+	finally:
+		lib.pcap_close(handle)
+
+class tpacket_ring():
+	"""
+	AF_PACKET TPACKET_V3 内存映射环形缓冲区抓包，代替 pcap 句柄向 PCAP 引擎提供数据包
+	内核按块（block）批量填充数据包，块填满或超时后交给用户态；逐块遍历其中的帧，
+	以 memoryview 切片直接引用环形缓冲区中的以太网帧，不复制为 bytes，整块处理完后归还内核
+	调用方不能在迭代到下一个数据包之后继续持有上一个 memoryview（decode_tcp_packet 只复制负载部分）
+	"""
+
+	def __init__(self, interface, ring_size=64*1024*1024, block_timeout=64, promisc=True):
+		"""
+		构造函数
+		:param interface: 网卡名
+		:param ring_size: 环形缓冲区大小（单位字节），按块大小向下取整，至少 2 个块
+		:param block_timeout: 块超时（单位毫秒），块未填满时超过该时间也交给用户态，流量较小时决定处理延迟
+		:param promisc: 是否开启混杂模式
+		"""
+		self.interface = interface
+		self.block_size = RING_BLOCK_SIZE
+		self.block_num = max(ring_size // self.block_size, 2)
+		self.block_timeout = max(int(block_timeout), 1)
+		self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+		try:
+			self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+			frame_num = self.block_size * self.block_num // RING_FRAME_SIZE
+			self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, pack_ring_req(self.block_size, self.block_num, RING_FRAME_SIZE, frame_num, self.block_timeout, 0, 0))
+			self.mmap = mmap.mmap(self.sock.fileno(), self.block_size * self.block_num, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+			self.sock.bind((interface, ETH_P_ALL))
+			if promisc:
+				mreq = struct.pack('iHH8s', socket.if_nametoindex(interface), PACKET_MR_PROMISC, 0, b'')
+				self.sock.setsockopt(SOL_PACKET, PACKET_ADD_MEMBERSHIP, mreq)
+		except:
+			self.sock.close()
+			raise
+		self.ring = memoryview(self.mmap)
+		self.poller = select.poll()
+		self.poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+		self.block_index = 0
+		self.stopped = False
+		# PACKET_STATISTICS 读取后清零，在此累计
+		self.recv_num = 0
+		self.drop_num = 0
+		self.freeze_num = 0
+		self.block_count = 0
+
+	def __iter__(self):
+		"""
+		:return: (时间戳, 以太网帧 memoryview)
+		"""
+		for batch in self.batches(RING_BATCH_SIZE):
+			yield from batch
+
+	def batches(self, batch_size):
+		"""
+		按块读取数据包，块内超过 batch_size 个数据包时分为多批，整块的数据包处理完（请求下一批）后才归还内核
+		:param batch_size: 每批最多的数据包数量
+		:return: (时间戳, 以太网帧 memoryview) 列表
+		"""
+		ring = self.ring
+		block_size = self.block_size
+		block_num = self.block_num
+		poll = self.poller.poll
+		while not self.stopped:
+			block_offset = self.block_index * block_size
+			if not unpack_block_status(ring, block_offset + 8)[0] & TP_STATUS_USER:
+				poll(self.block_timeout)
+				continue
+			pkt_num, frame_offset = unpack_block_header(ring, block_offset + 12)
+			frame_offset += block_offset
+			batch = []
+			for _ in range(pkt_num):
+				next_offset, sec, nsec, snaplen, _, _, mac, _, hatype, pkttype = unpack_frame_header(ring, frame_offset)
+				# 回环接口上发出的数据包会再以接收方向出现一次，与 libpcap 一致只保留接收方向
+				if pkttype != PACKET_OUTGOING or hatype != ARPHRD_LOOPBACK:
+					start = frame_offset + mac
+					batch.append((sec + nsec * 1e-9, ring[start:start + snaplen]))
+					if len(batch) >= batch_size:
+						yield batch
+						batch = []
+				frame_offset += next_offset
+			if batch:
+				yield batch
+			pack_block_status(ring, block_offset + 8, TP_STATUS_KERNEL)
+			self.block_count += 1
+			self.block_index = (self.block_index + 1) % block_num
+
+	def setfilter(self, bpf_filter):
+		"""
+		编译并加载内核 BPF 过滤器，替换是原子的，运行中可重复调用
+		"""
+		insn_num, insns = compile_filter(bpf_filter)
+		insn_buf = ctypes.create_string_buffer(insns, len(insns))
+		# struct sock_fprog，内核在 setsockopt 时复制指令
+		self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, struct.pack('HP', insn_num, ctypes.addressof(insn_buf)))
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def stats(self):
+		"""
+		:return: (接收数量, 环形缓冲区满时内核丢弃数量, 0)，与 pcap 句柄的 stats() 格式一致，接收数量包含丢弃的数据包
+		"""
+		packet_num, drop_num, freeze_num = unpack_ring_stats(self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12))
+		self.recv_num += packet_num
+		self.drop_num += drop_num
+		self.freeze_num += freeze_num
+		return self.recv_num, self.drop_num, 0
+
+	def get_stats(self):
+		"""
+		环形缓冲区的附加统计，freeze 为内核因缓冲区满而暂停填充的次数
+		"""
+		return {
+			'block': self.block_count,
+			'freeze': self.freeze_num,
+			'ring_size': self.block_size * self.block_num
+		}
+
+	def stop(self):
+		"""
+		在其他线程中调用，迭代在当前块处理完或下一次块超时后结束
+		"""
+		self.stopped = True
+
+	def close(self):
+		self.stopped = True
+		try:
+			self.ring.release()
+			self.mmap.close()
+		except BufferError:
+			# 仍有数据包 memoryview 被引用，映射随对象回收释放
+			pass
+		self.sock.close()
@@ -0,0 +1,139 @@
+#-*- coding:utf-8 -*-
+
+import os
+import struct
+import collections
+
+SEGMENT_PREFIX = 'spill-'
+SEGMENT_SUFFIX = '.dat'
+# 每条记录：4 字节长度 + UTF-8 数据
+record_header = struct.Struct('<I')
+
+class spill_ring():
+	"""
+	发送队列的磁盘溢出缓冲区，由按序编号的段文件组成，先写入的数据先读出
+	总大小超出 max_size 后丢弃新写入的数据；启动时接续读取目录中已有的段文件，重启不丢失积压的数据
+	非线程安全，由 msg_queue 在持有锁时调用
+	"""
+
+	def __init__(self, spill_dir, max_size, segment_size=4*1024*1024):
+		"""
+		构造函数
+		:param spill_dir: 段文件目录
+		:param max_size: 磁盘占用上限（单位字节）
+		:param segment_size: 单个段文件的大小
+		"""
+		self.spill_dir = spill_dir
+		self.max_size = max_size
+		self.segment_size = min(segment_size, max(max_size // 4, 1))
+		os.makedirs(self.spill_dir, exist_ok=True)
+		# 段编号，最早的在前；段编号 -> 段大小
+		self.segments = collections.deque()
+		self.segment_sizes = {}
+		self.total_size = 0
+		self.writer = None
+		self.write_id = 0
+		self.reader = None
+		self.read_offset = 0
+		self.stats = {
+			'spill': 0,
+			'replay': 0,
+			'drop': 0
+		}
+		for name in sorted(os.listdir(self.spill_dir)):
+			if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+				segment_id = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+				size = os.path.getsize(self.segment_path(segment_id))
+				self.segments.append(segment_id)
+				self.segment_sizes[segment_id] = size
+				self.total_size += size
+				self.write_id = segment_id
+
+	def segment_path(self, segment_id):
+		return os.path.join(self.spill_dir, '{}{:08d}{}'.format(SEGMENT_PREFIX, segment_id, SEGMENT_SUFFIX))
+
+	def pending_size(self):
+		"""
+		尚未读出的字节数
+		"""
+		return self.total_size - self.read_offset
+
+	def write(self, msg):
+		"""
+		写入一条数据
+		:return: 是否写入成功，磁盘占用达到上限时返回 False
+		"""
+		data = msg.encode('utf-8', 'surrogatepass')
+		size = record_header.size + len(data)
+		if self.total_size + size > self.max_size:
+			self.stats['drop'] += 1
+			return False
+		if self.writer is None or self.segment_sizes[self.write_id] + size > self.segment_size:
+			self.new_segment()
+		self.writer.write(record_header.pack(len(data)))
+		self.writer.write(data)
+		self.segment_sizes[self.write_id] += size
+		self.total_size += size
+		self.stats['spill'] += 1
+		return True
+
+	def new_segment(self):
+		if self.writer is not None:
+			self.writer.close()
+		self.write_id += 1
+		self.writer = open(self.segment_path(self.write_id), 'wb')
+		self.segments.append(self.write_id)
+		self.segment_sizes[self.write_id] = 0
+
+	def read(self, num):
+		"""
+		按写入顺序读出最多 num 条数据
+		"""
+		result = []
+		while len(result) < num and self.pending_size() > 0:
+			read_id = self.segments[0]
+			if self.writer is not None and read_id == self.write_id:
+				self.writer.flush()
+			if self.reader is None:
+				self.reader = open(self.segment_path(read_id), 'rb')
+				self.read_offset = 0
+
+			header = self.reader.read(record_header.size)
+			data = b''
+			if len(header) == record_header.size:
+				data_len = record_header.unpack(header)[0]
+				data = self.reader.read(data_len)
+			if len(header) < record_header.size or len(data) < data_len:
+				# 段已读完（或进程异常退出时留下不完整的记录）
+				self.remove_segment()
+				continue
+			self.read_offset += record_header.size + data_len
+			result.append(data.decode('utf-8', 'surrogatepass'))
+
+		self.stats['replay'] += len(result)
+		if self.pending_size() <= 0:
+			# 积压已全部读出，删除所有段文件，下次溢出时从新的段开始
+			while self.segments:
+				self.remove_segment()
+		return result
+
+	def remove_segment(self):
+		segment_id = self.segments.popleft()
+		if self.reader is not None:
+			self.reader.close()
+			self.reader = None
+		if segment_id == self.write_id and self.writer is not None:
+			self.writer.close()
+			self.writer = None
+		self.total_size -= self.segment_sizes.pop(segment_id)
+		self.read_offset = 0
+		try:
+			os.remove(self.segment_path(segment_id))
+		except OSError:
+			pass
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['bytes'] = self.total_size
+		stats['pending'] = self.pending_size()
+		return stats
@@ -1,12 +1,21 @@
 #-*- coding:utf-8 -*-
 
-import logging
-import logging.handlers 
 import os
+import re
 import sys
 import requests
 import socket
+import struct
+import time
 import json
+import gzip
+import collections
+import datetime
+try:
+	import fcntl
+	import termios
+except ImportError:
+	fcntl = None
 
 # TASK_LOCK_FILE临时文件，判断程序是否正在运行
 TASK_LOCK_FILE = sys.path[0]+'/passets_sensor.lock'
@@ -100,57 +109,345 @@ def proc_data_str(data, length):
 
 	return data[: length * 2]
 
+# 检测页面 Meta 中编码信息的正则表达式
+META_CHARSET_REGEX = re.compile(rb'<meta [^>]*?charset=["\']?([a-z\-\d]+)["\'>]?', re.I)
+
+def http_filter(http_filter_json, key, value):
+	"""
+	检查字符串中是否包含特定的规则
+	:param http_filter_json: 过滤规则，规则键名 -> 字符串列表
+	:param key: 规则键名，response_code（状态码）或 content_type（内容类型）
+	:param value: 要检查的字符串
+	:return: True - 包含， False - 不包含
+	"""
+	if key in http_filter_json:
+		for rule in http_filter_json[key]:
+			if rule in value:
+				return True
+	return False
+
+def decode_body_str(data, content_type, length):
+	"""
+	按页面 Meta 或 Content-Type 中的编码信息解码响应正文并截取，编码无效时按 utf-8 解码
+	:param data: 正文（已去除 chunked 分块并解压）
+	:param content_type: 小写的 Content-Type
+	:param length: 截取的数据长度
+	:return: 解码后的字符串
+	"""
+	charset = 'utf-8'
+	# 检测 Content-Type 中的编码信息
+	if 'charset=' in content_type:
+		charset = content_type[content_type.find('charset=')+8:].strip() or 'utf-8'
+	# 检测页面 Meta 中的编码信息
+	data_head = data[:500] if data.find(b'</head>', 0, 1024) == -1 else data[:data.find(b'</head>')]
+	match = META_CHARSET_REGEX.search(data_head)
+	if match:
+		charset = str(match.group(1).strip().lower(), 'utf-8', 'ignore')
+	try:
+		return proc_body_str(str(data, charset, 'ignore'), length)
+	except LookupError:
+		return proc_body_str(str(data, 'utf-8', 'ignore'), length)
+
 # Syslog Send
 class _syslog_msg_send:
-	def __init__(self, server_ip, server_port):
-
+	def __init__(self, server_ip, server_port, protocol='UDP', facility=4):
+		"""
+		Syslog 方式发送数据，按 RFC 5424 格式封装，不依赖也不修改全局 logging 配置
+		UDP 每条消息一个数据报（RFC 5426），TCP 采用 octet-counting 分帧（RFC 6587）并按批次合并写出
+		:param server_ip: Syslog 服务器地址
+		:param server_port: Syslog 服务器端口
+		:param protocol: 传输协议，UDP 或 TCP
+		:param facility: Syslog facility，默认 4（auth）
+		"""
 		self.server_ip = server_ip
 		self.server_port = server_port
-		self.logger = logging.getLogger()
-		hdlr = logging.handlers.SysLogHandler((self.server_ip, self.server_port), logging.handlers.SysLogHandler.LOG_AUTH)
-		# hdlr = logging.handlers.RotatingFileHandler(logfile, maxBytes=5242880, backupCount=5)
-		formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
-		hdlr.setFormatter(formatter)
-		self.logger.addHandler(hdlr)
-		self.logger.setLevel(logging.INFO)
+		self.protocol = protocol
+		# PRI = facility * 8 + severity(6, informational)
+		self.pri = facility * 8 + 6
+		self.hostname = socket.gethostname() or '-'
+		self.procid = os.getpid()
+		self.stats = {
+			'sent_msg': 0,
+			'sent_bytes': 0,
+			'drop_msg': 0,
+			'error': 0
+		}
+		if self.protocol == 'TCP':
+			self.tcp_sender = _tcp_msg_send(self.server_ip, self.server_port)
+		else:
+			self.udp_client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			self.udp_addr = (self.server_ip, self.server_port)
 
-	def info(self, msg):
-		self.logger.info(msg)
+	def get_stats(self):
+		if self.protocol == 'TCP':
+			return self.tcp_sender.get_stats()
+		return dict(self.stats)
 
-	def warning(self, msg):
-		self.logger.warning(msg)
+	def header(self):
+		# 同一批次共用时间戳，避免逐条格式化
+		timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds')
+		return '<{}>1 {} {} passets-sensor {} - - '.format(self.pri, timestamp, self.hostname, self.procid)
 
-	def error(self, msg):
-		self.logger.error(msg)
+	def info(self, msg):
+		return self.batch([msg])
 
-	def exception(self, msg):
-		self.logger.exception(msg)
+	def batch(self, msgs):
+		header = self.header()
+		if self.protocol == 'TCP':
+			frames = []
+			for msg in msgs:
+				data = (header + msg).encode()
+				frames.append(b'%d %s' % (len(data), data))
+			return self.tcp_sender.write(frames)
 
-	def critical(self, msg):
-		self.logger.critical(msg)
+		for msg in msgs:
+			data = (header + msg).encode()
+			try:
+				self.udp_client.sendto(data, self.udp_addr)
+				self.stats['sent_msg'] += 1
+				self.stats['sent_bytes'] += len(data)
+			except socket.error:
+				# 超过UDP数据报上限或网络不可达
+				self.stats['drop_msg'] += 1
+				self.stats['error'] += 1
+		return True
+
+	def flush(self):
+		"""
+		:return: True - 数据已发出， False - TCP 连接不可用
+		"""
+		if self.protocol == 'TCP':
+			return self.tcp_sender.flush()
+		return True
 
 # HTTP Send
 class _http_msg_send:
-	def __init__(self,http_url):
+	def __init__(self,http_url,gzip_switch=False,max_pending=100,max_retry_wait=30):
+		"""
+		HTTP 方式批量发送数据，复用 keep-alive 连接池，每批数据以 NDJSON 格式作为一个请求体 POST
+		:param http_url: 数据接收地址
+		:param gzip_switch: 是否对请求体进行 gzip 压缩
+		:param max_pending: 发送失败等待重试的最大批次数，超出后丢弃最早的批次
+		:param max_retry_wait: 重试退避的最长等待时间（单位秒）
+		"""
 		self.http_url = http_url
+		self.gzip_switch = gzip_switch
+		self.max_retry_wait = max_retry_wait
+		self.retry_wait = 0
+		self.next_retry_time = 0
+		self.pending = collections.deque()
+		self.max_pending = max_pending
+		self.headers = {'Content-Type': 'application/x-ndjson'}
+		if self.gzip_switch:
+			self.headers['Content-Encoding'] = 'gzip'
+		self.session = requests.Session()
+		adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+		self.stats = {
+			'sent_msg': 0,
+			'sent_bytes': 0,
+			'drop_msg': 0,
+			'reject_msg': 0,
+			'error': 0,
+			'retry': 0
+		}
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['pending_batch'] = len(self.pending)
+		return stats
+
 	def info(self,msg):
-		self.req = requests.post(self.http_url, data=msg, verify=False, timeout=2)
+		return self.batch([msg])
+
+	def batch(self,msgs):
+		body = ''.join([msg+'\n' for msg in msgs]).encode()
+		if self.gzip_switch:
+			body = gzip.compress(body, compresslevel=1)
+		if len(self.pending) >= self.max_pending:
+			self.stats['drop_msg'] += self.pending.popleft()[0]
+		self.pending.append((len(msgs), body))
+		return self.flush()
+
+	def flush(self):
+		"""
+		按顺序发送待发批次，服务端 5xx/408/429 或网络异常时保留批次并退避重试
+		:return: True - 待发批次已清空， False - 服务端暂不可用
+		"""
+		while self.pending:
+			wait_time = self.next_retry_time - time.time()
+			if wait_time > 0:
+				time.sleep(wait_time)
+
+			msg_num, body = self.pending[0]
+			try:
+				self.req = self.session.post(self.http_url, data=body, headers=self.headers, verify=False, timeout=(3, 10))
+				status = self.req.status_code
+			except requests.exceptions.RequestException:
+				status = 0
+
+			if 200 <= status < 300:
+				self.pending.popleft()
+				self.stats['sent_msg'] += msg_num
+				self.stats['sent_bytes'] += len(body)
+				self.retry_wait = 0
+				self.next_retry_time = 0
+			elif 400 <= status < 500 and status not in (408, 429):
+				# 服务端拒绝的数据重试无意义，直接丢弃
+				self.pending.popleft()
+				self.stats['reject_msg'] += msg_num
+			else:
+				self.stats['error'] += 1
+				self.stats['retry'] += 1
+				self.retry_wait = min(max(self.retry_wait * 2, 0.5), self.max_retry_wait)
+				self.next_retry_time = time.time() + self.retry_wait
+				return False
+		return True
 
 # TCP Send
 class _tcp_msg_send:
-	def __init__(self,server_ip,server_port):
+	def __init__(self,server_ip,server_port,max_buffer_size=16*1024*1024,max_retry_wait=30):
+		"""
+		TCP 方式发送 NDJSON 数据，数据先写入发送缓冲区再批量写出，断线后按退避时间自动重连，缓冲区数据不丢失
+		:param server_ip: 数据接收服务器地址
+		:param server_port: 数据接收服务器端口
+		:param max_buffer_size: 发送缓冲区最大字节数，超出后丢弃新数据
+		:param max_retry_wait: 重连退避的最长等待时间（单位秒）
+		"""
 		self.server_ip = server_ip
 		self.server_port = server_port
-		self.tcp_client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		#心跳维护
-		self.tcp_client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-		self.tcp_client.connect((self.server_ip, self.server_port))
+		self.max_buffer_size = max_buffer_size
+		self.max_retry_wait = max_retry_wait
+		self.write_buffer = bytearray()
+		# 缓冲区起始位置、首条未发完消息起始位置及缓冲区内每条消息结束位置的累计字节偏移
+		self.buffer_offset = 0
+		self.msg_start = 0
+		self.msg_ends = collections.deque()
+		self.tcp_client = None
+		self.retry_wait = 0
+		self.next_retry_time = 0
+		self.stats = {
+			'sent_msg': 0,
+			'sent_bytes': 0,
+			'drop_msg': 0,
+			'drop_bytes': 0,
+			'lost_bytes': 0,
+			'error': 0,
+			'reconnect': 0
+		}
+		self.connect()
 
-	def info(self,msg):
+	def connect(self):
 		try:
-			self.tcp_client.send(msg.encode()+b"\n")
+			tcp_client = socket.create_connection((self.server_ip, self.server_port), timeout=5)
+			#心跳维护
+			tcp_client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+			# 接收端长时间不读取数据时按发送失败处理并重连
+			tcp_client.settimeout(30)
+			self.tcp_client = tcp_client
+			self.retry_wait = 0
 			return True
-		except socket.error as e:
-			if e.errno == 32:
-				return False
-		# self.tcp_client.close()
+		except socket.error:
+			self.retry_wait = min(max(self.retry_wait * 2, 0.5), self.max_retry_wait)
+			self.next_retry_time = time.time() + self.retry_wait
+			return False
+
+	def close(self):
+		if self.tcp_client is None:
+			return
+		# 已写入内核但对端未确认的数据随连接关闭可能丢失
+		self.stats['lost_bytes'] += self.unacked_bytes()
+		try:
+			self.tcp_client.close()
+		except socket.error:
+			pass
+		self.tcp_client = None
+		self.next_retry_time = 0
+
+	def unacked_bytes(self):
+		"""
+		查询内核发送队列中尚未被对端确认的字节数
+		"""
+		if self.tcp_client is None or not fcntl:
+			return 0
+		try:
+			return struct.unpack('i', fcntl.ioctl(self.tcp_client.fileno(), termios.TIOCOUTQ, b'\0' * 4))[0]
+		except (OSError, ValueError):
+			return 0
+
+	def get_stats(self):
+		stats = dict(self.stats)
+		stats['buffer_bytes'] = len(self.write_buffer)
+		stats['acked_bytes'] = max(stats['sent_bytes'] - self.unacked_bytes(), 0)
+		stats['connected'] = self.tcp_client is not None
+		return stats
+
+	def info(self,msg):
+		return self.batch([msg])
+
+	def batch(self,msgs):
+		return self.write([(msg+'\n').encode() for msg in msgs])
+
+	def write(self,frames):
+		"""
+		将已分帧的消息写入发送缓冲区并发送
+		:param frames: 消息帧（bytes）列表，每个元素为一条完整消息
+		"""
+		data = b''.join(frames)
+		if len(self.write_buffer) + len(data) > self.max_buffer_size:
+			self.stats['drop_msg'] += len(frames)
+			self.stats['drop_bytes'] += len(data)
+		else:
+			msg_end = self.buffer_offset + len(self.write_buffer)
+			for frame in frames:
+				msg_end += len(frame)
+				self.msg_ends.append(msg_end)
+			self.write_buffer += data
+		return self.flush()
+
+	def flush(self):
+		"""
+		将发送缓冲区中的数据全部写出，处理部分写入，失败时保留未发送数据等待重连
+		:return: True - 缓冲区已清空， False - 连接不可用
+		"""
+		while self.write_buffer:
+			if self.tcp_client is None:
+				wait_time = self.next_retry_time - time.time()
+				if wait_time > 0:
+					time.sleep(wait_time)
+				if not self.connect():
+					return False
+				self.stats['reconnect'] += 1
+
+			sent = 0
+			send_error = False
+			view = memoryview(self.write_buffer)
+			try:
+				while sent < len(view):
+					sent += self.tcp_client.send(view[sent:])
+			except socket.error:
+				send_error = True
+			finally:
+				view.release()
+
+			if sent:
+				self.stats['sent_bytes'] += sent
+				self.buffer_offset += sent
+				del self.write_buffer[:sent]
+				while self.msg_ends and self.msg_ends[0] <= self.buffer_offset:
+					self.msg_start = self.msg_ends.popleft()
+					self.stats['sent_msg'] += 1
+				# 半条消息已写出时丢弃剩余部分，避免重连后接收端收到残缺消息
+				if send_error and self.msg_ends and self.buffer_offset > self.msg_start:
+					self.msg_start = self.msg_ends.popleft()
+					drop_size = self.msg_start - self.buffer_offset
+					self.stats['drop_msg'] += 1
+					self.stats['drop_bytes'] += drop_size
+					self.buffer_offset += drop_size
+					del self.write_buffer[:drop_size]
+
+			if send_error:
+				self.stats['error'] += 1
+				self.close()
+		return True
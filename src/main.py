@@ -2,14 +2,21 @@
 
 from lib._http_tcp_shark import tcp_http_shark
 from lib._http_tcp_pcap import tcp_http_pcap
+from lib._http_tcp_fields import tcp_http_fields
 from lib._util import check_lock
 from lib._util import _syslog_msg_send, _http_msg_send, _tcp_msg_send
+from lib._capture_worker import worker_queue, worker_forward, forward_dedup, partition_filter
+from lib._msg_queue import msg_queue
+from lib._spill_queue import spill_ring
+from lib._replay import run_replay
+from lib._batch_triage import MIN_BATCH_SIZE
+from lib._metrics import metrics_registry, start_metrics_server
+from lib._latency_trace import latency_tracer
 import getopt
 import sys
 import os
 import threading
-# import queue
-import collections
+import multiprocessing
 import signal
 import traceback
 import time
@@ -33,16 +40,66 @@ return_deep_info = True
 cache_size = 1024
 # 流量会话数量
 session_size = 1024
-# tshark定期清空内存（单位秒/默认一小时），pcap接收数据包的超时时间（单位毫秒/默认3.6秒）
+# tshark定期清空内存（单位秒/默认一小时，0为不重启），pcap接收数据包的超时时间（单位毫秒/默认3.6秒）
 timeout = 3600
-# 发送数据线程数量
-msg_send_thread_num = 10
+# PCAP引擎内存预算（单位MB），超出后按优先级收缩缓存，0为不限制
+memory_budget = 0
+# 发送数据线程数量，0为自动（TCP、SYSLOG_TCP模式单连接即可承载，使用1个线程，其他模式10个）
+msg_send_thread_num = 0
 # 发送数据队列最大值
 max_queue_size = 50000
-# 资产数据发送模式，仅支持TCP，HTTP，SYSLOG三种
+# 发送队列过载时按价值分级丢弃数据（先去除正文/数据，再丢弃已知服务的数据），off 时队列满后整体清空
+load_shed = 'off'
+# 运行指标 HTTP 服务监听地址，[地址:]端口 或 Unix socket 路径，为空时不启动
+metrics_listen = ''
+# 采集引擎最新的运行统计，采集进程序号 -> 统计
+engine_stats = {}
+# 端到端延迟采样间隔（单位秒），0 为不采样
+trace_interval = 0
+# 自适应过滤器最多排除的已知服务数量，0 为不启用
+adaptive_top = 0
+# 发送队列磁盘溢出目录，为空时队列满后清空（丢弃）数据
+spill_dir = ''
+# 发送队列磁盘溢出占用上限（单位MB），超出后丢弃新数据
+spill_size = 1024
+# 发送线程每批次最多发送的数据条数
+msg_batch_size = 100
+# 发送线程凑满一批数据的最长等待时间（单位毫秒）
+msg_batch_wait = 50
+# 发送线程统计信息输出间隔（单位秒），0为不输出
+stat_interval = 0
+# 资产数据发送模式，仅支持TCP，HTTP，SYSLOG（UDP），SYSLOG_TCP四种
 msg_send_mode = 'TCP'
-# 流量采集引擎，仅支持TSHARK，PCAP两种
+# HTTP模式请求体gzip压缩
+http_gzip = False
+# 流量采集引擎，支持PCAP，RING，TSHARK，FIELDS四种
 engine = "PCAP"
+# 离线回放的数据包文件（pcap/pcapng），指定后不再实时采集网卡流量
+input_file = ''
+# PCAP引擎HTTP响应正文解码线程数量，0为在采集线程中处理
+body_worker_num = 0
+# PCAP引擎HTTP响应正文（解压后）最大字节数
+max_body_size = 16 * 1024
+# PCAP引擎单个响应重组的最大字节数（单位KB），0为不重组，只处理响应的首个数据包
+reassembly_size = 0
+# PCAP引擎全部响应重组缓存的最大值（单位MB）
+reassembly_budget = 64
+# 去重缓存类型，hash（64位哈希精确去重）或 bloom（按时间衰减的 Bloom Filter）
+dedup_mode = 'hash'
+# bloom 去重缓存的误判率
+dedup_fpr = 0.001
+# 去重缓存快照文件，启动时恢复、运行中定期写入，为空时不保存
+snapshot_file = ''
+# 去重缓存快照写入间隔（单位秒）
+snapshot_interval = 300
+# RING引擎TPACKET_V3环形缓冲区大小（单位MB）
+ring_size = 64
+# RING引擎环形缓冲区块超时（单位毫秒）
+ring_timeout = 64
+# PCAP/RING引擎批量筛选每批的数据包数量（需要NumPy），0为逐包处理
+batch_size = 0
+# PCAP引擎采集进程数量，大于1时通过 AF_PACKET fanout 按流哈希分流
+capture_worker_num = 1
 
 # HTTP数据过滤
 http_filter = {
@@ -74,59 +131,213 @@ def Usage():
  -p <server_port>   server port(def: None)
  -t <tag>           Source identification(def: localhost)
  -c <cache_size>    Cache size(def: 1024)
+ -D <hash|bloom>    Dedup cache mode, bloom sizes each generation by -c(def: hash)
+ -P <fpr>           Bloom dedup false positive rate(def: 0.001)
+ -k <snapshot_file> Dedup snapshot file, restored at startup(def: None)
+ -K <interval>      Dedup snapshot write interval(def: 300 sec)
  -S <session_size>  Session size(def: 1024)
- -T <timeout>       Memory clear time(def: 3600 sec)
+ -T <timeout>       Memory clear time, 0 is never (PCAP/RING only)(def: 3600 sec)
+ -M <budget>        PCAP memory budget, shrink caches when exceeded, 0 is off(def: 0 MB)
+ -w <worker_num>    Capture worker processes(def: 1)
+ -W <thread_num>    PCAP response body decode threads, 0 is inline(def: 0)
+ -L <max_body_size> PCAP max decompressed response body bytes(def: 16384)
+ -R <size>          PCAP per-response TCP reassembly limit, 0 is off(def: 0 KB)
+ -G <budget>        PCAP total TCP reassembly memory budget(def: 64 MB)
+ -n <thread_num>    Message send threads(def: TCP/SYSLOG_TCP 1, others 10)
+ -b <batch_size>    Max messages per send batch(def: 100)
+ -B <batch_wait>    Max wait to fill a send batch(def: 50 ms)
+ -I <interval>      Sender statistics interval, 0 is off(def: 0 sec)
+ -q <spill_dir>     Spill queue overflow to disk instead of clearing(def: None)
+ -Q <spill_size>    Max disk usage of the spill queue(def: 1024 MB)
+ -O <off|on>        Priority load shedding on queue overload(def: off)
+ -l <listen>        Prometheus metrics endpoint, [host:]port or unix socket path(def: None)
+ -a <interval>      Latency trace sample interval, 0 is off(def: 0 sec)
+ -A <top_num>       PCAP adaptive BPF, exclude top N known services, 0 is off(def: 0)
+ -N <batch_size>    PCAP NumPy batch header triage packets per batch, at least 256, 0 is off(def: 0)
+ -m <send_mode>     Message send mode, TCP|HTTP|SYSLOG|SYSLOG_TCP(def: TCP)
+ -z <off|on>        HTTP mode gzip request body(def: off)
+ -e <engine>        Capture engine, PCAP|RING|TSHARK|FIELDS(def: PCAP)
+ -y <ring_size>     RING engine TPACKET_V3 ring buffer size(def: 64 MB)
+ -Y <timeout>       RING engine ring block timeout(def: 64 ms)
+ -f <pcap_file>     Replay a pcap/pcapng file at full speed and report rates
  -d <off|on>        Debug information switch(def: off)
  -------------------------------------------------------------------
 	''')
 	sys.exit()
 
-def tshark_analysis(work_queue):
+def engine_stats_callback(work_queue, worker_id=None):
+	"""
+	采集引擎运行统计的回调：多进程采集时经跨进程队列发往主进程，否则直接保存；未启用指标和统计输出时不统计
+	"""
+	if not metrics_listen and not stat_interval:
+		return None
+	if worker_id is not None:
+		return work_queue.publish_stats
+	return lambda stats: engine_stats.__setitem__('0', stats)
 
-	shark_obj = tcp_http_shark(work_queue, interface, custom_tag, return_deep_info, http_filter, cache_size, session_size, bpf_filter, timeout, debug)
-	shark_obj.run()
+def worker_snapshot_path(worker_id):
+	"""
+	采集进程的去重缓存快照文件：多进程采集时每个进程使用各自的快照文件（<快照文件>.<进程编号>），未指定 -k 时不使用快照
+	"""
+	if not snapshot_file:
+		return ''
+	if worker_id is None:
+		return snapshot_file
+	return '{}.{}'.format(snapshot_file, worker_id)
 
-def pcap_analysis(work_queue):
-	pcap_obj = tcp_http_pcap(int(max_queue_size), work_queue, interface, custom_tag, return_deep_info, http_filter, cache_size, session_size, bpf_filter, timeout, debug)
-	pcap_obj.run()
+def worker_args(worker_id):
+	"""
+	采集进程的 BPF 过滤器和快照文件：多进程采集时 TSHARK/FIELDS 引擎按流哈希分区
+	"""
+	worker_snapshot_file = worker_snapshot_path(worker_id)
+	if worker_id is None:
+		return bpf_filter, worker_snapshot_file
+	if engine in ('PCAP', 'RING'):
+		return bpf_filter, worker_snapshot_file
+	worker_bpf_filter = partition_filter(bpf_filter, worker_id, capture_worker_num)
+	print('[*] Capture worker {}: {}'.format(worker_id, worker_bpf_filter))
+	return worker_bpf_filter, worker_snapshot_file
+
+def tshark_analysis(work_queue, worker_id=None):
+	worker_bpf_filter, worker_snapshot_file = worker_args(worker_id)
+	shark_obj = tcp_http_shark(work_queue, interface, custom_tag, return_deep_info, http_filter, cache_size, session_size, worker_bpf_filter, timeout, debug, dedup_mode=dedup_mode, dedup_fpr=dedup_fpr, snapshot_file=worker_snapshot_file or None, snapshot_interval=snapshot_interval, max_queue_size=int(max_queue_size), load_shed=load_shed == 'on', stats_callback=engine_stats_callback(work_queue, worker_id), trace_interval=trace_interval)
+	try:
+		shark_obj.run()
+	finally:
+		shark_obj.save_snapshot()
+
+def fields_analysis(work_queue, worker_id=None):
+	worker_bpf_filter, worker_snapshot_file = worker_args(worker_id)
+	fields_obj = tcp_http_fields(work_queue, interface, custom_tag, return_deep_info, http_filter, cache_size, session_size, worker_bpf_filter, timeout, debug, dedup_mode=dedup_mode, dedup_fpr=dedup_fpr, snapshot_file=worker_snapshot_file or None, snapshot_interval=snapshot_interval, max_queue_size=int(max_queue_size), load_shed=load_shed == 'on', stats_callback=engine_stats_callback(work_queue, worker_id), trace_interval=trace_interval)
+	try:
+		fields_obj.run()
+	finally:
+		fields_obj.save_snapshot()
+
+def pcap_analysis(work_queue, fanout_id=None, worker_id=None):
+	worker_bpf_filter, worker_snapshot_file = worker_args(worker_id)
+	pcap_obj = tcp_http_pcap(int(max_queue_size), work_queue, interface, custom_tag, return_deep_info, http_filter, cache_size, session_size, worker_bpf_filter, timeout, debug, fanout_id, body_worker_num=body_worker_num, max_body_size=max_body_size, reassembly_size=reassembly_size*1024, reassembly_budget=reassembly_budget*1024*1024, dedup_mode=dedup_mode, dedup_fpr=dedup_fpr, snapshot_file=worker_snapshot_file or None, snapshot_interval=snapshot_interval, memory_budget=memory_budget*1024*1024, load_shed=load_shed == 'on', stats_callback=engine_stats_callback(work_queue, worker_id), trace_interval=trace_interval, adaptive_top=adaptive_top, ring_size=ring_size*1024*1024 if engine == 'RING' else 0, ring_timeout=ring_timeout, batch_size=batch_size)
+	try:
+		pcap_obj.run()
+	finally:
+		pcap_obj.save_snapshot()
+
+def replay_analysis(work_queue):
+	# 离线回放不启用过载丢弃（-O）：未指定接收服务器时没有发送线程消费队列，丢弃会去除 body 并影响回放速率统计
+	if engine in ('PCAP', 'RING'):
+		engine_obj = tcp_http_pcap(int(max_queue_size), work_queue, interface, custom_tag, return_deep_info, http_filter, cache_size, session_size, bpf_filter, timeout, debug, input_file=input_file, body_worker_num=body_worker_num, max_body_size=max_body_size, reassembly_size=reassembly_size*1024, reassembly_budget=reassembly_budget*1024*1024, dedup_mode=dedup_mode, dedup_fpr=dedup_fpr, memory_budget=memory_budget*1024*1024, load_shed=False, batch_size=batch_size)
+	elif engine == 'FIELDS':
+		engine_obj = tcp_http_fields(work_queue, interface, custom_tag, return_deep_info, http_filter, cache_size, session_size, bpf_filter, timeout, debug, input_file=input_file, dedup_mode=dedup_mode, dedup_fpr=dedup_fpr, load_shed=False)
+	else:
+		engine_obj = tcp_http_shark(work_queue, interface, custom_tag, return_deep_info, http_filter, cache_size, session_size, bpf_filter, timeout, debug, input_file=input_file, display_filter=display_filter, dedup_mode=dedup_mode, dedup_fpr=dedup_fpr, load_shed=False)
+	run_replay(engine_obj, engine)
+
+def capture_worker(mp_queue, fanout_id, worker_id):
+	# 子进程独享 tcp_cache/http_cache/会话缓存，结果汇总到主进程发送
+	if engine in ('PCAP', 'RING'):
+		pcap_analysis(worker_queue(mp_queue, worker_id), fanout_id, worker_id)
+	elif engine == 'TSHARK':
+		tshark_analysis(worker_queue(mp_queue, worker_id), worker_id)
+	elif engine == 'FIELDS':
+		fields_analysis(worker_queue(mp_queue, worker_id), worker_id)
+
+def capture_workers_start(mp_queue):
+	"""
+	启动多个采集进程：PCAP/RING 引擎通过 AF_PACKET fanout 分流，TSHARK/FIELDS 引擎各自启动 tshark 并按 BPF 流哈希分区
+	"""
+	fanout_id = os.getpid() & 0xffff
+	workers = []
+	for i in range(capture_worker_num):
+		worker = multiprocessing.Process(target=capture_worker, args=(mp_queue, fanout_id, i))
+		worker.daemon = True
+		worker.start()
+		workers.append(worker)
+	return workers
+
+# 线程CPU耗时，time.thread_time 需要 Python 3.7，更早的版本退化为整个进程的CPU耗时
+thread_time = getattr(time, 'thread_time', time.process_time)
 
 class thread_msg_send(threading.Thread):
-	def __init__(self, work_queue, msg_send_mode):
+	def __init__(self, work_queue, msg_send_mode, tracer=None):
 
 		threading.Thread.__init__(self)
 		self.work_queue = work_queue
 		self.msg_send_mode = msg_send_mode
+		self.tracer = tracer
 		self.msg_obj = self.msg_obj_fun(self.msg_send_mode)
+		# 发送统计：消息数、批次数、发送耗时、空闲等待耗时、线程CPU耗时
+		self.msg_num = 0
+		self.batch_num = 0
+		self.send_time = 0.0
+		self.idle_time = 0.0
+		self.cpu_time = 0.0
 
 	def msg_obj_fun(self, msg_send_mode):
 		if msg_send_mode == "TCP":
 			msg_obj = _tcp_msg_send(server_ip,server_port)
 		elif msg_send_mode == "HTTP":
 			http_url = "http://{}:{}/".format(server_ip,server_port)
-			msg_obj = _http_msg_send(http_url)
+			msg_obj = _http_msg_send(http_url, http_gzip)
 		elif msg_send_mode == "SYSLOG":
 			msg_obj = _syslog_msg_send(server_ip,server_port)
+		elif msg_send_mode == "SYSLOG_TCP":
+			msg_obj = _syslog_msg_send(server_ip,server_port,'TCP')
 		else:
 			msg_obj = ''
 		return msg_obj
 
 	def run(self):
-		tcp_flag = True if self.msg_obj else False
-		# total_msg_num = 0
 		while True:
-			# start = time.time()
-			if not tcp_flag:
-				self.msg_obj = self.msg_obj_fun(self.msg_send_mode)
-			if len(self.work_queue):
-				result = self.work_queue.popleft()
-				if msg_send_mode == "TCP":
-					tcp_flag = self.msg_obj.info(result)
-					# total_msg_num += 1
-					# if total_msg_num%100 == 0:
-						# end = time.time()
-						# print("Used Time: %s"%(end - start))
-				else:
-					self.msg_obj.info(result)
+			wait_start = time.time()
+			# 队列为空时阻塞休眠，不再空转占用CPU和GIL
+			result = self.work_queue.get_batch()
+			send_start = time.time()
+			self.idle_time += send_start - wait_start
+			if not result:
+				continue
+			# TCP 模式断线重连和缓冲由发送对象自身处理；发送失败（接收端不可用）时不再取出新的批次，
+			# 按退避时间重试直到恢复，数据积压在发送队列和磁盘溢出缓冲区中，不在发送对象的缓冲区中被丢弃
+			if not self.msg_obj.batch(result):
+				while not self.msg_obj.flush():
+					pass
+			send_end = time.time()
+			self.send_time += send_end - send_start
+			if self.tracer is not None:
+				self.tracer.record(result, send_start, send_end)
+			self.msg_num += len(result)
+			self.batch_num += 1
+			self.cpu_time = thread_time()
+
+	def get_stats(self):
+		stats = {
+			'msg': self.msg_num,
+			'batch': self.batch_num,
+			'send_time': round(self.send_time, 3),
+			'idle_time': round(self.idle_time, 3),
+			'cpu_time': round(self.cpu_time, 3)
+		}
+		if hasattr(self.msg_obj, 'get_stats'):
+			stats.update(self.msg_obj.get_stats())
+		return stats
+
+def thread_stat_report(msg_thread_list, work_queue, registry):
+	"""
+	定期输出各发送线程的吞吐量和空闲占比，用于评估 msg_send_thread_num 的取值
+	"""
+	last_msg_num = [0] * len(msg_thread_list)
+	while True:
+		time.sleep(stat_interval)
+		for i, msg_thread_obj in enumerate(msg_thread_list):
+			msg_num = msg_thread_obj.msg_num
+			total_time = msg_thread_obj.send_time + msg_thread_obj.idle_time
+			idle_rate = msg_thread_obj.idle_time * 100 / total_time if total_time else 100
+			print('[*] sender-{}: {:.1f} msg/s, total: {}, batches: {}, idle: {:.1f}%, cpu: {:.2f}s, queue: {}'.format(
+				i, (msg_num - last_msg_num[i]) / stat_interval, msg_num, msg_thread_obj.batch_num,
+				idle_rate, msg_thread_obj.cpu_time, len(work_queue)))
+			if hasattr(msg_thread_obj.msg_obj, 'get_stats'):
+				print('[*] sender-{}: {}'.format(i, msg_thread_obj.msg_obj.get_stats()))
+			last_msg_num[i] = msg_num
+		registry.log(['engine', 'forward', 'queue', 'latency'])
 
 	
 if __name__ == '__main__':
@@ -136,10 +347,10 @@ if __name__ == '__main__':
 	# check_lock()
 
 	try:
-		opts,args = getopt.getopt(sys.argv[1:],'i: s: p: d: t: r: c: T: S:')
+		opts,args = getopt.getopt(sys.argv[1:],'i: s: p: d: t: r: c: T: S: w: n: b: B: I: m: z: e: f: W: L: R: G: D: P: k: K: M: q: Q: O: l: a: A: y: Y: N:')
 	except:
 		Usage()
-	if len(opts) < 3:
+	if len(opts) < 3 and '-f' not in [o for o, a in opts]:
 		Usage()
 
 	for o, a in opts:
@@ -167,8 +378,75 @@ if __name__ == '__main__':
 				session_size = 1024
 		if o == '-T':
 			timeout = int(a)
+		if o == '-w':
+			capture_worker_num = max(int(a), 1)
+		if o == '-n':
+			msg_send_thread_num = max(int(a), 1)
+		if o == '-b':
+			msg_batch_size = max(int(a), 1)
+		if o == '-B':
+			msg_batch_wait = int(a)
+		if o == '-I':
+			stat_interval = int(a)
+		if o == '-m':
+			msg_send_mode = str(a).upper()
+		if o == '-z':
+			if str(a) == 'on':
+				http_gzip = True
+		if o == '-e':
+			engine = str(a).upper()
+		if o == '-f':
+			input_file = str(a)
+		if o == '-W':
+			body_worker_num = int(a)
+		if o == '-L':
+			max_body_size = int(a)
+			# 解压输出上限为0时 zlib 不限制输出长度
+			if max_body_size < 1:
+				print('[!] -L must be at least 1 byte')
+				sys.exit(1)
+		if o == '-R':
+			reassembly_size = int(a)
+		if o == '-G':
+			reassembly_budget = max(int(a), 1)
+		if o == '-D':
+			dedup_mode = str(a).lower()
+		if o == '-P':
+			dedup_fpr = min(max(float(a), 1e-9), 0.5)
+		if o == '-k':
+			snapshot_file = str(a)
+		if o == '-K':
+			snapshot_interval = max(int(a), 1)
+		if o == '-M':
+			memory_budget = int(a)
+		if o == '-q':
+			spill_dir = str(a)
+		if o == '-Q':
+			spill_size = max(int(a), 1)
+		if o == '-O':
+			load_shed = str(a)
+		if o == '-l':
+			metrics_listen = str(a)
+		if o == '-a':
+			trace_interval = max(float(a), 0)
+		if o == '-A':
+			adaptive_top = max(int(a), 0)
+		if o == '-y':
+			ring_size = max(int(a), 2)
+		if o == '-Y':
+			ring_timeout = max(int(a), 1)
+		if o == '-N':
+			batch_size = max(int(a), 0)
+			if 0 < batch_size < MIN_BATCH_SIZE:
+				print('[!] Batch size {} is below the break-even point, using {}'.format(batch_size, MIN_BATCH_SIZE))
+				batch_size = MIN_BATCH_SIZE
+
+	# TSHARK/FIELDS 引擎的内存主要是 tshark 进程中的会话与重组状态，不受 -M 限制，只能依靠定期重启释放
+	if timeout <= 0 and engine in ('TSHARK', 'FIELDS') and not input_file:
+		print('[!] -T 0 is only supported by the PCAP/RING engines (bounded by -M), {} needs a periodic restart'.format(engine))
+		sys.exit(1)
 
-	if interface and server_ip and server_port:
+	if input_file or (interface and server_ip and server_port):
 		# 接受通过环境变量传入的过滤设置
 		if 'http_filter_code' in os.environ:
 			http_filter['response_code'] = list(set(filter(None, os.environ["http_filter_code"].replace(" ","").split(","))))
@@ -176,24 +454,72 @@ if __name__ == '__main__':
 			http_filter['content_type'] = list(set(filter(None, os.environ["http_filter_type"].replace(" ","").split(","))))
 		bpf_filter += ' and not (host {} and port {}) and not (host 127.0.0.1 or host localhost) '.format(server_ip,server_port)
 
+		if snapshot_file:
+			# docker stop 等发送的 SIGTERM 转为正常退出，退出前写入去重缓存快照（采集子进程继承该处理）
+			signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
 		try:
-			# work_queue = queue.LifoQueue(max_queue_size)
-			work_queue = collections.deque(maxlen=int(max_queue_size))
+			spill = spill_ring(spill_dir, spill_size * 1024 * 1024) if spill_dir else None
+			work_queue = msg_queue(int(max_queue_size), msg_batch_size, msg_batch_wait / 1000.0, spill)
+
+			# 多进程采集需在发送线程启动前 fork 子进程
+			workers = []
+			forward_thread_obj = None
+			if capture_worker_num > 1 and not input_file:
+				mp_queue = multiprocessing.Queue(int(max_queue_size))
+				workers = capture_workers_start(mp_queue)
+				# 同一服务的不同会话可能分到不同进程，汇总时再跨进程去重
+				dedup = forward_dedup(cache_size, dedup_mode, dedup_fpr) if cache_size else None
+				forward_thread_obj = worker_forward(mp_queue, work_queue, load_shed == 'on', engine_stats, dedup)
+				forward_thread_obj.setDaemon(True)
+				forward_thread_obj.start()
 			
+			if not msg_send_thread_num:
+				msg_send_thread_num = 1 if msg_send_mode in ('TCP', 'SYSLOG_TCP') else 10
+			tracer = latency_tracer() if trace_interval > 0 else None
+			msg_thread_list = []
+			# 离线回放未指定接收服务器时只执行解析流程，不发送数据
+			if input_file and not ('-s' in [o for o, a in opts] and '-p' in [o for o, a in opts]):
+				msg_send_thread_num = 0
 			for i in range(msg_send_thread_num):
-				msg_thread_obj = thread_msg_send(work_queue, msg_send_mode)
+				msg_thread_obj = thread_msg_send(work_queue, msg_send_mode, tracer)
 				msg_thread_obj.setDaemon(True)
 				msg_thread_obj.start()
+				msg_thread_list.append(msg_thread_obj)
+
+			registry = metrics_registry()
+			registry.register('engine', lambda: dict(engine_stats), 'worker')
+			registry.register('queue', work_queue.get_stats)
+			registry.register('sender', lambda: dict((str(i), msg_thread_obj.get_stats()) for i, msg_thread_obj in enumerate(msg_thread_list)), 'sender')
+			if forward_thread_obj is not None:
+				registry.register('forward', forward_thread_obj.get_stats)
+			if tracer is not None:
+				registry.register('latency', tracer.get_stats)
+			if metrics_listen:
+				start_metrics_server(registry, metrics_listen)
+
+			if stat_interval > 0:
+				stat_thread_obj = threading.Thread(target=thread_stat_report, args=(msg_thread_list, work_queue, registry))
+				stat_thread_obj.setDaemon(True)
+				stat_thread_obj.start()
 
-			if engine == 'PCAP':
+			if input_file:
+				replay_analysis(work_queue)
+			elif workers:
+				for worker in workers:
+					worker.join()
+			elif engine in ('PCAP', 'RING'):
 				pcap_analysis(work_queue)
 			elif engine == 'TSHARK':
 				tshark_analysis(work_queue)
+			elif engine == 'FIELDS':
+				fields_analysis(work_queue)
 
 		except KeyboardInterrupt:
 			print('\nExit.')
 			os.kill(os.getpid(),signal.SIGKILL)
-		except :
+		# SIGTERM 转换的 SystemExit 为正常退出，不输出异常信息
+		except Exception:
 			traceback.print_exc()
 	else:
 		Usage()
\ No newline at end of file